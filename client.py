@@ -2,6 +2,7 @@
 """
 간단한 3D Scene Generation 클라이언트
 사용법: python client.py "input_prompt" "save_dir" [iterations] [server_url]
+배치: python client.py --batch descriptors.txt "save_dir"  (한 줄에 씬 설명 하나)
 """
 
 import sys
@@ -9,6 +10,8 @@ import requests
 import time
 import os
 import argparse
+import json
+import uuid
 from pathlib import Path
 
 
@@ -33,21 +36,43 @@ class SceneGenerationClient:
             print(f"❌ API 키 설정 중 오류: {e}")
             return False
     
-    def generate_scene(self, scene_descriptor, iterations=300):
-        """씬 생성 요청"""
+    def generate_scene(self, scene_descriptor, iterations=300, max_retries=3, time_budget=None):
+        """씬 생성 요청 (타임아웃 시 같은 Idempotency-Key 로 재시도하므로 작업이 중복 생성되지 않음)
+
+        time_budget(초)을 주면 배치 최적화를 그 시간 안에 끝내고 그때까지 찾은 가장 좋은 배치를 사용한다.
+        """
+        idempotency_key = str(uuid.uuid4())
         try:
-            response = requests.post(
-                f"{self.server_url}/api/generate-scene",
-                json={
-                    "scene_descriptor": scene_descriptor,
-                    "iterations": iterations
-                }
-            )
+            for attempt in range(max_retries + 1):
+                try:
+                    response = requests.post(
+                        f"{self.server_url}/api/generate-scene",
+                        json={
+                            "scene_descriptor": scene_descriptor,
+                            "iterations": iterations,
+                            "time_budget": time_budget
+                        },
+                        headers={"Idempotency-Key": idempotency_key},
+                        timeout=30
+                    )
+                    break
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    if attempt == max_retries:
+                        raise
+                    print(f"⚠️ 요청 실패 ({e}), 재시도 {attempt + 1}/{max_retries}")
+                    time.sleep(2 ** attempt)
             
             if response.status_code == 200:
                 data = response.json()
-                print(f"🚀 씬 생성 요청이 접수되었습니다. Task ID: {data['task_id']}")
+                if data.get('cached'):
+                    print(f"⚡ 캐시된 결과가 있습니다. Task ID: {data['task_id']}")
+                else:
+                    print(f"🚀 씬 생성 요청이 접수되었습니다. Task ID: {data['task_id']}")
                 return data['task_id']
+            elif response.status_code == 429:
+                retry_after = response.headers.get('Retry-After', '?')
+                print(f"⏸️ 서버 대기열이 가득 찼습니다. {retry_after}초 후 다시 시도하세요.")
+                return None
             else:
                 error_msg = response.json().get('detail', '알 수 없는 오류')
                 print(f"❌ 씬 생성 요청 실패: {error_msg}")
@@ -57,41 +82,207 @@ class SceneGenerationClient:
             print(f"❌ 요청 중 오류 발생: {e}")
             return None
     
+    def generate_scenes(self, scene_descriptors, iterations=300, max_retries=3, time_budget=None):
+        """여러 씬을 한 번에 요청. 배치 ID 반환 (재시도해도 같은 Idempotency-Key 로 중복 생성 방지)"""
+        idempotency_key = str(uuid.uuid4())
+        try:
+            for attempt in range(max_retries + 1):
+                try:
+                    response = requests.post(
+                        f"{self.server_url}/api/generate-scenes",
+                        json={
+                            "scene_descriptors": scene_descriptors,
+                            "iterations": iterations,
+                            "time_budget": time_budget
+                        },
+                        headers={"Idempotency-Key": idempotency_key},
+                        timeout=120
+                    )
+                    break
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    if attempt == max_retries:
+                        raise
+                    print(f"⚠️ 요청 실패 ({e}), 재시도 {attempt + 1}/{max_retries}")
+                    time.sleep(2 ** attempt)
+            
+            if response.status_code == 200:
+                data = response.json()
+                print(f"🚀 배치 요청이 접수되었습니다. Batch ID: {data['batch_id']} ({data['total']}개 씬)")
+                return data['batch_id']
+            else:
+                error_msg = response.json().get('detail', '알 수 없는 오류')
+                print(f"❌ 배치 요청 실패: {error_msg}")
+                return None
+        
+        except Exception as e:
+            print(f"❌ 요청 중 오류 발생: {e}")
+            return None
+    
+    def wait_for_batch(self, batch_id, check_interval=10):
+        """배치의 모든 작업이 끝날 때까지 대기. 완료된 씬이 하나라도 있으면 True"""
+        print("⏳ 배치 처리 중...")
+        while True:
+            try:
+                response = requests.get(f"{self.server_url}/api/batches/{batch_id}", timeout=30)
+                if response.status_code != 200:
+                    print(f"❌ 배치 상태 확인 실패: HTTP {response.status_code}")
+                    return False
+                
+                data = response.json()
+                counts = data['counts']
+                print(f"📊 진행률: {data['progress']}% (완료 {counts['completed']}, 실패 {counts['failed']}, "
+                      f"실행 중 {counts['processing']}, 대기 {counts['queued']} / 전체 {data['total']})")
+                if data['status'] == 'completed':
+                    for item in data['items']:
+                        if item['status'] == 'failed':
+                            print(f"  ❌ #{item['index']} {item['scene_descriptor']}: {item.get('error', '알 수 없는 오류')}")
+                    return counts['completed'] > 0
+                time.sleep(check_interval)
+            
+            except Exception as e:
+                print(f"❌ 배치 상태 확인 중 오류: {e}")
+                time.sleep(check_interval)
+    
+    def cancel_batch(self, batch_id):
+        """배치에서 끝나지 않은 작업을 모두 취소"""
+        try:
+            response = requests.delete(f"{self.server_url}/api/batches/{batch_id}", timeout=30)
+            if response.status_code == 200:
+                print(f"🛑 배치 취소 요청 완료: {response.json()['cancelled']}개 작업")
+                return True
+            else:
+                print(f"❌ 배치 취소 실패: {response.json().get('detail', '알 수 없는 오류')}")
+                return False
+        except Exception as e:
+            print(f"❌ 배치 취소 중 오류: {e}")
+            return False
+    
+    def download_batch(self, batch_id, save_path, partial=True):
+        """완료된 GLB 들과 manifest.json 을 담은 zip 다운로드"""
+        try:
+            Path(save_path).parent.mkdir(parents=True, exist_ok=True)
+            print(f"📁 배치 결과 다운로드 중...")
+            response = requests.get(
+                f"{self.server_url}/api/batches/{batch_id}/download",
+                params={"partial": str(partial).lower()},
+                stream=True,
+                timeout=300
+            )
+            if response.status_code != 200:
+                print(f"❌ 배치 다운로드 실패: HTTP {response.status_code}")
+                return False
+            
+            part_path = f"{save_path}.part"
+            with open(part_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    f.write(chunk)
+            os.replace(part_path, save_path)
+            print(f"✅ 파일이 성공적으로 저장되었습니다: {save_path}")
+            return True
+        
+        except Exception as e:
+            print(f"❌ 배치 다운로드 중 오류: {e}")
+            return False
+    
     def wait_for_completion(self, task_id, check_interval=10):
-        """작업 완료까지 대기"""
+        """작업 완료까지 대기 (서버 이벤트 스트림 구독, 실패 시 주기적 상태 확인)"""
         print("⏳ 씬 생성 중...")
         
+        result = self._stream_events(task_id)
+        if result is not None:
+            return result
+        return self._poll_status(task_id, check_interval)
+    
+    def _print_status(self, data):
+        """status 응답 / status 이벤트 출력. 완료면 True, 실패면 False, 진행 중이면 None"""
+        status = data['status']
+        print(f"📊 상태: {status}")
+        
+        # 대기열 정보 출력
+        if status == 'queued' and 'queue_position' in data:
+            print(f"  ⏳ 대기 순번: {data['queue_position']}, 예상 시작: {data.get('estimated_start_time', '알 수 없음')}")
+        
+        # 단계별 상세 정보 출력
+        if 'steps' in data:
+            for step_name, step_info in data['steps'].items():
+                self._print_step(step_name, step_info)
+        
+        if status == 'completed':
+            print("🎉 씬 생성이 완료되었습니다!")
+            return True
+        elif status == 'failed':
+            error_msg = data.get('error', '알 수 없는 오류')
+            print(f"❌ 씬 생성 실패: {error_msg}")
+            return False
+        elif status == 'cancelled':
+            print("🛑 작업이 취소되었습니다.")
+            return False
+        return None
+    
+    def _print_step(self, step_name, step_info):
+        step_status = step_info['status']
+        step_progress = step_info.get('progress', 0)
+        step_message = step_info.get('message', '')
+        
+        if step_status == 'processing':
+            detail = ""
+            if step_info.get('best_cost') is not None:
+                detail = f", iteration {step_info.get('iteration')}, best cost {step_info['best_cost']:.4f}"
+            print(f"  🔄 {step_name}: {step_message} ({step_progress}%{detail})")
+        elif step_status == 'completed':
+            print(f"  ✅ {step_name}: 완료")
+        elif step_status == 'failed':
+            print(f"  ❌ {step_name}: 실패 - {step_message}")
+    
+    def _stream_events(self, task_id):
+        """SSE 스트림으로 진행 상황 수신. 스트림을 쓸 수 없으면 None"""
+        try:
+            response = requests.get(
+                f"{self.server_url}/api/tasks/{task_id}/events",
+                stream=True,
+                timeout=(10, 60),  # 서버가 15초마다 keep-alive 를 보냄
+                headers={"Accept": "text/event-stream"}
+            )
+            if response.status_code != 200:
+                return None
+            
+            event_name, data_lines = None, []
+            for line in response.iter_lines(decode_unicode=True):
+                if line is None:
+                    continue
+                if line.startswith(':'):
+                    continue  # keep-alive
+                if line.startswith('event:'):
+                    event_name = line[len('event:'):].strip()
+                elif line.startswith('data:'):
+                    data_lines.append(line[len('data:'):].strip())
+                elif line == '' and event_name:
+                    data = json.loads("\n".join(data_lines)) if data_lines else {}
+                    if event_name == 'progress':
+                        self._print_step(data['stage'], data)
+                    elif event_name == 'status':
+                        result = self._print_status(data)
+                        if result is not None:
+                            return result
+                    elif event_name == 'end':
+                        return data.get('status') == 'completed'
+                    event_name, data_lines = None, []
+            return None
+        
+        except Exception as e:
+            print(f"⚠️ 이벤트 스트림 연결 실패 ({e}), 주기적 상태 확인으로 전환합니다.")
+            return None
+    
+    def _poll_status(self, task_id, check_interval=10):
+        """이벤트 스트림을 쓸 수 없을 때 주기적으로 상태 확인"""
         while True:
             try:
                 response = requests.get(f"{self.server_url}/api/status/{task_id}")
                 
                 if response.status_code == 200:
-                    data = response.json()
-                    status = data['status']
-                    
-                    print(f"📊 상태: {status}")
-                    
-                    # 단계별 상세 정보 출력
-                    if 'steps' in data:
-                        for step_name, step_info in data['steps'].items():
-                            step_status = step_info['status']
-                            step_progress = step_info['progress']
-                            step_message = step_info['message']
-                            
-                            if step_status == 'processing':
-                                print(f"  🔄 {step_name}: {step_message} ({step_progress}%)")
-                            elif step_status == 'completed':
-                                print(f"  ✅ {step_name}: 완료")
-                            elif step_status == 'failed':
-                                print(f"  ❌ {step_name}: 실패 - {step_message}")
-                    
-                    if status == 'completed':
-                        print("🎉 씬 생성이 완료되었습니다!")
-                        return True
-                    elif status == 'failed':
-                        error_msg = data.get('error', '알 수 없는 오류')
-                        print(f"❌ 씬 생성 실패: {error_msg}")
-                        return False
+                    result = self._print_status(response.json())
+                    if result is not None:
+                        return result
                     
                     time.sleep(check_interval)
                 else:
@@ -102,26 +293,62 @@ class SceneGenerationClient:
                 print(f"❌ 상태 확인 중 오류: {e}")
                 time.sleep(check_interval)
     
-    def download_file(self, task_id, save_path):
-        """GLB 파일 다운로드"""
+    def cancel_task(self, task_id):
+        """작업 취소 (실행 중이면 서버가 파이프라인을 종료하고 중간 결과를 삭제)"""
+        try:
+            response = requests.delete(f"{self.server_url}/api/tasks/{task_id}", timeout=30)
+            if response.status_code == 200:
+                print(f"🛑 작업 취소 요청 완료: {task_id}")
+                return True
+            else:
+                print(f"❌ 작업 취소 실패: {response.json().get('detail', '알 수 없는 오류')}")
+                return False
+        except Exception as e:
+            print(f"❌ 작업 취소 중 오류: {e}")
+            return False
+    
+    def download_file(self, task_id, save_path, max_retries=3):
+        """GLB 파일 다운로드 (연결이 끊기면 Range 요청으로 이어받기)"""
         try:
             # 저장 디렉토리 생성
             save_dir = Path(save_path).parent
             save_dir.mkdir(parents=True, exist_ok=True)
             
             print(f"📁 파일 다운로드 중...")
-            response = requests.get(f"{self.server_url}/download/{task_id}", stream=True)
+            part_path = f"{save_path}.part"
+            etag = None
+            if os.path.exists(part_path):
+                os.remove(part_path)
             
-            if response.status_code == 200:
-                with open(save_path, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        f.write(chunk)
+            for attempt in range(max_retries + 1):
+                offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+                headers = {}
+                if offset and etag:
+                    headers = {"Range": f"bytes={offset}-", "If-Range": etag}
                 
-                print(f"✅ 파일이 성공적으로 저장되었습니다: {save_path}")
-                return True
-            else:
-                print(f"❌ 파일 다운로드 실패: HTTP {response.status_code}")
-                return False
+                try:
+                    response = requests.get(f"{self.server_url}/download/{task_id}", headers=headers, stream=True, timeout=60)
+                    
+                    if response.status_code not in (200, 206):
+                        print(f"❌ 파일 다운로드 실패: HTTP {response.status_code}")
+                        return False
+                    
+                    etag = response.headers.get("ETag")
+                    # 206 이면 이어쓰기, 200 이면 (파일이 바뀌었거나 처음) 처음부터
+                    mode = 'ab' if response.status_code == 206 else 'wb'
+                    with open(part_path, mode) as f:
+                        for chunk in response.iter_content(chunk_size=1024 * 1024):
+                            f.write(chunk)
+                    
+                    os.replace(part_path, save_path)
+                    print(f"✅ 파일이 성공적으로 저장되었습니다: {save_path}")
+                    return True
+                
+                except requests.exceptions.RequestException as e:
+                    if attempt == max_retries:
+                        raise
+                    print(f"⚠️ 다운로드가 중단되었습니다 ({e}). 이어받기 재시도 {attempt + 1}/{max_retries}")
+                    time.sleep(2)
                 
         except Exception as e:
             print(f"❌ 파일 다운로드 중 오류: {e}")
@@ -147,14 +374,48 @@ class SceneGenerationClient:
             return False
 
 
+def run_batch(client, args):
+    """--batch: 파일의 씬 설명들을 한 번에 요청하고 zip 으로 받기"""
+    with open(args.input_prompt, 'r', encoding='utf-8') as f:
+        descriptors = [line.strip() for line in f if line.strip()]
+    if not descriptors:
+        print("❌ 씬 설명이 없습니다.")
+        sys.exit(1)
+    
+    batch_id = client.generate_scenes(descriptors, args.iterations, time_budget=args.time_budget)
+    if not batch_id:
+        print("❌ 배치 요청에 실패했습니다.")
+        sys.exit(1)
+    
+    # 완료 대기 (Ctrl+C 로 중단하면 서버의 작업도 취소)
+    try:
+        completed = client.wait_for_batch(batch_id, args.check_interval)
+    except KeyboardInterrupt:
+        client.cancel_batch(batch_id)
+        sys.exit(1)
+    if not completed:
+        print("❌ 완료된 씬이 없습니다.")
+        sys.exit(1)
+    
+    save_path = Path(args.save_dir) / f"scenes_{batch_id}.zip"
+    if client.download_batch(batch_id, save_path):
+        print(f"🎉 모든 작업이 완료되었습니다!")
+        print(f"📁 zip 파일 위치: {save_path} (manifest.json 에 항목별 결과)")
+    else:
+        print("❌ 파일 다운로드에 실패했습니다.")
+        sys.exit(1)
+
+
 def main():
     parser = argparse.ArgumentParser(description='3D Scene Generation Client')
-    parser.add_argument('input_prompt', help='씬 설명 텍스트')
+    parser.add_argument('input_prompt', help='씬 설명 텍스트 (--batch 이면 씬 설명 파일 경로)')
     parser.add_argument('save_dir', help='GLB 파일 저장 경로')
     parser.add_argument('--iterations', type=int, default=300, help='반복 횟수 (기본값: 300)')
+    parser.add_argument('--time-budget', type=float, default=None, help='배치 최적화 시간 예산 (초, 기본값: 서버 설정)')
     parser.add_argument('--server-url', default=os.getenv('SCENE_SERVER_URL', 'http://localhost:8000'), help='서버 URL')
     parser.add_argument('--api-key', default=os.getenv('OPENAI_API_KEY'), help='OpenAI API 키')
     parser.add_argument('--check-interval', type=int, default=10, help='상태 확인 간격 (초, 기본값: 10)')
+    parser.add_argument('--batch', action='store_true', help='input_prompt 파일의 각 줄을 하나의 씬으로 배치 요청')
     
     args = parser.parse_args()
     
@@ -180,14 +441,23 @@ def main():
             print("❌ API 키 설정에 실패했습니다.")
             sys.exit(1)
     
+    if args.batch:
+        run_batch(client, args)
+        return
+    
     # 씬 생성 요청
-    task_id = client.generate_scene(args.input_prompt, args.iterations)
+    task_id = client.generate_scene(args.input_prompt, args.iterations, time_budget=args.time_budget)
     if not task_id:
         print("❌ 씬 생성 요청에 실패했습니다.")
         sys.exit(1)
     
-    # 완료 대기
-    if not client.wait_for_completion(task_id, args.check_interval):
+    # 완료 대기 (Ctrl+C 로 중단하면 서버의 작업도 취소)
+    try:
+        completed = client.wait_for_completion(task_id, args.check_interval)
+    except KeyboardInterrupt:
+        client.cancel_task(task_id)
+        sys.exit(1)
+    if not completed:
         print("❌ 씬 생성에 실패했습니다.")
         sys.exit(1)
     
@@ -12,10 +12,12 @@ echo "==================="
 SCENE_DESCRIPTOR="$1"
 OUTPUT_BASE="$2"
 ITERATIONS="${3:-300}"  # 3번째 매개변수가 없으면 기본값 300
+SEED="$4"               # 4번째 매개변수: 최적화 random seed (선택)
+TIME_BUDGET="$5"        # 5번째 매개변수: 배치 최적화 시간 예산(초, 선택)
 
 # 매개변수 확인
 if [ -z "$SCENE_DESCRIPTOR" ] || [ -z "$OUTPUT_BASE" ]; then
-    echo "사용법: $0 <scene_descriptor> <output_base> [iterations]"
+    echo "사용법: $0 <scene_descriptor> <output_base> [iterations] [seed] [time_budget]"
     exit 1
 fi
 
@@ -52,83 +54,120 @@ mkdir -p "$OUTPUT_BASE"
 OUTPUT_BASE_ABS="$(readlink -f "$OUTPUT_BASE")"
 echo "출력 경로 (절대): $OUTPUT_BASE_ABS"
 
+# 단계별 checkpoint. 같은 출력 경로로 다시 실행하면 checkpoint 가 유효한 단계는 건너뛰고
+# 미완료 단계만 실행한다 (resume 이 실패하면 그 단계와 그에 의존하는 단계의 이전 출력은 삭제됨)
+CHECKPOINT=(python "$BASE_PATH/pipeline_checkpoint.py" --output "$OUTPUT_BASE_ABS"
+            --scene_descriptor "$SCENE_DESCRIPTOR" --iterations "$ITERATIONS" --seed "$SEED" --time_budget "$TIME_BUDGET")
+PROGRAM_DIR="$OUTPUT_BASE_ABS/Result_language"
+PROGRAM_FILE="$PROGRAM_DIR/program.json"
+
+# 중간에 실패해도 백그라운드의 배치 최적화는 끝까지 기다린다 (checkpoint 를 남겨 재시도 때 건너뛰도록)
+trap 'wait' EXIT
+
 # 1단계: Layout 및 공간 내 object text 생성
-echo "[1/4] Layout 및 object text 생성 중..."
+echo "[1/4] Layout 및 object text 생성 중 (language phase)..."
 
 cd "$BASE_PATH/Scene_Synthesis"
-python scene_synthesis.py --scene_descriptor "$SCENE_DESCRIPTOR" --save_path "$OUTPUT_BASE_ABS/Result_txt" --iterations $ITERATIONS
-
-if [ $? -eq 0 ]; then
-    echo "✓ Layout 생성 완료"
-    
-    # 생성된 파일들 확인
-    echo "=== 생성된 파일 확인 ==="
-    echo "Result_txt 디렉토리 내용:"
-    ls -la "$OUTPUT_BASE_ABS/Result_txt/" 2>/dev/null || echo "Result_txt 디렉토리 없음"
-    
-    LAYOUT_TXT="$OUTPUT_BASE_ABS/Result_txt/layout.txt"
-    if [ -f "$LAYOUT_TXT" ]; then
-        echo "layout.txt 파일 존재: YES"
-        LINE_COUNT=$(wc -l < "$LAYOUT_TXT")
-        echo "layout.txt 파일 크기: $LINE_COUNT lines"
-        echo "layout.txt 처음 5줄:"
-        head -5 "$LAYOUT_TXT"
-    else
-        echo "layout.txt 파일 존재: NO"
-    fi
-    echo "========================"
+if "${CHECKPOINT[@]}" resume language_phase; then
+    echo "✓ Language phase checkpoint 사용 (건너뜀)"
 else
-    echo "✗ Layout 생성 실패"
-    exit 1
+    STAGE_START=$(date +%s.%N)
+    python scene_synthesis.py --phase language --scene_descriptor "$SCENE_DESCRIPTOR" --program_dir "$PROGRAM_DIR"
+    "${CHECKPOINT[@]}" write language_phase --started_at "$STAGE_START"
 fi
 
-# 2단계: Object text를 기반으로 layout
-echo "[2/4] Text 기반 retrieval 수행 중..."
-
-# 경로 확인
-LAYOUT_FILE="$OUTPUT_BASE_ABS/Result_txt/layout.txt"
-echo "=== 2단계 경로 확인 ==="
-echo "Layout 파일 경로: $LAYOUT_FILE"
+if [ ! -f "$PROGRAM_FILE" ]; then
+    echo "✗ program.json 파일이 없어서 다음 단계를 진행할 수 없습니다."
+    exit 1
+fi
 
-if [ -f "$LAYOUT_FILE" ]; then
-    echo "파일 존재 여부: YES"
+# 배치 최적화는 retrieval 과 동시에 백그라운드에서 실행 (retrieval 은 언어 단계의 style 설명만 사용)
+OPTIMISE_PID=""
+if "${CHECKPOINT[@]}" resume scene_synthesis; then
+    echo "✓ Layout checkpoint 사용 (optimisation phase 건너뜀)"
 else
-    echo "파일 존재 여부: NO"
-    echo "✗ layout.txt 파일이 없어서 2단계를 진행할 수 없습니다."
-    exit 1
+    echo "[1/4] Layout 생성 중 (optimisation phase, 백그라운드)..."
+    (
+        STAGE_START=$(date +%s.%N)
+        OPTIMISE_ARGS=()
+        if [ -n "$SEED" ]; then
+            OPTIMISE_ARGS=(--seed "$SEED")
+        fi
+        if [ -n "$TIME_BUDGET" ]; then
+            OPTIMISE_ARGS+=(--time_budget "$TIME_BUDGET")
+        fi
+        python scene_synthesis.py --phase optimise --program_dir "$PROGRAM_DIR" --save_path "$OUTPUT_BASE_ABS/Result_txt" --iterations $ITERATIONS "${OPTIMISE_ARGS[@]}"
+
+        echo "✓ Layout 생성 완료"
+        
+        # 생성된 파일들 확인
+        echo "=== 생성된 파일 확인 ==="
+        echo "Result_txt 디렉토리 내용:"
+        ls -la "$OUTPUT_BASE_ABS/Result_txt/" 2>/dev/null || echo "Result_txt 디렉토리 없음"
+        
+        LAYOUT_JSON="$OUTPUT_BASE_ABS/Result_txt/layout.json"
+        if [ -f "$LAYOUT_JSON" ]; then
+            echo "layout.json 파일 존재: YES"
+            LINE_COUNT=$(wc -l < "$LAYOUT_JSON")
+            echo "layout.json 파일 크기: $LINE_COUNT lines"
+        else
+            echo "layout.json 파일 존재: NO"
+            exit 1
+        fi
+        echo "========================"
+        "${CHECKPOINT[@]}" write scene_synthesis --started_at "$STAGE_START"
+    ) &
+    OPTIMISE_PID=$!
 fi
-echo "====================="
 
-cd "$BASE_PATH/retrieval"
-python test_retrieval.py --layout_path "$LAYOUT_FILE" --output_dir "$OUTPUT_BASE_ABS/Result_retrieval/text_retrieval"
+# 2단계: Object text를 기반으로 layout
+echo "[2/4] Text 기반 retrieval 수행 중..."
 
-if [ $? -eq 0 ]; then
-    echo "✓ Text retrieval 완료"
+cd "$BASE_PATH/retrieval"
+if "${CHECKPOINT[@]}" resume text_retrieval; then
+    echo "✓ Text retrieval checkpoint 사용 (2단계 건너뜀)"
 else
-    echo "✗ Text retrieval 실패"
-    exit 1
+    STAGE_START=$(date +%s.%N)
+    python test_retrieval.py --layout_path "$PROGRAM_FILE" --output_dir "$OUTPUT_BASE_ABS/Result_retrieval/text_retrieval"
+    echo "✓ Text retrieval 완료"
+    "${CHECKPOINT[@]}" write text_retrieval --started_at "$STAGE_START"
 fi
 
 # 3단계: 1차 검색된 결과를 바탕으로 CLIP retrieval
 echo "[3/4] CLIP 기반 retrieval 수행 중..."
-python retrieval_clip.py --layout_path "$LAYOUT_FILE" --candidate_folder "$OUTPUT_BASE_ABS/Result_retrieval/text_retrieval" --output_dir "$OUTPUT_BASE_ABS/Result_retrieval/clip_retrieval"
-
-if [ $? -eq 0 ]; then
-    echo "✓ CLIP retrieval 완료"
+if "${CHECKPOINT[@]}" resume clip_retrieval; then
+    echo "✓ CLIP retrieval checkpoint 사용 (3단계 건너뜀)"
 else
-    echo "✗ CLIP retrieval 실패"
-    exit 1
+    STAGE_START=$(date +%s.%N)
+    python retrieval_clip.py --layout_path "$PROGRAM_FILE" --candidate_folder "$OUTPUT_BASE_ABS/Result_retrieval/text_retrieval" --output_dir "$OUTPUT_BASE_ABS/Result_retrieval/clip_retrieval"
+    echo "✓ CLIP retrieval 완료"
+    "${CHECKPOINT[@]}" write clip_retrieval --started_at "$STAGE_START"
+fi
+
+# composition 전에 배치 최적화 종료 대기
+if [ -n "$OPTIMISE_PID" ]; then
+    echo "배치 최적화 종료 대기 중..."
+    if ! wait "$OPTIMISE_PID"; then
+        echo "✗ Layout 생성 실패"
+        exit 1
+    fi
 fi
 
 # 4단계: 검색된 object와 layout을 기반으로 scene 완성
 echo "[4/4] Scene composition 수행 중..."
-python scene_composition.py --root "$OUTPUT_BASE_ABS/Result_txt" --clip-results "$OUTPUT_BASE_ABS/Result_retrieval/clip_retrieval" --output "$OUTPUT_BASE_ABS/Result"
-
-if [ $? -eq 0 ]; then
-    echo "✓ Scene composition 완료"
+if "${CHECKPOINT[@]}" resume scene_composition; then
+    echo "✓ Scene composition checkpoint 사용 (4단계 건너뜀)"
 else
-    echo "✗ Scene composition 실패"
-    exit 1
+    STAGE_START=$(date +%s.%N)
+    python scene_composition.py --root "$OUTPUT_BASE_ABS/Result_txt" --clip-results "$OUTPUT_BASE_ABS/Result_retrieval/clip_retrieval" --output "$OUTPUT_BASE_ABS/Result"
+
+    if [ $? -eq 0 ]; then
+        echo "✓ Scene composition 완료"
+    else
+        echo "✗ Scene composition 실패"
+        exit 1
+    fi
+    "${CHECKPOINT[@]}" write scene_composition --started_at "$STAGE_START"
 fi
 
 echo ""
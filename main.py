@@ -1,13 +1,31 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect, Header
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
+from typing import List
 import subprocess
 import uuid
 import os
-from datetime import datetime
+import sys
+import time
+import json
+import asyncio
+from datetime import datetime, timedelta
 from pathlib import Path
-import threading
 import shutil
+import zipfile
+
+from task_queue import SceneTaskQueue, QueueFullError
+from task_store import (create_task_store, QUEUED, PROCESSING, COMPLETED, FAILED, CANCELLED,
+                        FINISHED_STATUSES, ATTACHED, EXISTING)
+from pipeline_worker import StagedPipeline, PipelineError, PipelineCancelled, kill_process_group
+from retention import OutputRetention
+from result_cache import ResultCache
+from metrics import MetricsRegistry
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'space-generator'))
+from pipeline_progress import STAGES, StepSummaries, read_events
+from llm_cache import cache_mode
 
 # FastAPI 앱 생성
 app = FastAPI(title="Scene Synthesis API", version="1.0.0")
@@ -17,21 +35,155 @@ class SceneRequest(BaseModel):
     scene_descriptor: str
     iterations: int = 300
     openai_api_key: str = None
+    seed: int = None
+    use_cache: bool = True
+    timeout: float = None
+    time_budget: float = None
+
+class BatchSceneRequest(BaseModel):
+    scene_descriptors: List[str]
+    iterations: int = 300
+    openai_api_key: str = None
+    seed: int = None
+    use_cache: bool = True
+    timeout: float = None
+    time_budget: float = None
 
 # 전역 API 키
 global_openai_api_key = None
 
-# 작업 상태 저장
-tasks = {}
+# 작업 하나의 최대 실행 시간(초). 요청의 timeout 은 이 값보다 길 수 없다 (0 이면 제한 없음)
+task_timeout = float(os.getenv('SCENE_TASK_TIMEOUT', '1800'))
+
+# 파이프라인이 실패했을 때 다시 실행하는 횟수. 완료된 단계는 checkpoint 에서 복원되므로 실패한 단계부터 실행
+task_retries = int(os.getenv('SCENE_TASK_RETRIES', '1'))
+
+# 배치 요청 하나에 넣을 수 있는 최대 descriptor 수
+max_batch_size = int(os.getenv('SCENE_MAX_BATCH', '500'))
+
+# 작업 상태 저장 (SQLite, 여러 uvicorn 워커가 공유)
+task_store = create_task_store()
+
+def task_output_path(task_id: str):
+    """작업 출력 디렉토리 (환경변수 또는 현재 디렉토리 기준)"""
+    output_base = os.getenv('SCENE_OUTPUT_DIR', './outputs')
+    return f"{output_base}/scene_output_{task_id}"
+
+def task_progress_path(task_id: str):
+    """파이프라인 단계 이벤트가 기록되는 파일"""
+    return os.path.join(task_output_path(task_id), "progress.jsonl")
+
+# 작업별 단계 요약 (status / 배치 status 요청은 progress 파일에 새로 추가된 이벤트만 읽는다)
+step_summaries = StepSummaries()
+
+# 결과 캐시 (같은 descriptor / iterations / seed / time_budget / 파이프라인 버전이면 저장된 결과 재사용)
+result_cache = ResultCache(
+    os.getenv('SCENE_CACHE_DIR', os.path.join(os.getenv('SCENE_OUTPUT_DIR', './outputs'), 'cache')),
+    max_bytes=int(float(os.getenv('SCENE_CACHE_MAX_GB', '5')) * 1024 ** 3),
+)
+
+# Prometheus metrics (/metrics). 파이프라인 단계의 측정값은 작업이 끝날 때 progress 파일에서 읽어 반영
+metrics_registry = MetricsRegistry()
+metric_requests = metrics_registry.counter(
+    "scene_requests_total", "Scene generation requests by outcome (queued, cached, coalesced, idempotent, rejected)")
+metric_queue_depth = metrics_registry.gauge("scene_queue_depth", "Tasks waiting in the queue")
+metric_tasks_running = metrics_registry.gauge("scene_tasks_running", "Tasks being processed")
+metric_task_slots = metrics_registry.gauge("scene_task_slots", "Task slots of this server process by state")
+metric_stage_workers = metrics_registry.gauge("scene_stage_workers", "Warm pipeline workers by stage and state")
+metric_stage_utilisation = metrics_registry.gauge("scene_stage_utilisation", "Fraction of busy warm workers per stage")
+metric_stage_busy = metrics_registry.counter("scene_stage_busy_seconds_total", "Time warm workers spent running a stage")
+metric_queue_wait = metrics_registry.histogram("scene_queue_wait_seconds", "Time from submission to the start of processing")
+metric_task_duration = metrics_registry.histogram("scene_task_duration_seconds", "Processing time of a task by final status")
+metric_tasks_finished = metrics_registry.counter("scene_tasks_finished_total", "Processed tasks by final status")
+metric_task_retries = metrics_registry.counter("scene_task_retries_total", "Pipeline runs retried from the last checkpoint")
+metric_operation = metrics_registry.histogram(
+    "scene_pipeline_operation_seconds",
+    "Duration of pipeline operations (llm_call, slsqp_restart, text_retrieval, clip_rerank, mesh_load, glb_export, ...)")
+metric_llm_tokens = metrics_registry.counter("scene_llm_tokens_total", "OpenAI tokens used by type")
+metric_llm_cache = metrics_registry.counter("scene_llm_cache_lookups_total", "LLM response cache lookups by result")
+metric_program_library = metrics_registry.counter("scene_program_library_lookups_total", "Program library lookups by result")
+metric_slsqp_stops = metrics_registry.counter("scene_slsqp_stops_total", "SLSQP restart searches ended, by phase and reason")
+metric_cache_lookups = metrics_registry.counter("scene_result_cache_lookups_total", "Result cache lookups by result")
+metric_cache_hit_ratio = metrics_registry.gauge("scene_result_cache_hit_ratio", "Result cache hit ratio")
+
+def record_pipeline_metrics(task_id: str):
+    """작업이 progress 파일에 남긴 측정값 이벤트(report_timing / report_count)를 metric 에 반영"""
+    events, _ = read_events(task_progress_path(task_id))
+    for event in events:
+        if event.get("type") == "timing":
+            for value in event["values"]:
+                metric_operation.observe(value, operation=event["metric"], **event.get("labels", {}))
+        elif event.get("type") == "count" and event["metric"] == "llm_tokens":
+            metric_llm_tokens.inc(event["value"], **event.get("labels", {}))
+        elif event.get("type") == "count" and event["metric"] == "llm_cache":
+            metric_llm_cache.inc(event["value"], **event.get("labels", {}))
+        elif event.get("type") == "count" and event["metric"] == "program_library":
+            metric_program_library.inc(event["value"], **event.get("labels", {}))
+        elif event.get("type") == "count" and event["metric"] == "slsqp_stop":
+            metric_slsqp_stops.inc(event["value"], **event.get("labels", {}))
 
-def run_scene_synthesis(task_id: str, scene_descriptor: str, iterations: int, api_key: str):
-    """백그라운드에서 씬 생성 실행"""
+def set_task_state(task_id: str, **fields):
+    """작업 상태 변경. 같은 요청으로 붙은 작업(follower)들도 같이 변경 (취소된 작업은 그대로)"""
+    task_store.update(task_id, **fields)
+    for follower_id in task_store.followers(task_id):
+        task_store.update(follower_id, **fields)
+
+def has_active_followers(task_id: str):
+    """이 작업의 결과를 기다리는 follower 가 남아 있는지"""
+    for follower_id in task_store.followers(task_id):
+        follower = task_store.get(follower_id)
+        if follower is not None and follower["status"] in (QUEUED, PROCESSING):
+            return True
+    return False
+
+def is_cancelled(task_id: str):
+    """취소됐고 결과를 기다리는 follower 도 없으면 True (follower 가 있으면 계속 실행)"""
+    task = task_store.get(task_id)
+    return task is None or (task["status"] == CANCELLED and not has_active_followers(task_id))
+
+def run_script(task_id: str, command: list, cwd: str, env: dict, should_stop):
+    """스크립트를 별도 프로세스 그룹으로 실행. should_stop() 이 사유를 반환하면 bash 와 하위 python 프로세스를 모두 종료"""
+    process = subprocess.Popen(command, cwd=cwd, env=env, start_new_session=True)
+    while True:
+        try:
+            return process.wait(timeout=1.0)
+        except subprocess.TimeoutExpired:
+            pass
+        reason = should_stop()
+        if reason:
+            print(f"Task {task_id}: {reason}, killing process group {process.pid}")
+            kill_process_group(process.pid, process.wait)
+            raise PipelineCancelled(reason)
+
+def run_scene_synthesis(task_id: str, scene_descriptor: str, iterations: int, api_key: str,
+                        seed: int = None, cache_key: str = None, timeout: float = None, time_budget: float = None):
+    """백그라운드에서 씬 생성 실행. 취소되어 실행하지 않았으면 False
+
+    time_budget(초)은 배치 최적화 단계의 시간 예산. 예산을 다 쓰면 그때까지 찾은 가장 좋은 배치로 다음 단계를 진행한다.
+    """
+    if is_cancelled(task_id):
+        print(f"Task {task_id}: Cancelled before start")
+        return False
+    
+    output_path = task_output_path(task_id)
+    started_at = time.time()
+    deadline = started_at + timeout if timeout else None
+    created_at = task_store.get(task_id)["created_at"]
+    metric_queue_wait.observe(max(0.0, started_at - datetime.fromisoformat(created_at).timestamp()))
+    cleanup = False
+    
+    def should_stop():
+        # DELETE /api/tasks/{id} 또는 deadline 초과 시 중단 사유 반환
+        if deadline is not None and time.time() > deadline:
+            return f"Deadline exceeded ({timeout:.0f}s)"
+        if is_cancelled(task_id):
+            return "Cancelled"
+        return None
+    
     try:
-        tasks[task_id]["status"] = "processing"
+        set_task_state(task_id, status=PROCESSING, started_at=started_at, deadline=deadline)
         
-        # 출력 경로 생성 (환경변수 또는 현재 디렉토리 기준)
-        output_base = os.getenv('SCENE_OUTPUT_DIR', './outputs')
-        output_path = f"{output_base}/scene_output_{task_id}"
+        # 출력 경로 생성
         os.makedirs(output_path, exist_ok=True)
         
         # 스크립트 실행 (환경변수 또는 현재 디렉토리 기준)
@@ -39,22 +191,45 @@ def run_scene_synthesis(task_id: str, scene_descriptor: str, iterations: int, ap
         
         env = os.environ.copy()
         env['OPENAI_API_KEY'] = api_key
+        env['SCENE_PROGRESS_FILE'] = os.path.abspath(task_progress_path(task_id))
         
         print(f"Task {task_id}: Starting scene synthesis with {iterations} iterations...")
         
-        # 스크립트 실행 (kocca 디렉토리에서 실행하도록 절대 경로 사용)
-        kocca_dir = os.path.dirname(os.path.abspath(__file__))
+        def run_pipeline():
+            if pipeline_pool is not None:
+                # 단계별 상주 워커에서 실행 (모델/DB 재로딩 없음)
+                try:
+                    pipeline_pool.run(scene_descriptor, output_path, iterations, api_key, seed, should_stop=should_stop,
+                                      time_budget=time_budget)
+                    return True, None
+                except PipelineCancelled:
+                    raise
+                except PipelineError as e:
+                    return False, f"Pipeline failed: {e}"
+            
+            # 스크립트 실행 (kocca 디렉토리에서 실행하도록 절대 경로 사용)
+            kocca_dir = os.path.dirname(os.path.abspath(__file__))
+            
+            returncode = run_script(task_id, [
+                "bash", script_path, scene_descriptor, output_path, str(iterations),
+                "" if seed is None else str(seed), "" if time_budget is None else str(time_budget)
+            ],
+            cwd=kocca_dir,  # kocca 폴더에서 실행
+            env=env,
+            should_stop=should_stop,
+            )
+            return returncode == 0, f"Script failed with exit code {returncode}"
         
-        process = subprocess.run([
-            "bash", script_path, scene_descriptor, output_path, str(iterations)
-        ], 
-        cwd=kocca_dir,  # kocca 폴더에서 실행
-        env=env,
-        # capture_output=True,  # 이걸 주석처리해서 출력을 볼 수 있게 함
-        # text=True
-        )
+        # 실패하면 같은 출력 경로로 다시 실행. 두 실행 방식 모두 checkpoint 가 있는 단계는 건너뛴다
+        succeeded, error = run_pipeline()
+        for attempt in range(1, task_retries + 1):
+            if succeeded or should_stop():
+                break
+            print(f"Task {task_id}: {error}. Retrying from the last checkpoint ({attempt}/{task_retries})")
+            metric_task_retries.inc()
+            succeeded, error = run_pipeline()
         
-        if process.returncode == 0:
+        if succeeded:
             # GLB 파일 찾기
             glb_file = None
             result_dir = f"{output_path}/Result"
@@ -64,22 +239,89 @@ def run_scene_synthesis(task_id: str, scene_descriptor: str, iterations: int, ap
                     break
             
             if glb_file:
-                tasks[task_id]["status"] = "completed"
-                tasks[task_id]["file_path"] = glb_file
+                os.utime(output_path)  # 보관 기간은 완료 시각부터
+                set_task_state(task_id, status=COMPLETED, file_path=glb_file)
+                if cache_key:
+                    result_cache.put(cache_key, output_path, glb_file,
+                                     scene_descriptor=scene_descriptor, iterations=iterations, seed=seed,
+                                     time_budget=time_budget)
                 print(f"Task {task_id}: Completed successfully")
             else:
-                tasks[task_id]["status"] = "failed"
-                tasks[task_id]["error"] = "GLB file not found"
+                set_task_state(task_id, status=FAILED, error="GLB file not found")
                 print(f"Task {task_id}: GLB file not found")
         else:
-            tasks[task_id]["status"] = "failed"
-            tasks[task_id]["error"] = f"Script failed: {process.stderr}"
-            print(f"Task {task_id}: Script failed")
+            set_task_state(task_id, status=FAILED, error=error)
+            print(f"Task {task_id}: {error}")
             
+    except PipelineCancelled as e:
+        # 중간 결과 삭제. 취소된 작업은 이미 cancelled 상태이고, deadline 초과는 failed 로 기록
+        cleanup = True
+        set_task_state(task_id, status=FAILED, error=str(e))
+        print(f"Task {task_id}: {e}")
+        return not is_cancelled(task_id)
     except Exception as e:
-        tasks[task_id]["status"] = "failed"
-        tasks[task_id]["error"] = str(e)
+        set_task_state(task_id, status=FAILED, error=str(e))
         print(f"Task {task_id}: Exception - {str(e)}")
+    finally:
+        record_pipeline_metrics(task_id)
+        task = task_store.get(task_id)
+        status = task["status"] if task is not None else FAILED
+        metric_tasks_finished.inc(status=status)
+        metric_task_duration.observe(time.time() - started_at, status=status)
+        if cleanup:
+            shutil.rmtree(output_path, ignore_errors=True)
+
+# 파이프라인 실행 방식: warm = 단계별 상주 워커 풀, script = 매 작업마다 layout_scene_api.sh 실행
+pipeline_mode = os.getenv('SCENE_PIPELINE_MODE', 'warm')
+pipeline_pool = StagedPipeline({
+    "llm": int(os.getenv('SCENE_LLM_WORKERS', '4')),
+    "optimise": int(os.getenv('SCENE_OPTIMISE_WORKERS', '2')),
+    "retrieval": int(os.getenv('SCENE_RETRIEVAL_WORKERS', '1')),
+    "compose": int(os.getenv('SCENE_COMPOSE_WORKERS', '1')),
+}) if pipeline_mode == 'warm' else None
+
+# 작업 큐 (동시에 진행 중인 작업 수 제한 + FIFO 대기열)
+# warm 모드 기본값은 모든 단계 워커 수의 합 (단계마다 서로 다른 작업이 실행될 수 있도록)
+max_workers = int(os.getenv('SCENE_MAX_WORKERS', str(pipeline_pool.capacity() if pipeline_pool is not None else 2)))
+task_queue = SceneTaskQueue(
+    run_scene_synthesis,
+    max_workers=max_workers,
+    max_queue=int(os.getenv('SCENE_MAX_QUEUE', '20')),
+    default_duration=float(os.getenv('SCENE_DEFAULT_DURATION', '300')),
+)
+
+# 결과 보관 정책 (다운로드와 별개로 TTL / 디스크 용량 기준 정리)
+def is_task_active(task_id):
+    task = task_store.get(task_id)
+    if task is None:
+        return False
+    # 취소된 leader 라도 follower 를 위해 계속 실행 중이면 유지
+    return task["status"] in (QUEUED, PROCESSING) or (task["status"] == CANCELLED and has_active_followers(task_id))
+
+output_retention = OutputRetention(
+    os.getenv('SCENE_OUTPUT_DIR', './outputs'),
+    ttl=float(os.getenv('SCENE_OUTPUT_TTL', '86400')),
+    max_bytes=int(float(os.getenv('SCENE_OUTPUT_MAX_GB', '20')) * 1024 ** 3),
+    interval=float(os.getenv('SCENE_RETENTION_INTERVAL', '300')),
+    is_active=is_task_active,
+)
+
+@app.on_event("startup")
+async def start_task_queue():
+    # 이전 실행에서 끝나지 못한 작업 정리
+    orphaned = task_store.fail_orphaned()
+    if orphaned:
+        print(f"Marked {orphaned} unfinished tasks from a previous run as failed")
+    task_store.evict_expired()
+    if pipeline_pool is not None:
+        pipeline_pool.start()
+    task_queue.start()
+    output_retention.start()
+
+@app.on_event("shutdown")
+async def stop_pipeline_workers():
+    if pipeline_pool is not None:
+        pipeline_pool.stop()
 
 @app.get("/")
 async def root():
@@ -97,45 +339,128 @@ async def set_api_key(request: dict):
     global_openai_api_key = api_key
     return {"message": "API key set successfully"}
 
-@app.post("/api/generate-scene")
-async def generate_scene(request: SceneRequest):
-    """씬 생성 요청"""
+def submission_response(task_id: str, **extra):
+    """generate-scene 응답"""
+    task = task_store.get(task_id)
+    result = {"task_id": task_id, "status": task["status"]}
+    if task["status"] == QUEUED:
+        position = task_store.queue_position(task.get("leader_id") or task_id)
+        result["queue_position"] = (position or 0) + 1
+    elif task["status"] == COMPLETED:
+        result["download_url"] = f"/download/{task_id}"
+    if task.get("cached"):
+        result["cached"] = True
+    if task.get("leader_id"):
+        result["coalesced"] = True
+    result.update(extra)
+    return result
+
+def check_idempotent_request(task_id: str, request: SceneRequest):
+    """같은 Idempotency-Key 로 다른 요청을 보내면 거절"""
+    task = task_store.get(task_id)
+    if task["scene_descriptor"] != request.scene_descriptor or task["iterations"] != request.iterations:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    return task_id
+
+def validate_scene_request(request: SceneRequest):
+    """요청 검증 후 (API 키, 실행 시간 제한) 반환"""
     if not request.scene_descriptor.strip():
         raise HTTPException(status_code=400, detail="Scene descriptor required")
     
     if request.iterations <= 0 or request.iterations > 1000:
         raise HTTPException(status_code=400, detail="Iterations must be 1-1000")
     
+    if request.timeout is not None and request.timeout <= 0:
+        raise HTTPException(status_code=400, detail="Timeout must be positive")
+    if request.time_budget is not None and request.time_budget <= 0:
+        raise HTTPException(status_code=400, detail="Time budget must be positive")
+    timeout = request.timeout or task_timeout or None
+    if task_timeout > 0:
+        timeout = min(timeout, task_timeout)
+    
     api_key = request.openai_api_key or global_openai_api_key
     if not api_key:
-        raise HTTPException(status_code=400, detail="OpenAI API key required")
-    
-    task_id = str(uuid.uuid4())
-    
-    tasks[task_id] = {
-        "status": "queued",
+        # replay 모드는 기록된 응답만 사용하므로 키가 없어도 된다
+        if cache_mode() != "replay":
+            raise HTTPException(status_code=400, detail="OpenAI API key required")
+        api_key = ""
+    return api_key, timeout
+
+def submit_scene(request: SceneRequest, api_key: str, timeout: float, idempotency_key: str = None,
+                 batch_id: str = None, batch_index: int = None):
+    """작업 하나를 만들고 task_id 반환
+
+    - 캐시 적중: 바로 완료
+    - 같은 요청이 대기/실행 중: 그 작업에 붙어서 결과 공유 (새 task_id 발급)
+    - Idempotency-Key 가 이전 요청과 같으면: 이전 작업의 task_id
+    배치 작업(batch_id)은 단일 요청의 대기열 제한(max_queue)을 적용하지 않는다.
+    """
+    fields = {
         "scene_descriptor": request.scene_descriptor,
         "iterations": request.iterations,
-        "created_at": datetime.now().isoformat()
+        "created_at": datetime.now().isoformat(),
     }
+    if batch_id is not None:
+        fields.update(batch_id=batch_id, batch_index=batch_index)
+    
+    # 캐시 적중이면 파이프라인 없이 바로 완료
+    cache_key = (result_cache.key(request.scene_descriptor, request.iterations, request.seed, request.time_budget)
+                 if request.use_cache else None)
+    if cache_key:
+        task_id = str(uuid.uuid4())
+        glb_file = result_cache.materialize(cache_key, task_output_path(task_id))
+        if glb_file:
+            kind, existing_id = task_store.create_or_attach(
+                task_id, idempotency_key=idempotency_key,
+                status=COMPLETED, file_path=glb_file, cached=True, **fields
+            )
+            if kind == EXISTING:
+                shutil.rmtree(task_output_path(task_id), ignore_errors=True)
+                metric_requests.inc(result="idempotent")
+                return check_idempotent_request(existing_id, request)
+            metric_requests.inc(result="cached")
+            print(f"Task {task_id}: Served from cache")
+            return task_id
     
-    # 백그라운드 실행
-    thread = threading.Thread(
-        target=run_scene_synthesis,
-        args=(task_id, request.scene_descriptor, request.iterations, api_key)
+    task_id = str(uuid.uuid4())
+    kind, other_id = task_store.create_or_attach(
+        task_id, request_key=cache_key, idempotency_key=idempotency_key, status=QUEUED, **fields
     )
-    thread.daemon = True
-    thread.start()
+    if kind == EXISTING:
+        metric_requests.inc(result="idempotent")
+        return check_idempotent_request(other_id, request)
+    if kind == ATTACHED:
+        metric_requests.inc(result="coalesced")
+        print(f"Task {task_id}: Attached to running task {other_id}")
+        return task_id
     
-    return {"task_id": task_id, "status": "queued"}
-
-@app.get("/api/status/{task_id}")
-async def get_status(task_id: str):
-    """작업 상태 확인"""
-    if task_id not in tasks:
-        raise HTTPException(status_code=404, detail="Task not found")
+    # 대기열에 추가 (가득 차면 429로 즉시 거절)
+    retry_after = str(int(task_queue.average_duration()))
+    if batch_id is None and task_store.count(QUEUED, include_batches=False) > task_queue.max_queue:
+        task_store.delete(task_id)
+        metric_requests.inc(result="rejected")
+        raise HTTPException(status_code=429, detail=f"Queue is full ({task_queue.max_queue} tasks waiting)",
+                            headers={"Retry-After": retry_after})
+    try:
+        task_queue.submit(task_id, request.scene_descriptor, request.iterations, api_key, request.seed, cache_key, timeout,
+                          request.time_budget, force=batch_id is not None)
+    except QueueFullError as e:
+        task_store.delete(task_id)
+        metric_requests.inc(result="rejected")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": retry_after})
     
-    task = tasks[task_id]
+    metric_requests.inc(result="queued")
+    return task_id
+
+@app.post("/api/generate-scene")
+async def generate_scene(request: SceneRequest, idempotency_key: str = Header(None)):
+    """씬 생성 요청"""
+    api_key, timeout = validate_scene_request(request)
+    task_id = submit_scene(request, api_key, timeout, idempotency_key)
+    return submission_response(task_id)
+
+def build_status(task_id: str, task: dict, include_steps: bool = True):
+    """status API / 이벤트 스트림 공통 응답"""
     result = {
         "task_id": task_id,
         "status": task["status"],
@@ -143,51 +468,338 @@ async def get_status(task_id: str):
         "iterations": task["iterations"],
         "created_at": task["created_at"]
     }
+    if task.get("cached"):
+        result["cached"] = True
     
-    if task["status"] == "completed":
+    # 같은 요청에 붙은 작업은 실제로 실행 중인 작업(leader)의 대기 순번 / 진행 상황을 보여준다
+    source_id = task.get("leader_id") or task_id
+    if task.get("leader_id"):
+        result["coalesced"] = True
+    
+    if task["status"] == QUEUED:
+        position = task_store.queue_position(source_id)
+        if position is not None:
+            result["queue_position"] = position + 1
+            # 작업은 추가한 uvicorn 워커의 대기열에서 실행되므로 그 워커의 대기열과 실행 중인 작업으로 예상한다
+            owner_queue = task_store.owner_queue(source_id)
+            if owner_queue is not None:
+                wait = task_queue.estimate_wait(*owner_queue)
+                result["estimated_start_time"] = (datetime.now() + timedelta(seconds=wait)).isoformat()
+    elif task["status"] == COMPLETED:
         result["download_url"] = f"/download/{task_id}"
-    elif task["status"] == "failed":
+    elif task["status"] == FAILED:
         result["error"] = task.get("error", "Unknown error")
+    if task.get("deadline"):
+        result["deadline"] = datetime.fromtimestamp(task["deadline"]).isoformat()
+    
+    if include_steps and task["status"] != QUEUED:
+        result["steps"] = step_summaries.steps(task_progress_path(source_id))
     
     return result
 
+@app.get("/api/status/{task_id}")
+async def get_status(task_id: str):
+    """작업 상태 확인"""
+    task = task_store.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    return build_status(task_id, task)
+
+async def iter_task_events(task_id: str, interval: float = 0.5, keepalive: float = 15.0):
+    """(이벤트 이름, 데이터) 를 생성
+
+    status: 작업 상태 변경, progress: 단계 이벤트, ping: 연결 유지용, end: 종료
+    """
+    offset = 0
+    last_status = None
+    last_sent = time.time()
+    while True:
+        task = task_store.get(task_id)
+        if task is None:
+            yield "end", {"task_id": task_id, "status": "not_found"}
+            return
+        
+        events, offset = read_events(task_progress_path(task.get("leader_id") or task_id), offset)
+        for event in events:
+            if "metric" not in event:  # 측정값 이벤트는 /metrics 용
+                yield "progress", event
+        
+        status = build_status(task_id, task, include_steps=False)
+        key = (status["status"], status.get("queue_position"))
+        sent = bool(events)
+        if key != last_status:
+            last_status = key
+            sent = True
+            yield "status", status
+        
+        now = time.time()
+        if sent:
+            last_sent = now
+        elif now - last_sent > keepalive:
+            last_sent = now
+            yield "ping", {}
+        
+        if task["status"] in FINISHED_STATUSES:
+            yield "end", status
+            return
+        
+        await asyncio.sleep(interval)
+
+@app.delete("/api/tasks/{task_id}")
+async def cancel_task(task_id: str):
+    """작업 취소. 대기 중이면 대기열에서 빼고, 실행 중이면 파이프라인 프로세스를 종료하고 중간 결과를 삭제"""
+    task = task_store.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    if task["status"] in (COMPLETED, FAILED):
+        raise HTTPException(status_code=409, detail=f"Task already {task['status']}")
+    
+    request_cancel(task_id)
+    return build_status(task_id, task_store.get(task_id), include_steps=False)
+
+def request_cancel(task_id: str):
+    """작업을 cancelled 로 표시. 대기/실행 중이 아니면 False"""
+    if not task_store.cancel(task_id, cancelled_at=time.time()):
+        return False
+    # 같은 프로세스의 대기열에 있으면 바로 제거. 다른 워커의 대기열이나 실행 중인 작업은
+    # 그 워커가 상태를 확인해 건너뛰거나 종료한다. 결과를 기다리는 follower 가 있으면 계속 실행
+    if not has_active_followers(task_id):
+        task_queue.cancel(task_id)
+    print(f"Task {task_id}: Cancel requested")
+    return True
+
+@app.get("/api/tasks/{task_id}/events")
+async def task_events(task_id: str):
+    """작업 진행 상황 Server-Sent Events 스트림"""
+    if task_store.get(task_id) is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    async def event_stream():
+        async for name, data in iter_task_events(task_id):
+            if name == "ping":
+                yield ": ping\n\n"
+            else:
+                yield f"event: {name}\ndata: {json.dumps(data)}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/ws/tasks/{task_id}")
+async def task_events_ws(websocket: WebSocket, task_id: str):
+    """작업 진행 상황 WebSocket. 메시지 형식: {"event": ..., "data": ...}"""
+    await websocket.accept()
+    try:
+        async for name, data in iter_task_events(task_id):
+            await websocket.send_json({"event": name, "data": data})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
+def submit_batch(request: BatchSceneRequest, idempotency_key: str = None):
+    """배치의 descriptor 마다 작업 생성 (단일 요청과 같은 캐시 / coalescing 적용). batch_id 반환"""
+    options = {
+        name: getattr(request, name)
+        for name in ("iterations", "openai_api_key", "seed", "use_cache", "timeout", "time_budget")
+        if getattr(request, name) is not None
+    }
+    items = [SceneRequest(scene_descriptor=descriptor, **options) for descriptor in request.scene_descriptors]
+    # 하나라도 잘못되면 작업을 만들기 전에 거절
+    api_key, timeout = None, None
+    for item in items:
+        api_key, timeout = validate_scene_request(item)
+    
+    batch_id = str(uuid.uuid4())
+    task_ids = []
+    for index, item in enumerate(items):
+        # 항목마다 Idempotency-Key 를 따로 두면 재시도한 배치는 처음 만든 작업들을 그대로 돌려받는다
+        item_key = f"{idempotency_key}:{index}" if idempotency_key else None
+        task_ids.append(submit_scene(item, api_key, timeout, item_key, batch_id=batch_id, batch_index=index))
+    
+    batch_id = task_store.get(task_ids[0]).get("batch_id") or batch_id
+    print(f"Batch {batch_id}: {len(task_ids)} scenes submitted")
+    return batch_id
+
+def task_progress_percent(task_id: str, task: dict):
+    """작업 진행률 (0-100). 실행 중이면 단계별 진행률의 평균"""
+    if task["status"] in FINISHED_STATUSES:
+        return 100.0
+    if task["status"] == QUEUED:
+        return 0.0
+    steps = step_summaries.steps(task_progress_path(task.get("leader_id") or task_id))
+    return sum(steps.get(stage, {}).get("progress", 0) for stage in STAGES) / len(STAGES)
+
+def build_batch_status(batch_id: str, tasks: list):
+    """배치 전체 진행 상황 + 항목별 상태 (manifest 로도 사용)"""
+    counts = {status: 0 for status in (QUEUED, PROCESSING) + FINISHED_STATUSES}
+    items = []
+    progress = 0.0
+    for task in sorted(tasks, key=lambda t: t.get("batch_index", 0)):
+        task_id = task["task_id"]
+        counts[task["status"]] += 1
+        progress += task_progress_percent(task_id, task)
+        item = {
+            "index": task.get("batch_index"),
+            "task_id": task_id,
+            "scene_descriptor": task["scene_descriptor"],
+            "status": task["status"],
+        }
+        if task["status"] == COMPLETED:
+            item["download_url"] = f"/download/{task_id}"
+        elif task["status"] == FAILED:
+            item["error"] = task.get("error", "Unknown error")
+        if task.get("cached"):
+            item["cached"] = True
+        if task.get("leader_id"):
+            item["coalesced"] = True
+        items.append(item)
+    
+    finished = sum(counts[status] for status in FINISHED_STATUSES)
+    return {
+        "batch_id": batch_id,
+        "status": COMPLETED if finished == len(tasks) else PROCESSING,
+        "total": len(tasks),
+        "counts": counts,
+        "progress": round(progress / len(tasks), 1),
+        "iterations": tasks[0]["iterations"],
+        "created_at": tasks[0]["created_at"],
+        "download_url": f"/api/batches/{batch_id}/download",
+        "items": items,
+    }
+
+def get_batch_tasks(batch_id: str):
+    tasks = task_store.batch_tasks(batch_id)
+    if not tasks:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return tasks
+
+def build_batch_archive(batch_id: str, status: dict):
+    """완료된 GLB 들과 manifest.json 을 zip 으로 묶어 임시 파일 경로 반환"""
+    output_base = os.getenv('SCENE_OUTPUT_DIR', './outputs')
+    os.makedirs(output_base, exist_ok=True)
+    archive_path = os.path.join(output_base, f".batch_{batch_id}_{uuid.uuid4().hex}.zip")
+    # GLB 는 이미 압축된 바이너리이므로 ZIP_STORED
+    with zipfile.ZipFile(archive_path, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for item in status["items"]:
+            if item["status"] != COMPLETED:
+                continue
+            file_path = (task_store.get(item["task_id"]) or {}).get("file_path")
+            if not file_path or not os.path.exists(file_path):
+                item["status"], item["error"] = "expired", "File expired"
+                continue
+            item["file"] = f"{item['index']:04d}_{item['task_id']}.glb"
+            archive.write(file_path, item["file"])
+        archive.writestr("manifest.json", json.dumps(status, indent=2, ensure_ascii=False))
+    return archive_path
+
+@app.post("/api/generate-scenes")
+async def generate_scenes(request: BatchSceneRequest, idempotency_key: str = Header(None)):
+    """여러 씬 생성 요청을 한 번에 접수. 항목마다 작업을 만들어 같은 워커 풀(미리 로드된 모델 공유)에서 처리"""
+    if not request.scene_descriptors:
+        raise HTTPException(status_code=400, detail="Scene descriptors required")
+    if len(request.scene_descriptors) > max_batch_size:
+        raise HTTPException(status_code=400, detail=f"Batch too large (max {max_batch_size} scenes)")
+    
+    # 항목 수백 개를 등록하는 동안 이벤트 루프가 멈추지 않도록 스레드에서 처리
+    batch_id = await asyncio.to_thread(submit_batch, request, idempotency_key)
+    status = build_batch_status(batch_id, get_batch_tasks(batch_id))
+    del status["items"]
+    return status
+
+@app.get("/api/batches/{batch_id}")
+async def get_batch_status(batch_id: str):
+    """배치 진행 상황 (전체 진행률 + 항목별 상태)"""
+    return build_batch_status(batch_id, get_batch_tasks(batch_id))
+
+@app.delete("/api/batches/{batch_id}")
+async def cancel_batch(batch_id: str):
+    """배치에서 아직 끝나지 않은 작업을 모두 취소"""
+    tasks = get_batch_tasks(batch_id)
+    cancelled = sum(1 for task in tasks if request_cancel(task["task_id"]))
+    status = build_batch_status(batch_id, get_batch_tasks(batch_id))
+    status["cancelled"] = cancelled
+    return status
+
+@app.get("/api/batches/{batch_id}/download")
+async def download_batch(batch_id: str, partial: bool = False):
+    """완료된 GLB 들과 manifest.json 을 담은 zip. 끝나지 않은 작업이 있으면 partial=true 일 때만 허용"""
+    status = build_batch_status(batch_id, get_batch_tasks(batch_id))
+    if status["status"] != COMPLETED and not partial:
+        raise HTTPException(status_code=409, detail="Batch not finished (use ?partial=true for the completed scenes)")
+    
+    archive_path = await asyncio.to_thread(build_batch_archive, batch_id, status)
+    return FileResponse(
+        archive_path,
+        media_type="application/zip",
+        filename=f"scenes_{batch_id}.zip",
+        background=BackgroundTask(os.remove, archive_path),
+    )
+
 @app.get("/download/{task_id}")
-async def download_file(task_id: str):
-    """GLB 파일 다운로드"""
-    if task_id not in tasks:
+async def download_file(task_id: str, request: Request):
+    """GLB 파일 다운로드 (Range / ETag 지원, 여러 번 다운로드 가능)"""
+    task = task_store.get(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    task = tasks[task_id]
-    if task["status"] != "completed":
+    if task["status"] != COMPLETED:
         raise HTTPException(status_code=400, detail="Task not completed")
     
     file_path = task.get("file_path")
     if not file_path or not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="File not found")
-    
-    # 파일 스트리밍 후 정리
-    output_dir = str(Path(file_path).parent.parent)
+        # 보관 기간이 지나 정리된 결과
+        raise HTTPException(status_code=410, detail="File expired")
     
-    def file_stream_and_cleanup():
-        with open(file_path, "rb") as f:
-            yield from f
-        try:
-            shutil.rmtree(output_dir)
-            print(f"Cleaned up: {output_dir}")
-        except Exception as e:
-            print(f"Cleanup failed: {e}")
+    stat = os.stat(file_path)
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers={"ETag": etag})
     
-    return StreamingResponse(
-        file_stream_and_cleanup(),
-        media_type="application/octet-stream",
-        headers={"Content-Disposition": f"attachment; filename=scene_{task_id}.glb"}
+    # FileResponse: Range/If-Range 처리, 서버가 지원하면 pathsend(sendfile)로 전송
+    return FileResponse(
+        file_path,
+        media_type="model/gltf-binary",
+        filename=f"scene_{task_id}.glb",
+        stat_result=stat,
+        headers={"ETag": etag, "Cache-Control": "private, max-age=0, must-revalidate"},
     )
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics (text format)"""
+    metric_queue_depth.set(task_store.count(QUEUED))
+    metric_tasks_running.set(task_store.count(PROCESSING))
+    queue_stats = task_queue.stats()
+    metric_task_slots.set(queue_stats["running"], state="busy")
+    metric_task_slots.set(queue_stats["max_workers"], state="total")
+    if pipeline_pool is not None:
+        for stage, stats in pipeline_pool.stats().items():
+            busy = stats["size"] - stats["idle"]
+            metric_stage_workers.set(busy, stage=stage, state="busy")
+            metric_stage_workers.set(stats["idle"], stage=stage, state="idle")
+            metric_stage_workers.set(stats["waiting"], stage=stage, state="waiting")
+            metric_stage_utilisation.set(busy / stats["size"], stage=stage)
+            metric_stage_busy.set_total(stats["busy_seconds"], stage=stage)
+    cache_stats = result_cache.stats()
+    metric_cache_lookups.set_total(cache_stats["hits"], result="hit")
+    metric_cache_lookups.set_total(cache_stats["misses"], result="miss")
+    metric_cache_hit_ratio.set(cache_stats["hit_rate"] or 0.0)
+    return Response(metrics_registry.render(), media_type=MetricsRegistry.CONTENT_TYPE)
+
 @app.get("/health")
 async def health():
     return {
         "status": "healthy",
-        "active_tasks": len([t for t in tasks.values() if t["status"] == "processing"]),
+        "active_tasks": task_store.count(PROCESSING),
+        "stored_tasks": task_store.count(),
+        "queue": task_queue.stats(),
+        "cache": result_cache.stats(),
+        "pipeline_mode": pipeline_mode,
+        "pipeline_workers": pipeline_pool.stats() if pipeline_pool is not None else None,
         "api_key_status": "Set" if global_openai_api_key else "Not Set"
     }
 
@@ -0,0 +1,474 @@
+import multiprocessing
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SYNTHESIS_DIR = os.path.join(BASE_DIR, "space-generator", "Scene_Synthesis")
+RETRIEVAL_DIR = os.path.join(BASE_DIR, "space-generator", "retrieval")
+
+sys.path.append(os.path.dirname(SYNTHESIS_DIR))
+from pipeline_checkpoint import pending_stages, pipeline_params, write_checkpoint
+from layout_document import read_program, write_program
+from program_library import release_refresh
+
+
+class PipelineError(Exception):
+    """파이프라인 단계가 실패했거나 워커 프로세스가 비정상 종료됐을 때 발생"""
+
+
+class PipelineCancelled(PipelineError):
+    """취소 요청 또는 deadline 초과로 실행 중인 작업을 강제 종료했을 때 발생"""
+
+
+def kill_process_group(pid, wait, grace=5.0):
+    """pid 를 리더로 하는 프로세스 그룹 전체 종료
+
+    bash 스크립트와 그 아래 python 프로세스들을 한 번에 정리하기 위해 사용.
+    SIGTERM 후 리더가 끝나기를 grace 초 기다리고, 남아 있는 프로세스는 SIGKILL.
+    wait(timeout): 리더 프로세스 종료 대기 (Popen.wait / Process.join)
+    """
+    try:
+        os.killpg(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    try:
+        wait(grace)
+    except subprocess.TimeoutExpired:
+        pass
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    wait(None)
+
+
+def _dataset_folders():
+    # 원래 스크립트와 동일하게 retrieval 디렉토리 기준 상대 경로
+    base_path = os.environ.get('DATASET_BASE_PATH', '../../dataset')
+    return [os.path.join(base_path, f"3D-FUTURE-model-part{i}") for i in range(1, 5)]
+
+
+# 파이프라인 단계. 단계마다 자원 특성이 달라 별도의 워커 풀에서 실행한다
+#   llm: 언어 단계 (OpenAI 호출, 네트워크 대기)
+#   optimise: SLSQP 배치 최적화 (CPU)
+#   retrieval: text + CLIP retrieval (CLIP 모델 / GPU)
+#   compose: trimesh scene composition (I/O + CPU)
+STAGES = ("llm", "optimise", "retrieval", "compose")
+
+
+def _load_resources(stage):
+    """단계에 필요한 모듈 / 모델 / 데이터베이스만 한 번 로드"""
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    sys.path.insert(0, RETRIEVAL_DIR)
+    sys.path.insert(0, SYNTHESIS_DIR)
+    sys.path.insert(0, os.path.dirname(SYNTHESIS_DIR))
+    import pipeline_progress
+
+    resources = {"pipeline_progress": pipeline_progress}
+    if stage in ("llm", "optimise"):
+        os.chdir(SYNTHESIS_DIR)
+        import scene_synthesis
+        resources["scene_synthesis"] = scene_synthesis
+    elif stage == "retrieval":
+        os.chdir(RETRIEVAL_DIR)
+        import test_retrieval
+        import retrieval_clip
+        from object_retrieval import load_all_model_info
+
+        retrieval_clip.load_clip_model()
+        folder_paths = _dataset_folders()
+        resources.update({
+            "test_retrieval": test_retrieval,
+            "retrieval_clip": retrieval_clip,
+            "text_database": test_retrieval.DatabaseLoader.load_multiple_folders(folder_paths),
+            "clip_database": load_all_model_info(folder_paths),
+            "embedding_dict": retrieval_clip.load_embeddings(),
+        })
+    elif stage == "compose":
+        os.chdir(RETRIEVAL_DIR)
+        import scene_composition
+        resources["scene_composition"] = scene_composition
+    else:
+        raise ValueError(f"Unknown pipeline stage: {stage}")
+    return resources
+
+
+def _output_paths(output_path):
+    return {
+        "program_dir": os.path.join(output_path, "Result_language"),
+        "program_file": os.path.join(output_path, "Result_language", "program.json"),
+        "result_txt": os.path.join(output_path, "Result_txt"),
+        "layout_file": os.path.join(output_path, "Result_txt", "layout.json"),
+        "text_dir": os.path.join(output_path, "Result_retrieval", "text_retrieval"),
+        "clip_dir": os.path.join(output_path, "Result_retrieval", "clip_retrieval"),
+        "result_dir": os.path.join(output_path, "Result"),
+    }
+
+
+def _run_llm(resources, scene_descriptor, api_key, output_path, params):
+    """1단계 (앞부분): 언어 단계. constraint program 을 Result_language/program.json 으로 저장"""
+    print("[1/4] Layout 및 object text 생성 중 (language phase)...")
+    paths = _output_paths(output_path)
+    os.chdir(SYNTHESIS_DIR)
+    started_at = time.time()
+    scene_synthesis = resources["scene_synthesis"]
+    scene_synthesis.init_openai(api_key)
+    refreshes = []
+    try:
+        write_program(scene_synthesis.synthesize_program(scene_descriptor, refresh=refreshes.append), paths["program_dir"])
+        write_checkpoint(output_path, "language_phase", params, started_at)
+    except BaseException:
+        # 갱신 표시를 잡은 뒤 실패하면 갱신이 실행되지 않으므로 표시를 지운다
+        if refreshes:
+            release_refresh(scene_descriptor)
+        raise
+    # 라이브러리 program 을 재사용했고 갱신이 필요하면 True. 갱신은 StagedPipeline 이 llm 풀에 따로 넣는다
+    return bool(refreshes)
+
+
+def _run_refresh(resources, scene_descriptor, api_key):
+    """재사용한 라이브러리 program 을 LLM 으로 다시 만들어 라이브러리 항목을 교체 (llm 풀에서 실행)"""
+    os.chdir(SYNTHESIS_DIR)
+    scene_synthesis = resources["scene_synthesis"]
+    scene_synthesis.init_openai(api_key)
+    scene_synthesis.refresh_program(scene_descriptor)
+
+
+def _run_optimise(resources, output_path, iterations, seed, params, time_budget=None):
+    """1단계 (뒷부분): 배치 최적화 후 layout.json 저장"""
+    print("[1/4] Layout 및 object text 생성 중 (optimisation phase)...")
+    paths = _output_paths(output_path)
+    os.chdir(SYNTHESIS_DIR)
+    started_at = time.time()
+    program = read_program(paths["program_dir"])
+    resources["scene_synthesis"].synthesize_layout(program, paths["result_txt"], iterations, seed, time_budget=time_budget)
+    if not os.path.exists(paths["layout_file"]):
+        raise PipelineError("layout.json not generated")
+    write_checkpoint(output_path, "scene_synthesis", params, started_at)
+
+
+def _run_retrieval(resources, output_path, stages, params):
+    """2, 3단계: text 기반 retrieval + CLIP 기반 retrieval (stages 에 있는 단계만)
+
+    언어 단계의 style 설명(program.json)만 사용하므로 배치 최적화와 동시에 실행된다.
+    """
+    paths = _output_paths(output_path)
+    os.chdir(RETRIEVAL_DIR)
+
+    if "text_retrieval" in stages:
+        print("[2/4] Text 기반 retrieval 수행 중...")
+        started_at = time.time()
+        resources["test_retrieval"].demo_search(paths["program_file"], paths["text_dir"], database=resources["text_database"])
+        write_checkpoint(output_path, "text_retrieval", params, started_at)
+
+    if "clip_retrieval" in stages:
+        print("[3/4] CLIP 기반 retrieval 수행 중...")
+        started_at = time.time()
+        resources["retrieval_clip"].main(
+            paths["program_file"], paths["text_dir"], paths["clip_dir"],
+            database=resources["clip_database"],
+            embedding_dict=resources["embedding_dict"],
+        )
+        write_checkpoint(output_path, "clip_retrieval", params, started_at)
+
+
+def _run_compose(resources, output_path, params):
+    """4단계: Scene composition"""
+    print("[4/4] Scene composition 수행 중...")
+    paths = _output_paths(output_path)
+    os.chdir(RETRIEVAL_DIR)
+    started_at = time.time()
+    composer = resources["scene_composition"].SceneComposer(root_path=paths["result_txt"], clip_results_path=paths["clip_dir"])
+    composer.output_path = paths["result_dir"]
+    os.makedirs(composer.output_path, exist_ok=True)
+    composer.compose_scene()
+    write_checkpoint(output_path, "scene_composition", params, started_at)
+
+
+_STAGE_RUNNERS = {
+    "llm": _run_llm,
+    "refresh": _run_refresh,
+    "optimise": _run_optimise,
+    "retrieval": _run_retrieval,
+    "compose": _run_compose,
+}
+
+
+def _run_job(resources, job, progress_file, args):
+    """작업 하나 실행 (job: _STAGE_RUNNERS 의 이름). 진행 상황은 progress_file 에 기록"""
+    progress = resources["pipeline_progress"]
+    progress.set_progress_file(progress_file)
+    try:
+        return _STAGE_RUNNERS[job](resources, *args)
+    finally:
+        progress.set_progress_file(None)
+
+
+def _worker_main(conn, stage):
+    """상주 워커 프로세스 진입점"""
+    # 자체 프로세스 그룹을 만들어 두면 작업 취소 시 자식 프로세스까지 함께 종료할 수 있다
+    os.setsid()
+    try:
+        resources = _load_resources(stage)
+    except BaseException:
+        conn.send(("error", traceback.format_exc()))
+        return
+    conn.send(("ready", None))
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+
+        try:
+            result = _run_job(resources, *job)
+            conn.send(("done", result))
+        except KeyboardInterrupt:
+            break
+        except BaseException:
+            # SceneComposer.validate_structure 등은 sys.exit 을 호출하므로 SystemExit 도 잡는다
+            traceback.print_exc()
+            conn.send(("error", traceback.format_exc(limit=3)))
+
+
+class PipelineWorker:
+    """한 단계의 모델/데이터베이스를 미리 로드해 두고 여러 작업을 처리하는 상주 프로세스"""
+
+    def __init__(self, name, stage):
+        self.name = name
+        self.stage = stage
+        self._ctx = multiprocessing.get_context("spawn")
+        self.process = None
+        self.conn = None
+        self.ready = False
+
+    def start(self):
+        parent_conn, child_conn = self._ctx.Pipe()
+        self.process = self._ctx.Process(target=_worker_main, args=(child_conn, self.stage), name=self.name)
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self.ready = False
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def _recv(self):
+        try:
+            return self.conn.recv()
+        except (EOFError, OSError):
+            self.ready = False
+            raise PipelineError(f"{self.name} exited unexpectedly")
+
+    def run(self, args, progress_file=None, should_stop=None, poll_interval=1.0, job=None):
+        """단계 실행 후 결과 반환. should_stop() 이 취소 사유(문자열)를 반환하면 워커를 강제 종료하고 PipelineCancelled
+
+        job: 단계 대신 실행할 _STAGE_RUNNERS 의 작업 이름 (같은 자원을 쓰는 작업, 예: llm 워커의 refresh)
+        """
+        if not self.is_alive():
+            self.start()
+        if not self.ready:
+            status, payload = self._recv()
+            if status != "ready":
+                self.process.join()
+                raise PipelineError(f"{self.name} failed to load models:\n{payload}")
+            self.ready = True
+
+        self.conn.send((job or self.stage, progress_file, args))
+        while should_stop is not None and not self.conn.poll(poll_interval):
+            reason = should_stop()
+            if reason:
+                self.kill()
+                raise PipelineCancelled(reason)
+        status, payload = self._recv()
+        if status != "done":
+            raise PipelineError(payload)
+        return payload
+
+    def kill(self):
+        """실행 중인 작업과 함께 워커를 종료하고 새 워커를 띄운다 (모델은 다음 작업 전에 다시 로드)"""
+        if self.process is not None:
+            kill_process_group(self.process.pid, self.process.join)
+            self.conn.close()
+        self.start()
+
+    def stop(self, timeout=10):
+        if self.process is None:
+            return
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process = None
+        self.ready = False
+
+
+class PipelineWorkerPool:
+    """한 단계의 상주 워커 size 개. run() 은 비어있는 워커를 하나 빌려 단계를 실행한다"""
+
+    def __init__(self, stage, size=1):
+        self.stage = stage
+        self.workers = [PipelineWorker(f"pipeline-{stage}-{i}", stage) for i in range(max(1, int(size)))]
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        self._waiting = 0
+        self._busy_seconds = 0.0
+
+    def start(self):
+        """워커 프로세스를 띄운다 (모델 로딩은 각 프로세스에서 병렬로 진행)"""
+        with self._lock:
+            if self._started:
+                return
+            for worker in self.workers:
+                worker.start()
+                self._idle.put(worker)
+            self._started = True
+
+    def _acquire(self, should_stop):
+        """비어있는 워커를 기다린다. 기다리는 동안 취소되면 PipelineCancelled"""
+        with self._lock:
+            self._waiting += 1
+        try:
+            while True:
+                try:
+                    return self._idle.get(timeout=None if should_stop is None else 1.0)
+                except queue.Empty:
+                    reason = should_stop()
+                    if reason:
+                        raise PipelineCancelled(reason)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    def run(self, *args, progress_file=None, should_stop=None, job=None):
+        self.start()
+        worker = self._acquire(should_stop)
+        started = time.time()
+        try:
+            return worker.run(args, progress_file, should_stop=should_stop, job=job)
+        finally:
+            with self._lock:
+                self._busy_seconds += time.time() - started
+            self._idle.put(worker)
+
+    def stop(self):
+        with self._lock:
+            for worker in self.workers:
+                worker.stop()
+            self._idle = queue.Queue()
+            self._started = False
+
+    def stats(self):
+        return {
+            "size": len(self.workers),
+            "idle": self._idle.qsize(),
+            "waiting": self._waiting,
+            "alive": sum(1 for worker in self.workers if worker.is_alive()),
+            "busy_seconds": round(self._busy_seconds, 3),
+        }
+
+
+class StagedPipeline:
+    """단계별 워커 풀로 파이프라인 실행
+
+    작업 하나는 llm -> (optimise, retrieval 동시 실행) -> compose 순서로 각 단계의 풀을 거친다.
+    retrieval 은 언어 단계 결과만 필요하므로 배치 최적화가 끝나기를 기다리지 않는다.
+    단계마다 풀이 따로 있으므로 작업 A 의 composition, 작업 B 의 최적화, 작업 C 의 LLM 호출이 동시에 진행된다.
+    같은 output_path 로 다시 실행하면 checkpoint 가 남아 있는 단계는 건너뛴다 (pipeline_checkpoint).
+    """
+
+    def __init__(self, sizes):
+        self.pools = {stage: PipelineWorkerPool(stage, sizes.get(stage, 1)) for stage in STAGES}
+
+    def capacity(self):
+        """모든 단계가 동시에 처리할 수 있는 작업 수"""
+        return sum(len(pool.workers) for pool in self.pools.values())
+
+    def start(self):
+        for pool in self.pools.values():
+            pool.start()
+
+    def run(self, scene_descriptor, output_path, iterations, api_key, seed=None, should_stop=None, time_budget=None):
+        output_path = os.path.abspath(output_path)
+        options = {"progress_file": os.path.join(output_path, "progress.jsonl"), "should_stop": should_stop}
+        params = pipeline_params(scene_descriptor, iterations, seed, time_budget)
+        stages = pending_stages(output_path, params, options["progress_file"])
+        if stages[:1] != ["language_phase"]:
+            print(f"Resuming {output_path}: {', '.join(stages) or 'nothing'} left to run (checkpoint)")
+
+        if "language_phase" in stages:
+            if self.pools["llm"].run(scene_descriptor, api_key, output_path, params, **options):
+                self._refresh_in_background(scene_descriptor, api_key)
+
+        jobs = []
+        if "scene_synthesis" in stages:
+            jobs.append((self.pools["optimise"], (output_path, iterations, seed, params, time_budget)))
+        retrieval_stages = [stage for stage in ("text_retrieval", "clip_retrieval") if stage in stages]
+        if retrieval_stages:
+            jobs.append((self.pools["retrieval"], (output_path, retrieval_stages, params)))
+        self._run_concurrently(jobs, options)
+
+        if "scene_composition" in stages:
+            self.pools["compose"].run(output_path, params, **options)
+
+    def _refresh_in_background(self, scene_descriptor, api_key):
+        """재사용한 라이브러리 program 의 갱신을 llm 풀의 작업으로 실행 (작업을 기다리지 않음)
+
+        갱신 표시(program_library.claim_refresh)는 언어 단계가 이미 만들어 두었고, 갱신이 끝나거나 실패하면 지워진다.
+        """
+        def run():
+            try:
+                self.pools["llm"].run(scene_descriptor, api_key, job="refresh")
+            except Exception as e:
+                # 워커가 refresh_program 에 닿기 전에 실패했을 수도 있으므로 표시를 직접 지운다
+                release_refresh(scene_descriptor)
+                print(f"Program library refresh failed for '{scene_descriptor}': {e}")
+
+        threading.Thread(target=run, daemon=True).start()
+
+    @staticmethod
+    def _run_concurrently(jobs, options):
+        """(pool, args) 작업들을 동시에 실행하고 모두 끝날 때까지 대기
+
+        하나가 실패해도 나머지는 끝까지 실행한다 (checkpoint 가 남아 재시도 때 건너뛸 수 있도록).
+        실패가 있으면 취소보다 실패를 우선해 다시 발생시킨다.
+        """
+        errors = []
+
+        def run(pool, args):
+            try:
+                pool.run(*args, **options)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=job, daemon=True) for job in jobs[1:]]
+        for thread in threads:
+            thread.start()
+        if jobs:
+            run(*jobs[0])
+        for thread in threads:
+            thread.join()
+
+        failures = [e for e in errors if not isinstance(e, PipelineCancelled)]
+        if failures or errors:
+            raise (failures or errors)[0]
+
+    def stop(self):
+        for pool in self.pools.values():
+            pool.stop()
+
+    def stats(self):
+        return {stage: pool.stats() for stage, pool in self.pools.items()}
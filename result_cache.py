@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 결과에 영향을 주는 파일들. 하나라도 바뀌면 pipeline version 이 바뀌어 이전 캐시는 더 이상 맞지 않는다
+PIPELINE_SOURCES = [
+    "layout_scene_api.sh",
+    "pipeline_worker.py",
+    "space-generator/layout_document.py",
+    "space-generator/prompt_graph.py",
+    "space-generator/program_library.py",
+    "space-generator/Scene_Synthesis",
+    "space-generator/retrieval",
+]
+
+# 캐시에 저장하는 결과물 (출력 디렉토리 기준 상대 경로)
+CACHED_PATHS = ["Result", "Result_txt", os.path.join("Result_retrieval", "clip_retrieval")]
+
+
+def normalize_descriptor(scene_descriptor):
+    """대소문자, 공백, 끝의 문장부호 차이는 같은 요청으로 취급"""
+    text = re.sub(r"\s+", " ", scene_descriptor.strip().lower())
+    return text.rstrip(" .!?")
+
+
+def pipeline_version():
+    """파이프라인 소스 파일 내용의 해시 (SCENE_PIPELINE_VERSION 으로 고정 가능)"""
+    override = os.getenv('SCENE_PIPELINE_VERSION')
+    if override:
+        return override
+
+    digest = hashlib.sha256()
+    for source in PIPELINE_SOURCES:
+        path = os.path.join(BASE_DIR, source)
+        if os.path.isfile(path):
+            files = [path]
+        else:
+            files = sorted(
+                os.path.join(root, name)
+                for root, dirs, names in os.walk(path)
+                if "__pycache__" not in root
+                for name in names
+                if name.endswith((".py", ".sh", ".yaml"))
+            )
+        for file_path in files:
+            digest.update(os.path.relpath(file_path, BASE_DIR).encode())
+            with open(file_path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def _tree_size(path):
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _link_or_copy(src, dst):
+    """같은 파일시스템이면 하드링크 (복사 없음), 아니면 복사"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class ResultCache:
+    """파이프라인 결과 캐시 (내용 주소 방식)
+
+    키 = (정규화된 descriptor, iterations, seed, time_budget, pipeline version) 의 해시.
+    항목마다 디렉토리 하나 (GLB, layout, CLIP retrieval 결과, meta.json).
+    전체 크기가 max_bytes 를 넘으면 가장 오래 사용하지 않은 항목부터 삭제한다.
+    """
+
+    def __init__(self, cache_dir, max_bytes, version=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_bytes)
+        self.version = version or pipeline_version()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.enabled:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def key(self, scene_descriptor, iterations, seed=None, time_budget=None):
+        payload = json.dumps({
+            "scene_descriptor": normalize_descriptor(scene_descriptor),
+            "iterations": int(iterations),
+            "seed": seed,
+            "time_budget": time_budget,
+            "pipeline_version": self.version,
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        """캐시 항목의 meta dict. 없으면 None (사용 시각 갱신)"""
+        if not self.enabled:
+            return None
+        meta_path = os.path.join(self._entry_path(key), "meta.json")
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            os.utime(meta_path)  # LRU 순서 갱신
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return meta
+
+    def materialize(self, key, output_path):
+        """캐시 항목을 작업 출력 디렉토리로 옮기고 GLB 경로를 반환. 항목이 그 사이 삭제됐으면 None"""
+        entry = self._entry_path(key)
+        meta = self.get(key)
+        if meta is None:
+            return None
+        try:
+            shutil.copytree(entry, output_path, copy_function=_link_or_copy, dirs_exist_ok=True,
+                            ignore=shutil.ignore_patterns("meta.json"))
+        except (OSError, shutil.Error):
+            return None
+        glb_file = os.path.join(output_path, meta["glb_file"])
+        return glb_file if os.path.exists(glb_file) else None
+
+    def put(self, key, output_path, glb_file, **info):
+        """완료된 작업의 결과를 캐시에 저장"""
+        if not self.enabled:
+            return
+        entry = self._entry_path(key)
+        if os.path.exists(entry):
+            return
+
+        # 임시 디렉토리에 만든 뒤 rename 으로 한 번에 등록 (다른 워커가 반쯤 만든 항목을 읽지 않도록)
+        tmp = os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}")
+        try:
+            for rel in CACHED_PATHS:
+                src = os.path.join(output_path, rel)
+                if os.path.isdir(src):
+                    shutil.copytree(src, os.path.join(tmp, rel), copy_function=_link_or_copy)
+            meta = dict(info, key=key, pipeline_version=self.version,
+                        glb_file=os.path.relpath(glb_file, output_path), created_at=time.time())
+            meta["size"] = _tree_size(tmp)
+            with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.rename(tmp, entry)
+        except OSError as e:
+            print(f"Cache store failed: {e}")
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        self.evict()
+
+    def _entries(self):
+        """(마지막 사용 시각, 크기, 경로) 목록, 오래된 순"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            meta_path = os.path.join(path, "meta.json")
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    size = json.load(f).get("size", 0)
+                entries.append((os.path.getmtime(meta_path), size, path))
+            except (OSError, ValueError):
+                continue
+        entries.sort()
+        return entries
+
+    def evict(self):
+        """byte budget 을 넘으면 LRU 순으로 삭제"""
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "pipeline_version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
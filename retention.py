@@ -0,0 +1,101 @@
+import os
+import shutil
+import threading
+import time
+
+OUTPUT_PREFIX = "scene_output_"
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class OutputRetention:
+    """출력 디렉토리 정리 스레드
+
+    다운로드와 무관하게 주기적으로 실행되며,
+    - ttl 초 이상 지난 결과를 삭제하고
+    - 전체 크기가 max_bytes 를 넘으면 오래된 결과부터 삭제한다.
+    is_active(task_id) 가 True 인 작업(대기/실행 중)의 디렉토리는 건드리지 않는다.
+    """
+
+    def __init__(self, output_base, ttl=86400.0, max_bytes=0, interval=300.0, is_active=None):
+        self.output_base = output_base
+        self.ttl = float(ttl)
+        self.max_bytes = int(max_bytes)
+        self.interval = float(interval)
+        self.is_active = is_active or (lambda task_id: False)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="output-retention", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Retention sweep failed: {e}")
+
+    def _outputs(self):
+        """(수정 시각, 크기, task_id, 경로) 목록, 오래된 순"""
+        outputs = []
+        if not os.path.isdir(self.output_base):
+            return outputs
+        for name in os.listdir(self.output_base):
+            path = os.path.join(self.output_base, name)
+            if not name.startswith(OUTPUT_PREFIX) or not os.path.isdir(path):
+                continue
+            task_id = name[len(OUTPUT_PREFIX):]
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            outputs.append((mtime, _dir_size(path), task_id, path))
+        outputs.sort()
+        return outputs
+
+    def _remove(self, path):
+        shutil.rmtree(path, ignore_errors=True)
+        print(f"Cleaned up: {path}")
+
+    def sweep(self):
+        """한 번 정리하고 삭제한 디렉토리 수를 반환"""
+        removed = 0
+        now = time.time()
+        remaining = []
+        for mtime, size, task_id, path in self._outputs():
+            if self.is_active(task_id):
+                remaining.append((mtime, size, task_id, path))
+                continue
+            if self.ttl > 0 and now - mtime > self.ttl:
+                self._remove(path)
+                removed += 1
+            else:
+                remaining.append((mtime, size, task_id, path))
+
+        if self.max_bytes > 0:
+            total = sum(size for _, size, _, _ in remaining)
+            for mtime, size, task_id, path in remaining:
+                if total <= self.max_bytes:
+                    break
+                if self.is_active(task_id):
+                    continue
+                self._remove(path)
+                total -= size
+                removed += 1
+        return removed
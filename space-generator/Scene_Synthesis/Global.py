@@ -23,21 +23,10 @@ def in_bounds(positions, room, weight = 10):
         
     return weight * val 
 
-@safe_execution
-def no_overlap(positions, room, weight = 5):
-    """ This function ensures that no objects overlap in the room. This should be used in every objective function. 
-        
-        Args:
-        positions: list of floats, x, y, theta values for all objects in the room
-        room: rectangular Room object
-    """
-
-    val = 0
-    objs = room.moving_objects
-    indices = [i for i in range(len(room.moving_objects))]
-        
+def door_polygons(room):
+    ## The swing area of every door, which objects should not overlap
     doors = room.find_all('door')
-    door_polygons = [] 
+    polygons = [] 
     for door in doors: 
         door_corners = []
         if door.position[2] == 0:
@@ -62,7 +51,23 @@ def no_overlap(positions, room, weight = 5):
             door_corners += [[door.position[0], door.position[1] - door.width]]
 
         door_poly = Polygon(door_corners)
-        door_polygons += [door_poly]
+        polygons += [door_poly]
+    return polygons
+
+@safe_execution
+def no_overlap(positions, room, weight = 5):
+    """ This function ensures that no objects overlap in the room. This should be used in every objective function. 
+        
+        Args:
+        positions: list of floats, x, y, theta values for all objects in the room
+        room: rectangular Room object
+    """
+
+    val = 0
+    objs = room.moving_objects
+    indices = [i for i in range(len(room.moving_objects))]
+        
+    doors = door_polygons(room)
         
     for i in indices:
         
@@ -95,7 +100,7 @@ def no_overlap(positions, room, weight = 5):
                 lengths = np.linalg.norm(lengths, axis = 1)
                 val += sum(lengths**2)
         
-        for door in door_polygons:
+        for door in doors:
             intersection = poly1.intersection(door)
             if intersection.area > 0:
                 x = np.array([[i, j] for i, j in zip(intersection.exterior.xy[0], intersection.exterior.xy[1])])
@@ -1,6 +1,7 @@
 ## All the Individual Object constraint functions are defined here
 from Class_Structures import *
 from shapely.geometry import Polygon
+from functools import wraps
 
 ## Sides of Objects 
 # - Options for sides: 'front', 'back', 'left', 'right'. 
@@ -25,6 +26,7 @@ def corners(x, y, theta, w, l):
     return [TL(x, y, theta, w, l), TR(x, y, theta, w, l), BR(x, y, theta, w, l), BL(x, y, theta, w, l)]
 
 def safe_execution(func):
+    @wraps(func)
     def wrapper(*args, **kwargs):
         try:
             return func(*args, **kwargs)
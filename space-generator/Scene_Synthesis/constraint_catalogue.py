@@ -0,0 +1,81 @@
+## Builds the compact function catalogues that the language phase sends to the LLM.
+# Each catalogue lists the public functions of a constraint module as its real signature followed by the
+# first sentence of its docstring, e.g.
+#     ind_near_wall(positions, room, object_index, max_dist=0.5)  # This function ensures an object is near to a wall in a room.
+# The module's notes (the comments above its first definition, e.g. the definition of the object sides)
+# are kept as a header. Catalogues are cached in __pycache__, keyed by a hash of the module source.
+
+import hashlib
+import inspect
+import os
+import re
+
+# Bump when the catalogue format changes, so cached catalogues are rebuilt
+CATALOGUE_VERSION = 1
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__pycache__")
+
+
+def _defined_in(func, module):
+    """ True if func (unwrapped from decorators such as safe_execution) is defined in module's own file. """
+    try:
+        return os.path.abspath(inspect.getsourcefile(inspect.unwrap(func))) == os.path.abspath(module.__file__)
+    except TypeError:
+        return False
+
+
+def _summary(doc):
+    """ First sentence of a docstring, on one line (stops at a blank line or a section such as 'Args:'). """
+    lines = []
+    for line in inspect.cleandoc(doc).splitlines():
+        if not line.strip() or line.strip().endswith(":"):
+            break
+        lines.append(line.strip())
+    paragraph = " ".join(lines)
+    return re.split(r"(?<!e\.g\.)(?<!i\.e\.)(?<=[.!?])\s", paragraph, maxsplit = 1)[0]
+
+
+def _module_notes(source):
+    """ Top-level comment lines above the first function or class definition. """
+    notes = []
+    for line in source.splitlines():
+        if line.startswith(("def ", "class ", "@")):
+            break
+        if line.startswith("#"):
+            notes.append(line.rstrip())
+    return notes
+
+
+def build_catalogue(module):
+    """ The catalogue text of a module: its notes, then one line per public, documented function. """
+    with open(module.__file__, "r") as f:
+        lines = [f"# {os.path.basename(module.__file__)}"] + _module_notes(f.read())
+    functions = []
+    for name, func in inspect.getmembers(module, inspect.isfunction):
+        if name.startswith("_") or not func.__doc__ or not _defined_in(func, module):
+            continue
+        line_number = inspect.getsourcelines(inspect.unwrap(func))[1]
+        functions.append((line_number, f"{name}{inspect.signature(func)}  # {_summary(func.__doc__)}"))
+    return "\n".join(lines + [line for _, line in sorted(functions)]) + "\n"
+
+
+def load_catalogue(module, cache_dir = CACHE_DIR):
+    """ build_catalogue(module), read from / written to the on-disk cache. """
+    with open(module.__file__, "rb") as f:
+        digest = hashlib.sha256(f"{CATALOGUE_VERSION}\n".encode() + f.read()).hexdigest()[:16]
+    path = os.path.join(cache_dir, f"catalogue-{module.__name__}-{digest}.txt")
+    try:
+        with open(path, "r") as f:
+            return f.read()
+    except OSError:
+        pass
+
+    catalogue = build_catalogue(module)
+    try:
+        os.makedirs(cache_dir, exist_ok = True)
+        with open(f"{path}.{os.getpid()}.tmp", "w") as f:
+            f.write(catalogue)
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+    except OSError as e:
+        print(f"Could not cache the {module.__name__} catalogue: {e}")
+    return catalogue
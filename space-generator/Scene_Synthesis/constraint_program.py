@@ -0,0 +1,1060 @@
+## Declarative form of the objective functions written in the language phase.
+# optimize_primary_objects / optimize_secondary_objects are sums of terms such as
+#     output += check_and_call('io_next_to', positions, room, 2, 0, side1 = 'back', side2 = 'left')
+#     output += 10*balanced(positions, room)
+# parse_objective reads the source with ast (it is never executed) into a list of Constraint terms, and
+# compile_objective turns that list into a ConstraintObjective for scipy.optimize.minimize. The terms are grouped by
+# function and every group with a kernel below is evaluated for all of its terms in one NumPy pass. The kernels are
+# vectorised copies of the functions in Individual.py, InterObject.py and Global.py; any term without a kernel (or
+# with arguments a kernel does not cover) calls the constraint function itself, exactly as check_and_call did.
+# Every kernel also has an analytic gradient, so that minimize can be given value and gradient together (jac = True)
+# instead of estimating the gradient with 3N + 1 evaluations; the terms without a kernel are differenced on their own.
+
+import ast
+import copy
+import inspect
+from dataclasses import dataclass, field
+from functools import cached_property
+
+import numpy as np
+import shapely
+
+from Global import door_polygons
+
+
+class ConstraintParseError(ValueError):
+    """ The source is not a plain sum of constraint terms. """
+
+
+@dataclass
+class Constraint:
+    """ One term of an objective: weight * function(positions, room, object indices..., **params).
+
+        objects are the arguments named *_index, in the order of the function's signature. params are the other
+        arguments as written in the source (defaults are applied when the program is compiled).
+    """
+    function: str
+    objects: tuple = ()
+    params: dict = field(default_factory = dict)
+    weight: float = 1.0
+
+
+def _signature_arguments(func):
+    ## Names of the arguments after (positions, room)
+    return list(inspect.signature(func).parameters)[2:]
+
+
+def _literal(node):
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        raise ConstraintParseError(f"argument is not a literal: {ast.unparse(node)}")
+
+
+def _term(node, weight, variables, namespace):
+    """ The Constraint of the expression of one 'output += ...' line, or None for a check_and_call to an unknown function. """
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        return _term(node.operand, -weight if isinstance(node.op, ast.USub) else weight, variables, namespace)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Mult, ast.Div)):
+        for factor, call in ((node.left, node.right), (node.right, node.left)):
+            if isinstance(factor, ast.Constant) and isinstance(factor.value, (int, float)) and not (isinstance(node.op, ast.Div) and factor is node.left):
+                return _term(call, weight * factor.value if isinstance(node.op, ast.Mult) else weight / factor.value, variables, namespace)
+    if not isinstance(node, ast.Call) or not isinstance(node.func, ast.Name):
+        raise ConstraintParseError(f"term is not a constraint call: {ast.unparse(node)}")
+
+    args = node.args
+    checked = node.func.id == 'check_and_call'
+    if checked:
+        if not args or not isinstance(args[0], ast.Constant) or not isinstance(args[0].value, str):
+            raise ConstraintParseError(f"check_and_call without a function name: {ast.unparse(node)}")
+        name, args = args[0].value, args[1:]
+    else:
+        name = node.func.id
+    if len(args) < 2 or [getattr(arg, 'id', None) for arg in args[:2]] != variables:
+        raise ConstraintParseError(f"{name} is not called with ({', '.join(variables)})")
+    if any(keyword.arg is None for keyword in node.keywords):
+        raise ConstraintParseError(f"{name} is called with **kwargs")
+
+    func = namespace.get(name)
+    if not callable(func):
+        if checked:
+            ## check_and_call returns 0 for functions that do not exist
+            print(f"Skipping the unknown constraint function {name}")
+            return None
+        raise ConstraintParseError(f"unknown function {name}")
+    try:
+        bound = inspect.signature(func).bind(None, None, *[_literal(arg) for arg in args[2:]],
+                                             **{keyword.arg: _literal(keyword.value) for keyword in node.keywords})
+    except TypeError as e:
+        raise ConstraintParseError(f"{name}: {e}")
+
+    arguments = list(bound.arguments.items())[2:]
+    objects = tuple(value for argument, value in arguments if argument.endswith('_index'))
+    params = {argument: value for argument, value in arguments if not argument.endswith('_index')}
+    return Constraint(name, objects, params, weight)
+
+
+def parse_objective(source, namespace):
+    """ The list of Constraint terms of an objective function source (one 'def f(positions, room)' summing terms).
+
+        namespace maps function names to the constraint functions (the globals of scene_synthesis).
+        Raises ConstraintParseError for anything other than 'output = 0', 'output += <weight> * <call>' and 'return output'.
+    """
+    try:
+        tree = ast.parse(source)
+    except SyntaxError as e:
+        raise ConstraintParseError(f"invalid syntax: {e}")
+    if len(tree.body) != 1 or not isinstance(tree.body[0], ast.FunctionDef):
+        raise ConstraintParseError("expected a single function definition")
+    function = tree.body[0]
+    variables = [arg.arg for arg in function.args.args]
+    if len(variables) != 2 or function.args.vararg or function.args.kwarg or function.args.kwonlyargs:
+        raise ConstraintParseError(f"expected {function.name}(positions, room)")
+
+    output = None
+    constraints = []
+    for statement in function.body:
+        if isinstance(statement, ast.Pass) or (isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Constant)):
+            continue
+        if (output is None and isinstance(statement, ast.Assign) and len(statement.targets) == 1 and isinstance(statement.targets[0], ast.Name)
+                and isinstance(statement.value, ast.Constant) and statement.value.value == 0):
+            output = statement.targets[0].id
+        elif (output and isinstance(statement, ast.AugAssign) and isinstance(statement.target, ast.Name) and statement.target.id == output
+                and isinstance(statement.op, (ast.Add, ast.Sub))):
+            constraint = _term(statement.value, -1.0 if isinstance(statement.op, ast.Sub) else 1.0, variables, namespace)
+            if constraint:
+                constraints.append(constraint)
+        elif output and isinstance(statement, ast.Return) and isinstance(statement.value, ast.Name) and statement.value.id == output:
+            return constraints
+        else:
+            raise ConstraintParseError(f"unsupported statement: {ast.unparse(statement)}")
+    raise ConstraintParseError(f"{function.name} does not return {output or 'its output'}")
+
+
+## Kernels
+# A kernel is registered for a constraint function with @kernel(name, accepts). build(terms, layout) receives the
+# (arguments, weight) pairs of all the accepted terms of that function, where arguments holds every argument after
+# (positions, room) with the defaults applied, and returns evaluate(state) -> sum of the weighted terms, where state is
+# the _State of the positions being evaluated. When state.gradient is set, evaluate also adds the gradient of that sum
+# to state.d_poses and / or state.d_corners.
+
+KERNELS = {}
+
+
+def kernel(name, accepts = None):
+    def register(build):
+        KERNELS[name] = (build, accepts or (lambda arguments: True))
+        return build
+    return register
+
+
+def _numbers(*names):
+    return lambda arguments: all(isinstance(arguments[name], (int, float, np.number)) for name in names)
+
+
+class _Layout:
+    """ The parts of the room that stay fixed during one minimize: object sizes and the objects already placed (fm_indices).
+
+        A batched layout (batch = K) holds K copies of the room's objects side by side, object i of copy k being object
+        k*size + i, so that the kernels evaluate K candidate positions in one pass and return one value per copy.
+    """
+
+    def __init__(self, room, batch = None):
+        objects = room.moving_objects
+        copies = batch or 1
+        self.room = room
+        self.batch = batch
+        self.size = len(objects)
+        self.count = self.size * copies
+        self.widths = np.tile(np.array([obj.width for obj in objects], dtype = float), copies)
+        self.lengths = np.tile(np.array([obj.length for obj in objects], dtype = float), copies)
+        placed = np.zeros((self.size, 3))
+        for i in room.fm_indices:
+            if i < self.size:
+                placed[i] = objects[i].position
+        self.placed = np.tile(placed, (copies, 1))
+        free = np.array([i for i in range(self.size) if i not in room.fm_indices], dtype = int)
+        self.free = (free + self.size*np.arange(copies)[:, None]).ravel()
+        self.copies = np.repeat(np.arange(copies), self.size)
+
+    def poses(self, positions):
+        ## (N, 3) x, y, theta of every object, as get_position reads them
+        poses = self.placed.copy()
+        poses[self.free] = np.reshape(positions, (len(self.free), 3))
+        return poses
+
+    def pairs(self):
+        ## every pair (first < second) of objects of the same copy
+        first, second = np.triu_indices(self.size, k = 1)
+        offsets = self.size*np.arange(self.batch or 1)[:, None]
+        return (first + offsets).ravel(), (second + offsets).ravel()
+
+    def copy_of(self, index):
+        ## the objects of the copy that object index belongs to
+        start = index - index % self.size
+        return range(start, start + self.size)
+
+    def zeros(self):
+        return 0.0 if self.batch is None else np.zeros(self.batch)
+
+    def sum(self, values, objects = None):
+        ## the sum of values (one row per object in objects, default all), per copy when batched
+        if self.batch is None:
+            return values.sum()
+        rows = values.sum(axis = tuple(range(1, values.ndim)))
+        return np.bincount(self.copies if objects is None else self.copies[objects], weights = rows, minlength = self.batch)
+
+    def dot(self, weights, values, objects):
+        ## weights @ values for terms of the objects, per copy when batched
+        if self.batch is None:
+            return weights @ values
+        return np.bincount(self.copies[objects], weights = weights * values, minlength = self.batch)
+
+
+class _State:
+    """ One evaluation: the positions, the poses of all objects and (computed once, when a kernel needs them) their corners.
+        With gradient, also the gradient of the objective with respect to the poses and the corners.
+    """
+
+    def __init__(self, layout, positions, gradient = False):
+        self.layout = layout
+        self.positions = positions
+        self.poses = layout.poses(positions)
+        self.gradient = gradient
+        if gradient:
+            self.d_poses = np.zeros((layout.count, 3))
+            self.d_corners = np.zeros((layout.count, 4, 2))
+
+    def pose_gradient(self):
+        ## d_poses with d_corners carried over: a corner moves with x, y, and turns about the centre with theta
+        offsets = self.corners - self.poses[:, None, :2]
+        d_poses = self.d_poses.copy()
+        d_poses[:, :2] += self.d_corners.sum(axis = 1)
+        d_poses[:, 2] += (self.d_corners[..., 1]*offsets[..., 0] - self.d_corners[..., 0]*offsets[..., 1]).sum(axis = 1)
+        return d_poses
+
+    @cached_property
+    def corners(self):
+        ## (N, 4, 2) corners TL, TR, BR, BL, computed in the same order as Individual.corners (so that comparisons
+        ## between equal sides, e.g. in io_next_to, come out the same)
+        x, y, theta = self.poses[:, 0], self.poses[:, 1], self.poses[:, 2]
+        w, l = self.layout.widths/2, self.layout.lengths/2
+        wc, ls, ws, lc = w * np.cos(theta), l * np.sin(theta), w * np.sin(theta), l * np.cos(theta)
+        return np.stack([np.stack([x - wc + ls, x + wc + ls, x + wc - ls, x - wc - ls], axis = -1),
+                         np.stack([y - ws - lc, y + ws - lc, y + ws + lc, y - ws + lc], axis = -1)], axis = -1)
+
+
+def _column(terms, name, dtype = float):
+    return np.array([arguments[name] for arguments, _ in terms], dtype = dtype)
+
+
+def _weights(terms, name = None):
+    ## term weights, times the function's own weight argument if it has one
+    return np.array([weight * (arguments[name] if name else 1.0) for arguments, weight in terms], dtype = float)
+
+
+## Corners (TL, TR, BR, BL) of the sides back, front, left, right
+SIDE_CORNERS = np.array([[0, 1], [2, 3], [0, 3], [1, 2]])
+SIDE_ROWS = {'top': 0, 'back': 0, 'bottom': 1, 'front': 1, 'left': 2, 'right': 3}
+SIDE_INCIDENCE = np.zeros((4, 4))
+SIDE_INCIDENCE[np.arange(4)[:, None], SIDE_CORNERS] = 1
+
+
+def _side_row(side):
+    return SIDE_ROWS.get(side, 0) if isinstance(side, str) else 0
+
+
+def _wall_side_distances(cs, room):
+    ## [M, side, wall]: distance of each side (back, front, left, right) to each wall (N, E, S, W), summed over its two corners
+    x, y = cs[..., 0], cs[..., 1]
+    distances = np.stack([np.abs(y - room.length), np.abs(x - room.width), np.abs(y), np.abs(x)], axis = -1)
+    return distances[:, SIDE_CORNERS[:, 0], :] + distances[:, SIDE_CORNERS[:, 1], :]
+
+
+def _wall_side_distances_gradient(cs, room, d_distances):
+    ## d/d(cs) of the sum of d_distances [M, side, wall] times _wall_side_distances(cs, room)
+    x, y = cs[..., 0], cs[..., 1]
+    signs = np.stack([np.sign(y - room.length), np.sign(x - room.width), np.sign(y), np.sign(x)], axis = -1)
+    d_corners = np.einsum('sc,msw->mcw', SIDE_INCIDENCE, d_distances) * signs
+    return np.stack([d_corners[..., 1] + d_corners[..., 3], d_corners[..., 0] + d_corners[..., 2]], axis = -1)
+
+
+def _near_wall(cs, room, max_dist, gradient = False):
+    ## Individual.ind_near_wall of the boxes cs (M, 4, 2); with gradient, (values, d/d(cs) of their sum)
+    side_distances = _wall_side_distances(cs, room)/2
+    rows = np.arange(len(cs))
+    walls = np.argmin(side_distances[:, 0, :], axis = -1)
+    ds = side_distances[rows, :, walls]
+    val = np.minimum(max_dist - ds.min(axis = -1), 0.0)**2 + (np.maximum(ds[:, :1] - ds[:, 1:], 0.0)**2).sum(axis = -1)
+    if not gradient:
+        return val
+    d_ds = np.zeros_like(ds)
+    d_ds[rows, np.argmin(ds, axis = -1)] = -2*np.minimum(max_dist - ds.min(axis = -1), 0.0)
+    behind = 2*np.maximum(ds[:, :1] - ds[:, 1:], 0.0)
+    d_ds[:, 0] += behind.sum(axis = -1)
+    d_ds[:, 1:] -= behind
+    d_distances = np.zeros(side_distances.shape)
+    d_distances[rows, :, walls] = d_ds/2
+    return val, _wall_side_distances_gradient(cs, room, d_distances)
+
+
+def _dot(a, b):
+    ## row-wise dot products of (M, 2) vectors, rounded as np.dot / np.linalg.norm round a single vector (so that
+    ## comparisons such as the equal sides in io_next_to come out the same)
+    return (a[:, None, :] @ b[:, :, None])[:, 0, 0]
+
+
+def _norm(a):
+    return np.sqrt(_dot(a, a))
+
+
+def _angle_difference(theta1, theta2):
+    return (theta1 % (2*np.pi) - theta2 % (2*np.pi))**2
+
+
+def _cross(a, b):
+    return a[..., 0]*b[..., 1] - a[..., 1]*b[..., 0]
+
+
+def _unit_gradient(direction, d_unit):
+    ## d/d(direction) of d_unit . direction/|direction|
+    norm = np.linalg.norm(direction, axis = -1)[..., None]
+    unit = direction/norm
+    return (d_unit - (d_unit*unit).sum(axis = -1)[..., None]*unit)/norm
+
+
+def _distance_gradient(poses, first, second, d_distances):
+    ## d/d(poses) of the sum of d_distances times _distance(poses, first, second)
+    d_poses = np.zeros(poses.shape)
+    delta = poses[first, :2] - poses[second, :2]
+    distances = np.linalg.norm(delta, axis = -1)
+    d_delta = np.where(distances > 0, d_distances, 0.0)[:, None] * delta/np.where(distances > 0, distances, 1.0)[:, None]
+    np.add.at(d_poses[:, :2], first, d_delta)
+    np.add.at(d_poses[:, :2], second, -d_delta)
+    return d_poses
+
+
+@kernel('in_bounds', _numbers('weight'))
+def _in_bounds(terms, layout):
+    weight, room = _weights(terms, 'weight').sum(), layout.room
+    def evaluate(state):
+        x, y = state.corners[..., 0], state.corners[..., 1]
+        val = np.maximum(0, x - room.width)**2 + np.maximum(0, y - room.length)**2 + np.maximum(0, -x)**2 + np.maximum(0, -y)**2
+        if state.gradient:
+            state.d_corners += weight * 2 * np.stack([np.maximum(0, x - room.width) - np.maximum(0, -x),
+                                                      np.maximum(0, y - room.length) - np.maximum(0, -y)], axis = -1)
+        return weight * layout.sum(val)
+    return evaluate
+
+
+def _overlap_edges(geometries, min_area = 0):
+    ## Squared edge lengths of each overlap summed, as no_overlap and ind_accessible measure them (0 for an area of at
+    ## most min_area). nan for an overlap that is not a single polygon, on which those functions fail (safe_execution: 0)
+    sums = np.zeros(len(geometries))
+    overlapping = shapely.area(geometries) > min_area
+    geometries = geometries[overlapping]
+    if len(geometries):
+        polygon = shapely.get_type_id(geometries) == shapely.GeometryType.POLYGON
+        coords, index = shapely.get_coordinates(shapely.get_exterior_ring(geometries[polygon]), return_index = True)
+        edges = (np.diff(coords, axis = 0)**2).sum(axis = -1)
+        same = index[1:] == index[:-1]
+        values = np.full(len(geometries), np.nan)
+        values[polygon] = np.bincount(index[1:][same], weights = edges[same], minlength = polygon.sum())
+        sums[overlapping] = values
+    return sums
+
+
+def _overlap_edges_gradient(geometries, corners1, corners2, min_area = 0):
+    ## _overlap_edges of the intersections of the polygons corners1 and corners2 (P, 4, 2), with the gradients of each
+    ## sum with respect to corners1 and corners2. A vertex of an overlap is either a corner of one of the polygons, which
+    ## moves with that corner, or the crossing of a side of each, which moves with both sides (implicit differentiation of
+    ## the two line equations)
+    d_corners1, d_corners2 = np.zeros(corners1.shape), np.zeros(corners2.shape)
+    if not len(geometries):
+        return np.zeros(0), d_corners1, d_corners2
+    sums = _overlap_edges(geometries, min_area)
+    overlaps = np.nonzero(~np.isnan(sums) & (sums > 0))[0]
+    if not len(overlaps):
+        return sums, d_corners1, d_corners2
+    coords, index = shapely.get_coordinates(shapely.get_exterior_ring(geometries[overlaps]), return_index = True)
+    pair = overlaps[index]
+    same = np.nonzero(index[1:] == index[:-1])[0]
+    edges = coords[same + 1] - coords[same]
+    d_coords = np.zeros(coords.shape)
+    np.add.at(d_coords, same, -2*edges)
+    np.add.at(d_coords, same + 1, 2*edges)
+
+    a, b = corners1[pair], corners2[pair]
+    tolerance = 1e-9 * (1 + np.abs(coords).max())
+    to_a, to_b = np.abs(a - coords[:, None]).max(axis = -1), np.abs(b - coords[:, None]).max(axis = -1)
+    at_a = to_a.min(axis = -1) <= tolerance
+    at_b = ~at_a & (to_b.min(axis = -1) <= tolerance)
+    np.add.at(d_corners1, (pair[at_a], np.argmin(to_a[at_a], axis = -1)), d_coords[at_a])
+    np.add.at(d_corners2, (pair[at_b], np.argmin(to_b[at_b], axis = -1)), d_coords[at_b])
+
+    crossing = np.nonzero(~at_a & ~at_b)[0]
+    if len(crossing):
+        v, d_v = coords[crossing], d_coords[crossing]
+        def side(corners):
+            ## the side (start corner index, start, end) that the crossing lies on
+            starts, ends = corners[crossing], np.roll(corners[crossing], -1, axis = 1)
+            residuals = np.abs(_cross(ends - starts, v[:, None] - starts))/np.linalg.norm(ends - starts, axis = -1)
+            k = np.argmin(residuals, axis = -1)
+            rows = np.arange(len(crossing))
+            return k, starts[rows, k], ends[rows, k]
+        k1, p1, p2 = side(a)
+        k2, q1, q2 = side(b)
+        direction1, direction2 = p2 - p1, q2 - q1
+        det = _cross(direction1, direction2)
+        ok = np.abs(det) > 1e-12
+        det = np.where(ok, det, 1.0)
+        ## multipliers of the line equations cross(direction1, v - p1) = 0 and cross(direction2, v - q1) = 0
+        lambda1 = np.where(ok, -(direction2*d_v).sum(axis = -1)/det, 0.0)[:, None]
+        lambda2 = np.where(ok, (direction1*d_v).sum(axis = -1)/det, 0.0)[:, None]
+        for d_corners, k, lam, start, direction in ((d_corners1, k1, lambda1, p1, direction1), (d_corners2, k2, lambda2, q1, direction2)):
+            offset = v - start
+            d_start = np.stack([direction[:, 1] - offset[:, 1], offset[:, 0] - direction[:, 0]], axis = -1)
+            d_end = np.stack([offset[:, 1], -offset[:, 0]], axis = -1)
+            np.add.at(d_corners, (pair[crossing], k), lam*d_start)
+            np.add.at(d_corners, (pair[crossing], (k + 1) % 4), lam*d_end)
+    return sums, d_corners1, d_corners2
+
+
+def _boxes_overlap(low1, high1, low2, high2):
+    ## bounding boxes (x, y) that overlap with an area; only these pairs can have an overlap with an area
+    return ((low1 < high2) & (low2 < high1)).all(axis = -1)
+
+
+@kernel('no_overlap', _numbers('weight'))
+def _no_overlap(terms, layout):
+    weight = _weights(terms, 'weight').sum()
+    doors = np.array(door_polygons(layout.room), dtype = object)
+    door_low = np.array([shapely.bounds(door)[:2] for door in doors]).reshape(-1, 2)
+    door_high = np.array([shapely.bounds(door)[2:] for door in doors]).reshape(-1, 2)
+    door_corners = np.array([shapely.get_coordinates(door)[:4] for door in doors]).reshape(-1, 4, 2)
+    first, second = layout.pairs()
+    def evaluate(state):
+        cs = state.corners
+        valid = ~np.isnan(cs).any(axis = (-2, -1))
+        low, high = cs.min(axis = 1), cs.max(axis = 1)
+        pairs = valid[first] & valid[second] & _boxes_overlap(low[first], high[first], low[second], high[second])
+        door_pairs = valid[:, None] & _boxes_overlap(low[:, None], high[:, None], door_low, door_high)
+        if not pairs.any() and not door_pairs.any():
+            return layout.zeros()
+        polygons = np.full(layout.count, None, dtype = object)
+        polygons[valid] = shapely.polygons(cs[valid])
+        objects, door_indices = np.nonzero(door_pairs)
+        overlaps = shapely.intersection(polygons[first[pairs]], polygons[second[pairs]])
+        door_overlaps = shapely.intersection(polygons[objects], doors[door_indices])
+        if layout.batch:
+            val = layout.sum(_overlap_edges(overlaps), first[pairs]) + 100 * layout.sum(_overlap_edges(door_overlaps), objects)
+            return np.where(np.isnan(val), 0.0, weight * val)
+        if not state.gradient:
+            val = _overlap_edges(overlaps).sum() + 100 * _overlap_edges(door_overlaps).sum()
+            return 0.0 if np.isnan(val) else weight * val
+        sums, d_first, d_second = _overlap_edges_gradient(overlaps, cs[first[pairs]], cs[second[pairs]])
+        door_sums, d_objects, _ = _overlap_edges_gradient(door_overlaps, cs[objects], door_corners[door_indices])
+        val = sums.sum() + 100 * door_sums.sum()
+        if np.isnan(val):
+            return 0.0
+        np.add.at(state.d_corners, first[pairs], weight * d_first)
+        np.add.at(state.d_corners, second[pairs], weight * d_second)
+        np.add.at(state.d_corners, objects, weight * 100 * d_objects)
+        return weight * val
+    return evaluate
+
+
+@kernel('aligned')
+def _aligned(terms, layout):
+    weight = _weights(terms).sum()
+    def evaluate(state):
+        if state.gradient:
+            state.d_poses[layout.free, 2] += weight * 2*np.sin(4*state.positions[2::3])/5
+        return weight * layout.sum(np.sin(2*state.positions[2::3])**2/5, layout.free)
+    return evaluate
+
+
+@kernel('balanced')
+def _balanced(terms, layout):
+    weight, room = _weights(terms).sum(), layout.room
+    areas = layout.widths * layout.lengths
+    def evaluate(state):
+        if layout.batch:
+            if len(layout.free) == layout.batch:
+                return layout.zeros()
+            av = np.einsum('n,knd->kd', areas[:layout.size], state.poses[:, :2].reshape(layout.batch, layout.size, 2)) / areas[:layout.size].sum()
+            return weight * ((av[:, 0] - room.width/2)**2 + (av[:, 1] - room.length/2)**2)
+        if state.positions.shape[0] == 3:
+            return 0.0
+        av_x, av_y = areas @ state.poses[:, :2] / areas.sum()
+        if state.gradient:
+            state.d_poses[:, :2] += weight * 2*np.outer(areas/areas.sum(), [av_x - room.width/2, av_y - room.length/2])
+        return weight * ((av_x - room.width/2)**2 + (av_y - room.length/2)**2)
+    return evaluate
+
+
+@kernel('wall_attraction')
+def _wall_attraction(terms, layout):
+    weight = _weights(terms).sum()
+    max_dist = np.sqrt(layout.widths**2 + layout.lengths**2)/2 + 0.5
+    def evaluate(state):
+        if state.gradient:
+            val, d_corners = _near_wall(state.corners, layout.room, max_dist, gradient = True)
+            state.d_corners += weight * 0.05 * d_corners
+            return weight * 0.05 * val.sum()
+        return weight * 0.05 * layout.sum(_near_wall(state.corners, layout.room, max_dist))
+    return evaluate
+
+
+@kernel('ind_near_wall', _numbers('max_dist'))
+def _ind_near_wall(terms, layout):
+    weights, objects, max_dist = _weights(terms), _column(terms, 'object_index', int), _column(terms, 'max_dist')
+    def evaluate(state):
+        if state.gradient:
+            val, d_corners = _near_wall(state.corners[objects], layout.room, max_dist, gradient = True)
+            np.add.at(state.d_corners, objects, weights[:, None, None] * d_corners)
+            return layout.dot(weights, val, objects)
+        return layout.dot(weights, _near_wall(state.corners[objects], layout.room, max_dist), objects)
+    return evaluate
+
+
+@kernel('ind_next_to_wall')
+def _ind_next_to_wall(terms, layout):
+    weights, objects = _weights(terms), _column(terms, 'object_index', int)
+    sides = np.array([_side_row(arguments['side']) for arguments, _ in terms])
+    rows = np.arange(len(terms))
+    def evaluate(state):
+        side_distances = _wall_side_distances(state.corners[objects], layout.room)
+        side = side_distances[rows, sides]
+        walls = np.argmin(side, axis = -1)
+        ds = side_distances[rows, :, walls]
+        val = np.minimum(side[:, 0], side[:, 2]) * np.minimum(side[:, 1], side[:, 3])
+        val += (np.maximum(ds[rows, sides][:, None] - ds, 0.0)**2).sum(axis = -1)
+        if state.gradient:
+            d_side = np.zeros(side.shape)
+            d_side[rows, np.where(side[:, 0] <= side[:, 2], 0, 2)] += np.minimum(side[:, 1], side[:, 3])
+            d_side[rows, np.where(side[:, 1] <= side[:, 3], 1, 3)] += np.minimum(side[:, 0], side[:, 2])
+            behind = 2*np.maximum(ds[rows, sides][:, None] - ds, 0.0)
+            d_ds = -behind
+            d_ds[rows, sides] += behind.sum(axis = -1)
+            d_distances = np.zeros(side_distances.shape)
+            d_distances[rows, sides] += d_side
+            d_distances[rows, :, walls] += d_ds
+            np.add.at(state.d_corners, objects, (2*weights)[:, None, None] * _wall_side_distances_gradient(state.corners[objects], layout.room, d_distances))
+        return layout.dot(weights, 2*val, objects)
+    return evaluate
+
+
+def _region_index(room, region_name):
+    ## The region ind_in_region uses, or None (the term is then 0)
+    regions = room.regions
+    region_index = room.find_region_index(region_name)
+    if region_index is None and " " in region_name:
+        first, second = region_name.split(" ")[:2]
+        names = [first.capitalize() + " " + second.capitalize(), first.lower() + " " + second.lower(), first.capitalize() + " " + second.lower()]
+        for r in regions:
+            if r.name in names:
+                return regions.index(r)
+    if region_index is not None and not 0 <= region_index < len(regions):
+        return None
+    return region_index
+
+
+@kernel('ind_in_region', lambda arguments: isinstance(arguments['region_name'], str) and _numbers('weight')(arguments))
+def _ind_in_region(terms, layout):
+    room = layout.room
+    region_indices = [_region_index(room, arguments['region_name']) for arguments, _ in terms]
+    terms = [term for term, region_index in zip(terms, region_indices) if region_index is not None]
+    region_indices = np.array([region_index for region_index in region_indices if region_index is not None], dtype = int)
+    weights, objects = _weights(terms, 'weight'), _column(terms, 'object_index', int)
+    centres = np.array([[region.x, region.y] for region in room.regions], dtype = float).reshape(-1, 2)
+    rows = np.arange(len(terms))
+    def evaluate(state):
+        if not len(terms):
+            return layout.zeros()
+        distances = np.linalg.norm(state.poses[objects, None, :2] - centres, axis = -1)
+        r_dist = distances[rows, region_indices]
+        if state.gradient:
+            closer = 2*np.minimum(distances - r_dist[:, None], 0.0)
+            d_distances = closer
+            d_distances[rows, region_indices] -= closer.sum(axis = -1)
+            offsets = state.poses[objects, None, :2] - centres
+            d_distances = np.where(distances > 0, d_distances/np.where(distances > 0, distances, 1.0), 0.0)
+            np.add.at(state.d_poses[:, :2], objects, weights[:, None] * (d_distances[..., None]*offsets).sum(axis = 1))
+        return layout.dot(weights, (np.minimum(distances - r_dist[:, None], 0.0)**2).sum(axis = -1), objects)
+    return evaluate
+
+
+## ind_accessible: the corners (TL, TR, BR, BL) projected outwards from each side (back, front, left, right), as
+## (corner, towards corner) pairs, and the clearance polygon of the side over [TL, TR, BR, BL, projected 1, projected 2]
+ACCESS_PROJECTIONS = np.array([[[0, 3], [1, 2]], [[3, 0], [2, 1]], [[0, 1], [3, 2]], [[1, 0], [2, 3]]])
+ACCESS_POLYGONS = np.array([[0, 1, 5, 4], [4, 5, 2, 3], [0, 4, 5, 3], [4, 1, 2, 5]])
+RUG_NAMES = ['rug', 'mat', 'Rug', 'Mat', 'RUG', 'MAT', 'carpet', 'Carpet']
+
+
+def _is_rug(obj):
+    return any(name in obj.name for name in RUG_NAMES)
+
+
+def _accessible_sides(sides, obj):
+    ## The sides ind_accessible clears for a list of side names (it uses the front alone if any name is unknown)
+    if sides == []:
+        sides = ['front']
+    if sides == ['sides']:
+        sides = ['left', 'right']
+    sides = [('front' if obj.width > obj.length else 'left') if side == 'short' else side for side in sides]
+    if any(side not in SIDE_ROWS for side in sides):
+        return ['front']
+    return sides
+
+
+@kernel('ind_accessible', lambda arguments: isinstance(arguments['sides'], (list, tuple)) and all(isinstance(side, str) for side in arguments['sides'])
+                                            and 'long' not in arguments['sides'] and (arguments['min_dist'] is None or _numbers('min_dist')(arguments)))
+def _ind_accessible(terms, layout):
+    ## 'long' picks a side at random, so those terms call ind_accessible itself
+    room, objs = layout.room, layout.room.moving_objects
+    terms = [(arguments, weight) for arguments, weight in terms if not _is_rug(objs[arguments['object_index'] % layout.size])]
+    term_rows, row_objects, row_sides, row_distances = [], [], [], []
+    for t, (arguments, _) in enumerate(terms):
+        obj = objs[arguments['object_index'] % layout.size]
+        distance = arguments['min_dist'] if arguments['min_dist'] else min(1, np.max([obj.width, obj.length, 0.5]))
+        for side in _accessible_sides(list(arguments['sides']), obj):
+            term_rows.append(t)
+            row_objects.append(arguments['object_index'])
+            row_sides.append(SIDE_ROWS[side])
+            row_distances.append(distance)
+    term_rows, row_objects, row_sides = np.array(term_rows, dtype = int), np.array(row_objects, dtype = int), np.array(row_sides, dtype = int)
+    row_distances = np.array(row_distances, dtype = float)
+    weights, objects = _weights(terms), _column(terms, 'object_index', int)
+
+    ## every clearance polygon against every other moving object (of the same copy) that is not a rug, and against the doors
+    others = [(row, i) for row, obj_index in enumerate(row_objects) for i in layout.copy_of(obj_index) if i != obj_index and not _is_rug(objs[i % layout.size])]
+    other_rows, other_objects = np.array(others, dtype = int).reshape(-1, 2).T
+    doors = np.array([shapely.Polygon(f_obj.corners()) for f_obj in room.fixed_objects if f_obj.name == 'door'], dtype = object)
+    door_corners = np.array([shapely.get_coordinates(door)[:4] for door in doors]).reshape(-1, 4, 2)
+    door_low = np.array([shapely.bounds(door)[:2] for door in doors]).reshape(-1, 2)
+    door_high = np.array([shapely.bounds(door)[2:] for door in doors]).reshape(-1, 2)
+    rows = np.arange(len(row_objects))
+
+    def evaluate(state):
+        if not len(terms):
+            return layout.zeros()
+        cs = state.corners
+        row_corners = cs[row_objects]
+        projections = ACCESS_PROJECTIONS[row_sides]
+        start, towards = row_corners[rows[:, None], projections[..., 0]], row_corners[rows[:, None], projections[..., 1]]
+        direction = start - towards
+        projected = start + row_distances[:, None, None] * direction/np.linalg.norm(direction, axis = -1)[..., None]
+        valid = ~np.isnan(projected).any(axis = (-2, -1))
+        x, y = projected[..., 0], projected[..., 1]
+        val = np.bincount(term_rows, weights = np.where(valid, (np.minimum(0.0, x)**2 + np.minimum(0.0, y)**2 + np.maximum(0.0, x - room.width)**2
+                                                                + np.maximum(0.0, y - room.length)**2).sum(axis = -1), 0.0), minlength = len(terms))
+        if state.gradient:
+            d_projected = np.where(valid[:, None, None], 2*np.stack([np.maximum(0.0, x - room.width) + np.minimum(0.0, x),
+                                                                     np.maximum(0.0, y - room.length) + np.minimum(0.0, y)], axis = -1), 0.0)
+            d_points = np.zeros((len(rows), 4, 2))
+
+        points = np.concatenate([row_corners, projected], axis = 1)[rows[:, None], ACCESS_POLYGONS[row_sides]]
+        low, high = points.min(axis = 1), points.max(axis = 1)
+        pairs = valid[other_rows] & _boxes_overlap(low[other_rows], high[other_rows], cs[other_objects].min(axis = 1), cs[other_objects].max(axis = 1))
+        door_rows, door_indices = np.nonzero(valid[:, None] & _boxes_overlap(low[:, None], high[:, None], door_low, door_high))
+        if pairs.any() or len(door_rows):
+            clearances = np.full(len(rows), None, dtype = object)
+            clearances[valid] = shapely.polygons(points[valid])
+            blocked = other_rows[pairs]
+            overlaps = shapely.intersection(clearances[blocked], shapely.polygons(cs[other_objects[pairs]]))
+            door_overlaps = shapely.intersection(clearances[door_rows], doors[door_indices])
+            if state.gradient:
+                sums, d_blocked, d_others = _overlap_edges_gradient(overlaps, points[blocked], cs[other_objects[pairs]], 1e-3)
+                door_sums, d_door_rows, _ = _overlap_edges_gradient(door_overlaps, points[door_rows], door_corners[door_indices], 1e-3)
+                np.add.at(d_points, blocked, d_blocked)
+                np.add.at(d_points, door_rows, 5 * d_door_rows)
+            else:
+                sums, door_sums = _overlap_edges(overlaps, 1e-3), _overlap_edges(door_overlaps, 1e-3)
+            val += np.bincount(term_rows[blocked], minlength = len(terms), weights = sums)
+            val += np.bincount(term_rows[door_rows], minlength = len(terms), weights = 5 * door_sums)
+
+        if state.gradient:
+            ## a term whose overlap could not be measured is 0 (safe_execution), as is its gradient
+            scale = np.where(np.isnan(val), 0.0, 3*weights)[term_rows]
+            if pairs.any():
+                np.add.at(state.d_corners, other_objects[pairs], scale[blocked][:, None, None] * d_others)
+            d_both = np.zeros((len(rows), 6, 2))
+            np.add.at(d_both, (rows[:, None], ACCESS_POLYGONS[row_sides]), d_points)
+            d_row_corners, d_projected = d_both[:, :4], d_both[:, 4:] + d_projected
+            d_direction = _unit_gradient(direction, row_distances[:, None, None] * d_projected)
+            np.add.at(d_row_corners, (rows[:, None], projections[..., 0]), d_projected + d_direction)
+            np.add.at(d_row_corners, (rows[:, None], projections[..., 1]), -d_direction)
+            np.add.at(state.d_corners, row_objects, scale[:, None, None] * np.where(valid[:, None, None], d_row_corners, 0.0))
+        return layout.dot(weights, np.where(np.isnan(val), 0.0, 3*val), objects)
+    return evaluate
+
+
+@kernel('ind_central')
+def _ind_central(terms, layout):
+    weights, objects, room = _weights(terms), _column(terms, 'object_index', int), layout.room
+    both = np.array([bool(arguments['both']) for arguments, _ in terms])
+    lower_x, upper_x, lower_y, upper_y = room.width/3, 2*room.width/3, room.length/3, 2*room.length/3
+    def evaluate(state):
+        x, y, theta = state.poses[objects].T
+        below_x, above_x = np.minimum(x - lower_x, 0.0), np.minimum(upper_x - x, 0.0)
+        below_y, above_y = np.minimum(y - lower_y, 0.0), np.minimum(upper_y - y, 0.0)
+        centred = below_x**2 + above_x**2 + below_y**2 + above_y**2 + 0.01*((x - room.width/2)**2 + (y - room.length/2)**2)
+        val = np.where(both, centred, (below_x + above_x)*(below_y + above_y)) + np.sin(2*theta)**2/5
+        if state.gradient:
+            inside_x = (x < lower_x).astype(float) - (x > upper_x)
+            inside_y = (y < lower_y).astype(float) - (y > upper_y)
+            d_x = np.where(both, 2*(below_x - above_x) + 0.02*(x - room.width/2), inside_x*(below_y + above_y))
+            d_y = np.where(both, 2*(below_y - above_y) + 0.02*(y - room.length/2), inside_y*(below_x + above_x))
+            np.add.at(state.d_poses, objects, weights[:, None] * np.stack([d_x, d_y, 2*np.sin(4*theta)/5], axis = -1))
+        return layout.dot(weights, val, objects)
+    return evaluate
+
+
+@kernel('ind_away_from_fixed_object', _numbers('min_dist'))
+def _ind_away_from_fixed_object(terms, layout):
+    room = layout.room
+    points = [np.array([f_obj.position[:2] for f_obj in room.find_all(arguments['fixed_object_type'])], dtype = float).reshape(-1, 2)
+              for arguments, _ in terms]
+    count = max([len(p) for p in points] + [1])
+    fixed = np.zeros((len(terms), count, 2))
+    present = np.zeros((len(terms), count), dtype = bool)
+    for i, p in enumerate(points):
+        fixed[i, :len(p)], present[i, :len(p)] = p, True
+    weights, objects = _weights(terms), _column(terms, 'object_index', int)
+    reach = _column(terms, 'min_dist') + np.sqrt((layout.widths[objects]/2)**2 + (layout.lengths[objects]/2)**2)
+    def evaluate(state):
+        offsets = state.poses[objects, None, :2] - fixed
+        distances = np.linalg.norm(offsets, axis = -1)
+        val = np.where(present, np.maximum(0.0, reach[:, None] - distances)**2, 0.0).sum(axis = -1)
+        if state.gradient:
+            d_distances = np.where(present & (distances > 0), -2*np.maximum(0.0, reach[:, None] - distances), 0.0)
+            d_offsets = d_distances[..., None] * offsets/np.where(distances > 0, distances, 1.0)[..., None]
+            np.add.at(state.d_poses[:, :2], objects, (0.8*weights)[:, None] * d_offsets.sum(axis = 1))
+        return layout.dot(weights, 0.8*val, objects)
+    return evaluate
+
+
+def _pairs(terms):
+    return _column(terms, 'object1_index', int), _column(terms, 'object2_index', int)
+
+
+def _distance(poses, first, second):
+    return np.linalg.norm(poses[first, :2] - poses[second, :2], axis = -1)
+
+
+def _add_angle_gradient(state, first, second, weights):
+    ## gradient of the weighted _angle_difference of the orientations of first and second
+    poses = state.poses
+    d_theta = weights * 2*(poses[first, 2] % (2*np.pi) - poses[second, 2] % (2*np.pi))
+    np.add.at(state.d_poses[:, 2], first, d_theta)
+    np.add.at(state.d_poses[:, 2], second, -d_theta)
+
+
+@kernel('io_away_from', _numbers('min_dist'))
+def _io_away_from(terms, layout):
+    weights, (first, second), min_dist = _weights(terms), _pairs(terms), _column(terms, 'min_dist')
+    def evaluate(state):
+        val = np.exp(min_dist - _distance(state.poses, first, second))
+        if state.gradient:
+            state.d_poses += _distance_gradient(state.poses, first, second, -weights * val)
+        return layout.dot(weights, val, first)
+    return evaluate
+
+
+@kernel('io_near', _numbers('max_dist'))
+def _io_near(terms, layout):
+    weights, (first, second), max_dist = _weights(terms), _pairs(terms), _column(terms, 'max_dist')
+    def evaluate(state):
+        shortfall = np.minimum(max_dist - _distance(state.poses, first, second), 0.0)
+        if state.gradient:
+            state.d_poses += _distance_gradient(state.poses, first, second, -2*weights * shortfall)
+        return layout.dot(weights, shortfall**2, first)
+    return evaluate
+
+
+@kernel('io_parallel')
+def _io_parallel(terms, layout):
+    weights, (first, second) = _weights(terms), _pairs(terms)
+    def evaluate(state):
+        if state.gradient:
+            _add_angle_gradient(state, first, second, weights)
+        return layout.dot(weights, _angle_difference(state.poses[first, 2], state.poses[second, 2]), first)
+    return evaluate
+
+
+@kernel('io_under_central')
+def _io_under_central(terms, layout):
+    weights, (first, second) = _weights(terms), _pairs(terms)
+    def evaluate(state):
+        poses = state.poses
+        if state.gradient:
+            delta = weights[:, None] * 2*(poses[first, :2] - poses[second, :2])
+            np.add.at(state.d_poses[:, :2], first, delta)
+            np.add.at(state.d_poses[:, :2], second, -delta)
+            _add_angle_gradient(state, first, second, weights)
+        return layout.dot(weights, _distance(poses, first, second)**2 + _angle_difference(poses[first, 2], poses[second, 2]), first)
+    return evaluate
+
+
+@kernel('io_infront', _numbers('dist'))
+def _io_infront(terms, layout):
+    weights, (first, second) = _weights(terms), _pairs(terms)
+    parallel = np.array([bool(arguments['parallel'] == True) for arguments, _ in terms])
+    reach = _column(terms, 'dist') + np.minimum(layout.widths[first], layout.lengths[first])/2
+    def evaluate(state):
+        poses, cs2 = state.poses, state.corners[second]
+        mid_front = (cs2[:, 2] + cs2[:, 3])/2
+        to_front = mid_front - poses[second, :2]
+        mid2front = to_front/np.linalg.norm(to_front, axis = -1)[:, None]
+        projection = mid_front + reach[:, None] * mid2front
+        val = ((projection - poses[first, :2])**2).sum(axis = -1)
+        val += np.where(parallel, 3*_angle_difference(poses[first, 2], poses[second, 2]), 0.0)
+        if state.gradient:
+            d_projection = (4*weights)[:, None] * 2*(projection - poses[first, :2])
+            d_to_front = _unit_gradient(to_front, reach[:, None] * d_projection)
+            d_mid_front = d_projection + d_to_front
+            np.add.at(state.d_poses[:, :2], first, -d_projection)
+            np.add.at(state.d_poses[:, :2], second, -d_to_front)
+            np.add.at(state.d_corners[:, 2], second, d_mid_front/2)
+            np.add.at(state.d_corners[:, 3], second, d_mid_front/2)
+            _add_angle_gradient(state, first, second, np.where(parallel, 12*weights, 0.0))
+        return layout.dot(weights, 4*val, first)
+    return evaluate
+
+
+@kernel('io_facing', lambda arguments: not arguments['both'])
+def _io_facing(terms, layout):
+    weights, (first, second) = _weights(terms), _pairs(terms)
+    def evaluate(state):
+        cs1, target = state.corners[first], state.poses[second, :2]
+        tl, tr, br, bl = cs1[:, 0], cs1[:, 1], cs1[:, 2], cs1[:, 3]
+        distances = np.linalg.norm(cs1 - target[:, None], axis = -1)
+        val = np.maximum(0.0, distances[:, 3] - distances[:, 0])**2 + np.maximum(0.0, distances[:, 2] - distances[:, 1])**2
+        def line_distance(a, b):
+            ## distance of the target from the line through a and b
+            direction = b - a
+            return (np.abs(direction[:, 1]*target[:, 0] - direction[:, 0]*target[:, 1] + b[:, 0]*a[:, 1] - b[:, 1]*a[:, 0])
+                    / np.linalg.norm(direction, axis = -1))
+        val += (line_distance(tl, bl) + line_distance(tr, br) - layout.widths[first])**2
+        if state.gradient:
+            d_cs1, d_target = np.zeros(cs1.shape), np.zeros(target.shape)
+            behind = 2*np.stack([-np.maximum(0.0, distances[:, 3] - distances[:, 0]), -np.maximum(0.0, distances[:, 2] - distances[:, 1]),
+                                 np.maximum(0.0, distances[:, 2] - distances[:, 1]), np.maximum(0.0, distances[:, 3] - distances[:, 0])], axis = -1)
+            d_offsets = behind[..., None] * (cs1 - target[:, None])/distances[..., None]
+            d_cs1 += d_offsets
+            d_target -= d_offsets.sum(axis = 1)
+            d_lines = 2*(line_distance(tl, bl) + line_distance(tr, br) - layout.widths[first])
+            for i, j in ((0, 3), (1, 2)):
+                a, b = cs1[:, i], cs1[:, j]
+                direction = b - a
+                length = np.linalg.norm(direction, axis = -1)
+                signed = direction[:, 1]*target[:, 0] - direction[:, 0]*target[:, 1] + b[:, 0]*a[:, 1] - b[:, 1]*a[:, 0]
+                d_signed = (d_lines * np.sign(signed)/length)[:, None]
+                d_length = (-d_lines * np.abs(signed)/length**2)[:, None] * direction/length[:, None]
+                d_target += d_signed * np.stack([direction[:, 1], -direction[:, 0]], axis = -1)
+                d_cs1[:, i] += d_signed * np.stack([target[:, 1] - b[:, 1], b[:, 0] - target[:, 0]], axis = -1) - d_length
+                d_cs1[:, j] += d_signed * np.stack([a[:, 1] - target[:, 1], target[:, 0] - a[:, 0]], axis = -1) + d_length
+            np.add.at(state.d_corners, first, weights[:, None, None] * d_cs1)
+            np.add.at(state.d_poses[:, :2], second, weights[:, None] * d_target)
+        return layout.dot(weights, val, first)
+    return evaluate
+
+
+@kernel('io_next_to', lambda arguments: isinstance(arguments['side1'], str) and isinstance(arguments['side2'], str)
+                                        and arguments['side1'] in SIDE_ROWS and arguments['side2'] in SIDE_ROWS)
+def _io_next_to(terms, layout):
+    weights, (first, second) = _weights(terms), _pairs(terms)
+    sides1 = SIDE_CORNERS[[SIDE_ROWS[arguments['side1']] for arguments, _ in terms]]
+    sides2 = SIDE_CORNERS[[SIDE_ROWS[arguments['side2']] for arguments, _ in terms]]
+    ## only the words 'front' and 'back' (not 'top' or 'bottom') add the centre distance for two front/back sides
+    end_to_end = np.array([arguments['side1'] in ('front', 'back') and arguments['side2'] in ('front', 'back') for arguments, _ in terms])
+    def evaluate(state):
+        cs = state.corners
+        point1, point2 = cs[first, sides1[:, 0]], cs[first, sides1[:, 1]]
+        point3, point4 = cs[second, sides2[:, 0]], cs[second, sides2[:, 1]]
+        direction1, direction2 = point2 - point1, point4 - point3
+        norm1, norm2 = _norm(direction1), _norm(direction2)
+
+        angle_diff = np.arccos(np.clip(_dot(direction1, direction2)/(np.maximum(norm1, 1e-6) * np.maximum(norm2, 1e-6)), -1, 1))
+        val = 2 * np.sin(angle_diff)**2
+
+        ## the midpoint of the shorter side is measured against the line of the longer side
+        longer1 = norm1 > norm2
+        point5 = np.where(longer1[:, None], (point3 + point4)/2, (point1 + point2)/2)
+        point6 = np.where(longer1[:, None], (point1 + point2)/2, (point3 + point4)/2)
+        direction3 = point5 - np.where(longer1[:, None], point1, point3)
+        direction4 = point5 - np.where(longer1[:, None], point2, point4)
+        direction5 = np.where(longer1[:, None], direction1, direction2)
+        dim_shorter, norm5 = np.where(longer1, norm2, norm1), np.where(longer1, norm1, norm2)
+        t = _dot(direction5, direction3)/norm5
+        line_distance = np.abs(direction5[:, 0]*direction3[:, 1] - direction5[:, 1]*direction3[:, 0])/norm5
+        centre_distance = _norm(point5 - point6)**2
+
+        val += np.where(t < 0, _norm(direction3)**2 + t**2 + 0.1*centre_distance,
+                        np.where(t > 1, _norm(direction4)**2 + (t - 1)**2 + 0.1*centre_distance, line_distance**2))
+        val += np.where(end_to_end, 10*centre_distance, 0.0)
+        along, remaining = _norm(t[:, None]*direction5), _norm((1 - t)[:, None]*direction5)
+        val += np.where(along < dim_shorter/2, 10*(dim_shorter/2 - along)**2,
+                        np.where(remaining < dim_shorter/2, 10*(dim_shorter/2 - remaining)**2, line_distance**2))
+        if state.gradient:
+            scale = (2*weights)[:, None]
+            ## the angle term, 2*sin(arccos(c))**2 = 2*(1 - c**2)
+            m1, m2 = np.maximum(norm1, 1e-6), np.maximum(norm2, 1e-6)
+            c = _dot(direction1, direction2)/(m1*m2)
+            d_c = np.where(np.abs(c) < 1, -4*c, 0.0)[:, None]
+            d_direction1 = d_c * (direction2/(m1*m2)[:, None] - (c/m1 * (norm1 > 1e-6)/norm1)[:, None] * direction1)
+            d_direction2 = d_c * (direction1/(m1*m2)[:, None] - (c/m2 * (norm2 > 1e-6)/norm2)[:, None] * direction2)
+
+            ## the side terms, with the longer side P1 -> P2 and the shorter side P3 -> P4
+            lower, upper = t < 0, t > 1
+            between = ~lower & ~upper
+            short_end, short_start = (along < dim_shorter/2), (along >= dim_shorter/2) & (remaining < dim_shorter/2)
+            d_t = np.where(lower, 2*t, 0.0) + np.where(upper, 2*(t - 1), 0.0)
+            d_centre = np.where(lower | upper, 0.1, 0.0) + np.where(end_to_end, 10.0, 0.0)
+            d_line = np.where(between, 2*line_distance, 0.0) + np.where(~short_end & ~short_start, 2*line_distance, 0.0)
+            d_along = np.where(short_end, -20*(dim_shorter/2 - along), 0.0)
+            d_remaining = np.where(short_start, -20*(dim_shorter/2 - remaining), 0.0)
+            d_dim_shorter = -(d_along + d_remaining)/2
+            d_t += d_along*np.sign(t)*norm5 - d_remaining*np.sign(1 - t)*norm5
+            d_norm5 = d_along*np.abs(t) + d_remaining*np.abs(1 - t)
+            cross = _cross(direction5, direction3)
+            d_direction3 = (np.where(lower, 2.0, 0.0)[:, None] * direction3 + (d_t/norm5)[:, None] * direction5
+                            + (d_line*np.sign(cross)/norm5)[:, None] * np.stack([-direction5[:, 1], direction5[:, 0]], axis = -1))
+            d_direction4 = np.where(upper, 2.0, 0.0)[:, None] * direction4
+            d_direction5 = ((d_t/norm5)[:, None] * direction3 - (d_t*t/norm5**2)[:, None] * direction5
+                            + (d_line*np.sign(cross)/norm5)[:, None] * np.stack([direction3[:, 1], -direction3[:, 0]], axis = -1)
+                            - (d_line*line_distance/norm5**2)[:, None] * direction5 + (d_norm5/norm5)[:, None] * direction5)
+            d_point5 = 2*d_centre[:, None]*(point5 - point6) + d_direction3 + d_direction4
+            d_p1 = -d_centre[:, None]*(point5 - point6) - d_direction3 - d_direction5
+            d_p2 = -d_centre[:, None]*(point5 - point6) - d_direction4 + d_direction5
+            short = np.where(longer1[:, None], point4 - point3, point2 - point1)
+            d_short = (d_dim_shorter/dim_shorter)[:, None] * short
+            d_p3, d_p4 = d_point5/2 - d_short, d_point5/2 + d_short
+
+            longer = longer1[:, None]
+            d_point1 = np.where(longer, d_p1, d_p3) - d_direction1
+            d_point2 = np.where(longer, d_p2, d_p4) + d_direction1
+            d_point3 = np.where(longer, d_p3, d_p1) - d_direction2
+            d_point4 = np.where(longer, d_p4, d_p2) + d_direction2
+            for objects, corners, d_point in ((first, sides1[:, 0], d_point1), (first, sides1[:, 1], d_point2),
+                                              (second, sides2[:, 0], d_point3), (second, sides2[:, 1], d_point4)):
+                np.add.at(state.d_corners, (objects, corners), scale * d_point)
+        return layout.dot(weights, 2*val, first)
+    return evaluate
+
+
+def _replicate(terms, layout):
+    ## The (arguments, weight) terms of one room, for every copy in a batched layout. Terms without object arguments
+    ## (in_bounds, no_overlap, ...) already cover every object of the layout, so they are kept once.
+    if not any(name.endswith('_index') for arguments, _ in terms for name in arguments):
+        return terms
+    return [({name: value + layout.size*k if name.endswith('_index') else value for name, value in arguments.items()}, weight)
+            for k in range(layout.batch) for arguments, weight in terms]
+
+
+class ConstraintObjective:
+    """ objective(positions, room) for scipy.optimize.minimize, built from a list of Constraint terms for one room.
+
+        The room's objects, sizes, placed objects (fm_indices), regions and fixed objects are read once here,
+        so build a new objective whenever they change (e.g. for every secondary region).
+    """
+
+    def __init__(self, constraints, room, namespace):
+        self.constraints = constraints
+        self.room = room
+        self.layout = _Layout(room)
+        self.kernels = []
+        self.fallback = []
+        ## (build, terms) of every kernel, and the kernels built for the last batch size (see evaluate_batch)
+        self.kernel_terms = []
+        self.batch_kernels = {}
+
+        groups = {}
+        for constraint in constraints:
+            groups.setdefault(constraint.function, []).append(constraint)
+        for name, group in groups.items():
+            func = namespace[name]
+            names = _signature_arguments(func)
+            index_names = [argument for argument in names if argument.endswith('_index')]
+            build, accepts = KERNELS.get(name, (None, None))
+            batched = []
+            for constraint in group:
+                kwargs = dict(zip(index_names, constraint.objects), **constraint.params)
+                bound = inspect.signature(func).bind(None, None, **kwargs)
+                bound.apply_defaults()
+                arguments = dict(list(bound.arguments.items())[2:])
+                if build and self._valid_objects(constraint) and accepts(arguments):
+                    batched.append((arguments, constraint.weight))
+                else:
+                    mutable = any(isinstance(value, (list, dict)) for value in kwargs.values())
+                    self.fallback.append((func, kwargs, constraint.weight, mutable))
+            if batched:
+                self.kernels.append((name, len(batched), build(batched, self.layout)))
+                self.kernel_terms.append((build, batched))
+
+    def _valid_objects(self, constraint):
+        return all(isinstance(index, (int, np.integer)) and not isinstance(index, bool) and 0 <= index < self.layout.count
+                   for index in constraint.objects)
+
+    def __call__(self, positions, room = None):
+        positions = np.asarray(positions, dtype = float)
+        state = _State(self.layout, positions)
+        val = 0.0
+        for _, _, evaluate in self.kernels:
+            val += evaluate(state)
+        for func, kwargs, weight, mutable in self.fallback:
+            ## fresh copies of list arguments, as every call of the exec'd source made (ind_accessible edits its sides)
+            val += weight * func(positions, self.room, **(copy.deepcopy(kwargs) if mutable else kwargs))
+        return val
+
+    def value_and_gradient(self, positions, room = None):
+        """ (objective, gradient) at positions, for minimize(..., jac = True). The kernels' gradients are analytic;
+            the terms that call their constraint function are differenced on their own (forward differences, as minimize would).
+        """
+        positions = np.asarray(positions, dtype = float)
+        state = _State(self.layout, positions, gradient = True)
+        val = 0.0
+        for _, _, evaluate in self.kernels:
+            val += evaluate(state)
+        gradient = state.pose_gradient()[self.layout.free].ravel()
+        steps = np.sqrt(np.finfo(float).eps) * np.maximum(1.0, np.abs(positions))
+        for func, kwargs, weight, mutable in self.fallback:
+            def term(x):
+                return weight * func(x, self.room, **(copy.deepcopy(kwargs) if mutable else kwargs))
+            term_value = term(positions)
+            val += term_value
+            for k in range(len(positions)):
+                stepped = positions.copy()
+                stepped[k] += steps[k]
+                gradient[k] += (term(stepped) - term_value)/steps[k]
+        return val, gradient
+
+    def evaluate_batch(self, positions):
+        """ The objective at every row of positions (K, 3F): K candidate layouts, evaluated together by the kernels
+            (the terms that call their constraint function are called for each row).
+        """
+        positions = np.asarray(positions, dtype = float)
+        batch = len(positions)
+        if batch not in self.batch_kernels:
+            layout = _Layout(self.room, batch)
+            self.batch_kernels = {batch: (layout, [build(_replicate(terms, layout), layout) for build, terms in self.kernel_terms])}
+        layout, kernels = self.batch_kernels[batch]
+        state = _State(layout, positions.ravel())
+        val = np.zeros(batch)
+        for evaluate in kernels:
+            val += evaluate(state)
+        for func, kwargs, weight, mutable in self.fallback:
+            val += [weight * func(x, self.room, **(copy.deepcopy(kwargs) if mutable else kwargs)) for x in positions]
+        return val
+
+    def summary(self):
+        batched = sum(count for _, count, _ in self.kernels)
+        functions = sorted({func.__name__ for func, _, _, _ in self.fallback})
+        return (f"{len(self.constraints)} constraint terms: {batched} in {len(self.kernels)} NumPy kernels, "
+                f"{len(self.fallback)} through the constraint functions{' (' + ', '.join(functions) + ')' if functions else ''}")
+
+
+def compile_objective(constraints, room, namespace):
+    """ The ConstraintObjective of a list of Constraint terms (see parse_objective) in room. """
+    return ConstraintObjective(constraints, room, namespace)
@@ -0,0 +1,81 @@
+## Compares the restart initialisers (see initialisers.py) on a saved constraint program (program.json).
+# Every method runs the optimisation phase once per seed. For each phase the benchmark counts the restarts until the best
+# feasible cost first reached the target: the best cost any run reached in that phase plus --tolerance (relative), or
+# --threshold if that is higher. A run that never reached it counts all of its restarts.
+#
+#   python initialiser_benchmark.py --program_dir DIR [--methods uniform sobol+wall+cardinal+region] [--seeds 4]
+
+import argparse
+import contextlib
+import os
+import random
+import time
+
+import numpy as np
+
+from scene_synthesis import read_program, run_optimisation_phase
+
+
+def run(program, method, seed, iterations, verbose = False):
+    """ The phase_stats (see run_optimisation_phase) and the duration of one optimisation phase with method. """
+    os.environ['SCENE_SLSQP_INIT'] = method
+    np.random.seed(seed)
+    random.seed(seed)
+    phase_stats = []
+    start = time.time()
+    with contextlib.ExitStack() as stack:
+        if not verbose:
+            stack.enter_context(contextlib.redirect_stdout(open(os.devnull, 'w')))
+        run_optimisation_phase(program, iterations, phase_stats = phase_stats)
+    return phase_stats, time.time() - start
+
+
+def restarts_to_target(stats, target):
+    for restart, cost in stats['improvements']:
+        if cost <= target:
+            return restart, True
+    return stats['restarts'], False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--program_dir', type=str, required=True, help='Directory of program.json (language phase result)')
+    parser.add_argument('--methods', nargs='+', default=['uniform', 'sobol', 'lhs', 'uniform+wall+cardinal+region',
+                                                          'sobol+wall+cardinal+region'], help='SCENE_SLSQP_INIT values to compare')
+    parser.add_argument('--seeds', type=int, default=4, help='Runs per method (seeds 0..n-1)')
+    parser.add_argument('--iterations', type=int, default=300, help='Number of optimization iterations')
+    parser.add_argument('--threshold', type=float, default=1e-2, help='Lowest target cost')
+    parser.add_argument('--tolerance', type=float, default=0.05, help='Target: best cost of any run times 1 + tolerance')
+    parser.add_argument('--verbose', action='store_true', help='Print the optimisation output')
+    args = parser.parse_args()
+
+    program = read_program(args.program_dir)
+    results = {}
+    for method in args.methods:
+        for seed in range(args.seeds):
+            results[method, seed] = run(program, method, seed, args.iterations, args.verbose)
+            print(f"{method} seed {seed}: {results[method, seed][1]:.1f}s, restarts",
+                  [stats['restarts'] for stats in results[method, seed][0]])
+
+    phases = [(stats['phase'], stats['region']) for stats in results[args.methods[0], 0][0]]
+    best = [min(stats[k]['best_cost'] for stats, _ in results.values() if k < len(stats) and stats[k]['best_cost'] is not None)
+            for k in range(len(phases))]
+    targets = [max(args.threshold, cost + args.tolerance*abs(cost)) for cost in best]
+
+    print()
+    print(f"{'method':32} {'phase':20} {'target':>8} {'reached':>8} {'restarts to target':>19} {'restarts run':>13} {'best cost':>10}")
+    totals = {}
+    for method in args.methods:
+        runs = [results[method, seed] for seed in range(args.seeds)]
+        for k, (phase, region) in enumerate(phases):
+            counts = [restarts_to_target(stats[k], targets[k]) for stats, _ in runs]
+            costs = [stats[k]['best_cost'] for stats, _ in runs if stats[k]['best_cost'] is not None]
+            print(f"{method:32} {phase + (f' ({region})' if region else ''):20} {targets[k]:8.4f} "
+                  f"{sum(reached for _, reached in counts):>4}/{len(runs):<3} {np.mean([n for n, _ in counts]):19.1f} "
+                  f"{np.mean([stats[k]['restarts'] for stats, _ in runs]):13.1f} {np.mean(costs) if costs else np.nan:10.4f}")
+        totals[method] = (sum(np.mean([restarts_to_target(stats[k], targets[k])[0] for stats, _ in runs]) for k in range(len(phases))),
+                          np.mean([seconds for _, seconds in runs]))
+    print()
+    for method, (restarts, seconds) in totals.items():
+        print(f"{method:32} restarts to target, all phases: {restarts:6.1f} ({restarts/totals[args.methods[0]][0] - 1:+.0%}), "
+              f"optimisation phase {seconds:.1f}s")
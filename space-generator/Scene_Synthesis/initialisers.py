@@ -0,0 +1,132 @@
+## Starting positions for the SLSQP restarts of the optimisation phase.
+# A sampler draws a point of the unit cube per restart, one (x, y, theta) triple per free object, and the object's
+# triple is scaled to a pose in the room. Heuristics change how the triple is used for some objects:
+#   wall      objects with an ind_next_to_wall term start with that side against a wall (the triple picks the wall and
+#             the position along it)
+#   cardinal  orientations are one of 0, pi/2, pi, 3pi/2
+#   region    secondary objects start in a box around the centre of their region (the primary objects are placed)
+# SCENE_SLSQP_INIT names the sampler and the heuristics (default "sobol+wall+cardinal+region"). "uniform" without
+# heuristics draws the np.random.uniform starts of earlier versions. initialiser_benchmark.py compares the methods.
+
+import os
+
+import numpy as np
+from scipy.stats import qmc
+
+SAMPLERS = {}
+HEURISTICS = ('wall', 'cardinal', 'region')
+
+DEFAULT_METHOD = 'sobol+wall+cardinal+region'
+
+## Points drawn at a time by the quasi-random samplers (a power of 2 keeps the balance of Sobol' points)
+BLOCK = 64
+
+## Half the size of the box around a region centre that secondary objects start in, as a fraction of the room
+REGION_SPREAD = 0.25
+
+## Angle of the outward normal of each object side at theta = 0, and of the walls N, E, S, W
+SIDE_ANGLES = {'top': -np.pi/2, 'back': -np.pi/2, 'bottom': np.pi/2, 'front': np.pi/2, 'left': np.pi, 'right': 0.0}
+WALL_ANGLES = np.array([np.pi/2, 0.0, -np.pi/2, np.pi])
+
+
+def sampler(name):
+    ## Registers build(dimensions), which returns draw(): a new point of [0, 1)^dimensions on every call
+    def register(build):
+        SAMPLERS[name] = build
+        return build
+    return register
+
+
+@sampler('uniform')
+def _uniform(dimensions):
+    return lambda: np.random.uniform(size = dimensions)
+
+
+def _blocks(engine):
+    points = []
+    def draw():
+        if not points:
+            points.extend(engine.random(BLOCK)[::-1])
+        return points.pop()
+    return draw
+
+
+## The quasi-random engines are seeded from np.random, so a seeded run draws the same starts
+@sampler('sobol')
+def _sobol(dimensions):
+    return _blocks(qmc.Sobol(dimensions, rng = np.random.default_rng(np.random.randint(2**32))))
+
+
+@sampler('lhs')
+def _latin_hypercube(dimensions):
+    return _blocks(qmc.LatinHypercube(dimensions, rng = np.random.default_rng(np.random.randint(2**32))))
+
+
+def parse_method(method = None):
+    """ (sampler name, heuristics) of method, default SCENE_SLSQP_INIT. """
+    method = (method or os.getenv('SCENE_SLSQP_INIT') or DEFAULT_METHOD).strip().lower()
+    name, *heuristics = [part.strip() for part in method.split('+')]
+    if name not in SAMPLERS:
+        raise ValueError(f"SCENE_SLSQP_INIT: unknown sampler {name!r}, expected one of {', '.join(SAMPLERS)}")
+    for heuristic in heuristics:
+        if heuristic not in HEURISTICS:
+            raise ValueError(f"SCENE_SLSQP_INIT: unknown heuristic {heuristic!r}, expected any of {', '.join(HEURISTICS)}")
+    return name, set(heuristics)
+
+
+def _against_wall(room, obj, side, u):
+    ## The pose with the given side of obj against the wall picked by u[0], at u[1] of the way along it
+    wall = min(int(4*u[0]), 3)
+    angle = SIDE_ANGLES.get(side, SIDE_ANGLES['back']) if isinstance(side, str) else SIDE_ANGLES['back']
+    theta = (WALL_ANGLES[wall] - angle) % (2*np.pi)
+    ## the back and front are the sides along the object's width
+    depth, half = (obj.length/2, obj.width/2) if angle in (-np.pi/2, np.pi/2) else (obj.width/2, obj.length/2)
+    wall_length = room.width if wall in (0, 2) else room.length
+    along = half + u[1]*max(0.0, wall_length - 2*half) if wall_length > 2*half else wall_length/2
+    if wall == 0:
+        return along, room.length - depth, theta
+    if wall == 1:
+        return room.width - depth, along, theta
+    if wall == 2:
+        return along, depth, theta
+    return depth, along, theta
+
+
+def initialiser(room, constraints = (), method = None):
+    """ sample() for the restarts: starting positions of the objects of room not in fm_indices.
+
+        Args:
+        room: Room object, with the objects to place and the regions
+        constraints: the Constraint terms of the objective (the wall heuristic reads ind_next_to_wall)
+        method: sampler and heuristics, default SCENE_SLSQP_INIT (see the module notes)
+    """
+    name, heuristics = parse_method(method)
+    free = [i for i in range(len(room.moving_objects)) if i not in room.fm_indices]
+    draw = SAMPLERS[name](3*len(free))
+
+    low = np.zeros((len(free), 3))
+    scale = np.tile([room.width, room.length, 2*np.pi], (len(free), 1))
+    if 'region' in heuristics and room.fm_indices:
+        for j, i in enumerate(free):
+            region = room.find_region_index(room.moving_objects[i].region) if room.moving_objects[i].region else None
+            if region is None:
+                continue
+            centre, size = np.array([room.regions[region].x, room.regions[region].y]), np.array([room.width, room.length])
+            box_low = np.clip(centre - REGION_SPREAD*size, 0, size)
+            low[j, :2], scale[j, :2] = box_low, np.clip(centre + REGION_SPREAD*size, 0, size) - box_low
+
+    walls = {}
+    if 'wall' in heuristics:
+        for constraint in constraints:
+            if constraint.function == 'ind_next_to_wall' and constraint.objects and constraint.objects[0] in free:
+                walls.setdefault(free.index(constraint.objects[0]), constraint.params.get('side', 'back'))
+
+    def sample():
+        u = np.reshape(draw(), (len(free), 3))
+        poses = low + u*scale
+        if 'cardinal' in heuristics:
+            poses[:, 2] = np.pi/2 * np.minimum(np.floor(4*u[:, 2]), 3)
+        for j, side in walls.items():
+            poses[j] = _against_wall(room, room.moving_objects[free[j]], side, u[j])
+        return poses.ravel()
+    return sample
@@ -0,0 +1,121 @@
+## Runs the independent random restarts of the SLSQP layout search in a pool of worker processes.
+# The objective and the room are inherited by forking, so neither has to be picklable (exec'd objective functions are not).
+# The starting positions are drawn in this process in restart order and the results are yielded in the same order,
+# so a seeded run gives the same layout for a given number of processes.
+# When the caller stops iterating (e.g. a feasible result under the cost threshold was found), the queued restarts are
+# cancelled and the running ones are stopped at their next SLSQP iteration.
+# With a deadline, restarts still running when it passes are stopped the same way and yield the positions they reached,
+# so the caller always gets a result shortly after its time budget runs out. The deadline lives in shared memory, so
+# lift_deadline() lets the restarts of a search that has nothing usable yet run to completion again.
+
+import math
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from scipy.optimize import minimize
+
+## (func, room, bounds, options, jac), the stop event and the deadline (a shared double) of the search the forked workers belong to
+_problem = None
+_stop = None
+_deadline = None
+
+
+def restart_processes():
+    """ Number of processes for the restarts: SCENE_SLSQP_PROCESSES, or every available core if it is 0 or unset. """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return 1
+    processes = int(os.getenv('SCENE_SLSQP_PROCESSES', '0') or 0)
+    if processes <= 0:
+        try:
+            processes = len(os.sched_getaffinity(0))
+        except AttributeError:
+            processes = os.cpu_count() or 1
+    return processes
+
+
+def restart(func, room, bounds, options, jac, start, callback = None):
+    """ One SLSQP run of func from the starting positions start. Returns (result, seconds). """
+    restart_start = time.time()
+    res = minimize(func, start, args = (room), method = 'SLSQP', jac = jac, options = options, bounds = bounds, callback = callback)
+    return res, time.time() - restart_start
+
+
+def _deadline_check(xk):
+    if _deadline is not None and time.time() > _deadline.value:
+        raise StopIteration
+
+
+def _cancel_check(xk):
+    if _stop.is_set():
+        raise StopIteration
+    _deadline_check(xk)
+
+
+def _shared_deadline(context, deadline):
+    return None if deadline is None else context.RawValue('d', deadline)
+
+
+def _worker_restart(start):
+    if _stop.is_set():
+        return None
+    return restart(*_problem, start, callback = _cancel_check)
+
+
+def lift_deadline():
+    """ Removes the deadline of the running search, in this process and its workers. Restarts already stopped by it are
+        not run again. Returns False if there was no deadline to lift.
+    """
+    if _deadline is None or _deadline.value == math.inf:
+        return False
+    _deadline.value = math.inf
+    return True
+
+
+def multistart(func, room, bounds, options, sample, jac = None, processes = None, restart_times = None, deadline = None):
+    """ Yields the results of SLSQP restarts of func from sample() (a new array of starting positions on every call),
+        in restart order, for as long as the caller keeps iterating. Close the generator (contextlib.closing) to cancel
+        the outstanding restarts.
+
+        Args:
+        func: objective function func(positions, room)
+        room: Room object passed to func
+        bounds, options, jac: passed to scipy.optimize.minimize (jac = True: func returns the value and the gradient)
+        sample: function returning the starting positions of the next restart
+        processes: number of worker processes (default restart_processes()). With 1 the restarts run in this process.
+        restart_times: optional list that the duration of every yielded restart is appended to
+        deadline: optional time.time() at which running restarts stop early (the caller decides when to stop iterating;
+                  lift_deadline() removes it)
+    """
+    global _problem, _stop, _deadline
+
+    processes = processes or restart_processes()
+    if processes <= 1:
+        _deadline = _shared_deadline(multiprocessing, deadline)
+        try:
+            while True:
+                res, seconds = restart(func, room, bounds, options, jac, sample(), callback = _deadline_check if deadline else None)
+                if restart_times is not None:
+                    restart_times.append(seconds)
+                yield res
+        finally:
+            _deadline = None
+
+    context = multiprocessing.get_context('fork')
+    _problem, _stop, _deadline = (func, room, bounds, options, jac), context.Event(), _shared_deadline(context, deadline)
+    executor = ProcessPoolExecutor(max_workers = processes, mp_context = context)
+    try:
+        ## Two restarts per process are queued, so that no worker waits while its last result is consumed
+        pending = deque(executor.submit(_worker_restart, sample()) for _ in range(2*processes))
+        while True:
+            res, seconds = pending.popleft().result()
+            pending.append(executor.submit(_worker_restart, sample()))
+            if restart_times is not None:
+                restart_times.append(seconds)
+            yield res
+    finally:
+        _stop.set()
+        executor.shutdown(wait = True, cancel_futures = True)
+        _problem, _stop, _deadline = None, None, None
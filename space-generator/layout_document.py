@@ -0,0 +1,304 @@
+"""
+씬 레이아웃 문서 (scene_synthesis 결과 -> retrieval / composition 입력)
+
+scene_synthesis 는 write_layout() 으로 Result_txt/layout.json 을 쓰고,
+retrieval 과 composition 단계는 read_layout() 으로 같은 문서를 읽는다.
+문서는 버전이 있는 dict 이며 읽고 쓸 때 모두 validate_layout() 으로 형식을 검사한다.
+
+{
+    "format": "scene-layout",
+    "version": 1,
+    "prompt": "A 4x4 bedroom ...",
+    "room": {"width": 4.0, "length": 4.0},
+    "objects": [
+        {"name": "bed", "kind": "moving", "position": [x, y, theta], "width": 1.6, "length": 2.0},
+        {"name": "door", "kind": "fixed", ...}
+    ],
+    "wall_color": [r, g, b, a] 또는 null,
+    "floor_color": [r, g, b, a] 또는 null,
+    "style": "LLM 이 만든 스타일 설명 (1. **Bed** ... 형식)",
+    "feasible": true
+}
+
+feasible 은 배치 최적화가 모든 단계에서 제약을 만족하는 배치를 찾았는지 여부 (없는 문서는 true 로 읽는다).
+
+SCENE_LAYOUT_MSGPACK=1 이고 msgpack 이 설치되어 있으면 같은 내용을 layout.msgpack 으로도 저장하고,
+읽을 때는 msgpack 을 먼저 사용한다. 이전 버전이 만든 layout.txt 도 읽을 수 있다.
+
+언어 단계의 결과(constraint program)는 write_program() 으로 Result_language/program.json 에 저장한다.
+retrieval 은 여기 있는 style 설명만 있으면 되므로 배치 최적화가 끝나기를 기다리지 않고 시작할 수 있다.
+"""
+
+import ast
+import json
+import os
+import re
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+LAYOUT_FORMAT = "scene-layout"
+LAYOUT_VERSION = 1
+
+LAYOUT_JSON = "layout.json"
+LAYOUT_MSGPACK = "layout.msgpack"
+LEGACY_LAYOUT_TXT = "layout.txt"
+
+PROGRAM_FORMAT = "scene-program"
+PROGRAM_JSON = "program.json"
+
+OBJECT_KINDS = ("moving", "fixed")
+
+
+class LayoutFormatError(ValueError):
+    """레이아웃 문서 형식 오류 (필드 누락, 잘못된 값, 지원하지 않는 버전)"""
+
+
+def _number(value, field):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise LayoutFormatError(f"{field}: expected a number, got {value!r}")
+    if number != number or number in (float("inf"), float("-inf")):
+        raise LayoutFormatError(f"{field}: expected a finite number, got {value!r}")
+    return number
+
+
+def _vector(value, field, lengths):
+    if not isinstance(value, (list, tuple)) or len(value) not in lengths:
+        raise LayoutFormatError(f"{field}: expected {' or '.join(map(str, lengths))} numbers, got {value!r}")
+    return [_number(v, f"{field}[{i}]") for i, v in enumerate(value)]
+
+
+def _color(value, field):
+    return None if value is None else _vector(value, field, (3, 4))
+
+
+def _text(value, field):
+    if not isinstance(value, str):
+        raise LayoutFormatError(f"{field}: expected a string, got {type(value).__name__}")
+    return value
+
+
+def _flag(value, field):
+    if not isinstance(value, bool):
+        raise LayoutFormatError(f"{field}: expected true or false, got {value!r}")
+    return value
+
+
+def validate_layout(document):
+    """형식 검사 후 정규화된 새 문서 반환 (숫자는 float, 좌표와 색상은 list)"""
+    if not isinstance(document, dict):
+        raise LayoutFormatError(f"Layout must be an object, got {type(document).__name__}")
+    if document.get("format") != LAYOUT_FORMAT:
+        raise LayoutFormatError(f"Not a scene layout document (format={document.get('format')!r})")
+    if document.get("version") != LAYOUT_VERSION:
+        raise LayoutFormatError(f"Unsupported layout version {document.get('version')!r} (expected {LAYOUT_VERSION})")
+
+    room = document.get("room")
+    if not isinstance(room, dict):
+        raise LayoutFormatError("room: expected an object with width and length")
+    objects = document.get("objects")
+    if not isinstance(objects, list):
+        raise LayoutFormatError("objects: expected a list")
+
+    names = set()
+    normalized_objects = []
+    for i, obj in enumerate(objects):
+        field = f"objects[{i}]"
+        if not isinstance(obj, dict):
+            raise LayoutFormatError(f"{field}: expected an object")
+        name = _text(obj.get("name"), f"{field}.name")
+        if not name or name in names:
+            raise LayoutFormatError(f"{field}.name: empty or duplicate name {name!r}")
+        names.add(name)
+        if obj.get("kind") not in OBJECT_KINDS:
+            raise LayoutFormatError(f"{field}.kind: expected one of {OBJECT_KINDS}, got {obj.get('kind')!r}")
+        normalized_objects.append({
+            "name": name,
+            "kind": obj["kind"],
+            "position": _vector(obj.get("position"), f"{field}.position", (3,)),
+            "width": _number(obj.get("width"), f"{field}.width"),
+            "length": _number(obj.get("length"), f"{field}.length"),
+        })
+
+    return {
+        "format": LAYOUT_FORMAT,
+        "version": LAYOUT_VERSION,
+        "prompt": _text(document.get("prompt"), "prompt"),
+        "room": {"width": _number(room.get("width"), "room.width"), "length": _number(room.get("length"), "room.length")},
+        "objects": normalized_objects,
+        "wall_color": _color(document.get("wall_color"), "wall_color"),
+        "floor_color": _color(document.get("floor_color"), "floor_color"),
+        "style": _text(document.get("style", ""), "style"),
+        "feasible": _flag(document.get("feasible", True), "feasible"),
+    }
+
+
+def build_layout(prompt, room_width, room_length, objects, style, wall_color=None, floor_color=None, feasible=True):
+    """scene_synthesis 결과로 문서 생성. objects: (name, kind, position, width, length) 목록"""
+    return validate_layout({
+        "format": LAYOUT_FORMAT,
+        "version": LAYOUT_VERSION,
+        "prompt": prompt,
+        "room": {"width": room_width, "length": room_length},
+        "objects": [
+            {"name": name, "kind": kind, "position": list(position), "width": width, "length": length}
+            for name, kind, position, width, length in objects
+        ],
+        "wall_color": None if wall_color is None else list(wall_color),
+        "floor_color": None if floor_color is None else list(floor_color),
+        "style": style or "",
+        "feasible": feasible,
+    })
+
+
+def _write_atomic(path, data, mode):
+    tmp = f"{path}.tmp"
+    with open(tmp, mode) as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def write_layout(document, directory):
+    """directory 에 layout.json (+ 설정 시 layout.msgpack) 저장. layout.json 경로 반환"""
+    document = validate_layout(document)
+    os.makedirs(directory, exist_ok=True)
+
+    json_path = os.path.join(directory, LAYOUT_JSON)
+    _write_atomic(json_path, json.dumps(document, indent=2, ensure_ascii=False), "w")
+
+    msgpack_path = os.path.join(directory, LAYOUT_MSGPACK)
+    if msgpack is not None and os.getenv("SCENE_LAYOUT_MSGPACK", "0").lower() in ("1", "true", "yes"):
+        _write_atomic(msgpack_path, msgpack.packb(document, use_bin_type=True), "wb")
+    elif os.path.exists(msgpack_path):
+        os.remove(msgpack_path)  # 이전 결과가 남아 있으면 새 json 대신 읽히지 않도록
+    return json_path
+
+
+def find_layout(directory):
+    """directory 안의 레이아웃 파일 경로 (msgpack > json > layout.txt). 없으면 layout.json 경로"""
+    candidates = [LAYOUT_JSON, LEGACY_LAYOUT_TXT]
+    if msgpack is not None:
+        candidates.insert(0, LAYOUT_MSGPACK)
+    for name in candidates:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            return path
+    return os.path.join(directory, LAYOUT_JSON)
+
+
+def read_layout(path):
+    """레이아웃 문서 읽기 (path 는 파일 또는 Result_txt 디렉토리). 형식이 틀리면 LayoutFormatError"""
+    if os.path.isdir(path):
+        path = find_layout(path)
+
+    if path.endswith(".msgpack"):
+        if msgpack is None:
+            raise LayoutFormatError(f"{path}: msgpack is not installed")
+        with open(path, "rb") as f:
+            document = msgpack.unpackb(f.read(), raw=False)
+    elif path.endswith(".txt"):
+        with open(path, "r", encoding="utf-8") as f:
+            document = _parse_legacy_layout(f.read())
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                document = json.load(f)
+            except ValueError as e:
+                raise LayoutFormatError(f"{path}: invalid JSON ({e})")
+    return validate_layout(document)
+
+
+def _parse_legacy_layout(content):
+    """이전 버전의 layout.txt ("key: repr(value)" 줄들, 마지막이 여러 줄의 style) 를 문서로 변환"""
+    head, _, style = content.partition("\nstyle: ")
+    fields = {}
+    for line in head.splitlines():
+        key, sep, value = line.partition(": ")
+        if sep:
+            fields[key.strip()] = value.strip()
+
+    def literal(key):
+        value = re.sub(r"np\.float64\(([^()]*)\)", r"\1", fields.pop(key))
+        try:
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            raise LayoutFormatError(f"layout.txt: cannot parse {key}: {value[:80]}")
+
+    document = {
+        "format": LAYOUT_FORMAT,
+        "version": LAYOUT_VERSION,
+        "prompt": fields.pop("prompt", ""),
+        "room": {"width": literal("room_width") if "room_width" in fields else None,
+                 "length": literal("room_length") if "room_length" in fields else None},
+        "wall_color": literal("wall_color") if "wall_color" in fields else None,
+        "floor_color": literal("floor_color") if "floor_color" in fields else None,
+        "style": style.strip(),
+        "objects": [],
+    }
+    for name in list(fields):
+        value = literal(name)
+        if isinstance(value, dict) and "position" in value:
+            kind = "fixed" if any(k in name.lower() for k in ("door", "window")) else "moving"
+            document["objects"].append(dict(value, name=name, kind=kind))
+    return document
+
+
+def layout_data(document):
+    """composition 단계에서 쓰는 dict 형태로 변환 (objects: 이름 -> position / width / length)"""
+    return {
+        "prompt": document["prompt"],
+        "room_width": document["room"]["width"],
+        "room_length": document["room"]["length"],
+        "objects": {
+            obj["name"]: {"position": tuple(obj["position"]), "width": obj["width"], "length": obj["length"]}
+            for obj in document["objects"]
+        },
+        "wall_color": document["wall_color"],
+        "floor_color": document["floor_color"],
+        "style": document["style"],
+    }
+
+
+def write_program(program, directory):
+    """언어 단계 결과를 directory/program.json 으로 저장하고 경로 반환"""
+    _text(program.get("scene_descriptor"), "program.scene_descriptor")
+    _text(program.get("style"), "program.style")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, PROGRAM_JSON)
+    document = {"format": PROGRAM_FORMAT, "version": LAYOUT_VERSION, "program": program}
+    _write_atomic(path, json.dumps(document, ensure_ascii=False), "w")
+    return path
+
+
+def read_program(path):
+    """write_program() 으로 저장한 constraint program (path 는 파일 또는 디렉토리)"""
+    if os.path.isdir(path):
+        path = os.path.join(path, PROGRAM_JSON)
+    with open(path, "r", encoding="utf-8") as f:
+        try:
+            document = json.load(f)
+        except ValueError as e:
+            raise LayoutFormatError(f"{path}: invalid JSON ({e})")
+    if not isinstance(document, dict) or document.get("format") != PROGRAM_FORMAT:
+        raise LayoutFormatError(f"{path}: not a scene program document")
+    if document.get("version") != LAYOUT_VERSION:
+        raise LayoutFormatError(f"Unsupported program version {document.get('version')!r} (expected {LAYOUT_VERSION})")
+    program = document.get("program")
+    if not isinstance(program, dict):
+        raise LayoutFormatError(f"{path}: program: expected an object")
+    _text(program.get("style"), "program.style")
+    return program
+
+
+def read_query_text(path):
+    """retrieval 단계의 검색 텍스트. program.json / 레이아웃 문서면 style 설명, 그 외 텍스트 파일은 내용 그대로"""
+    if os.path.basename(path) == PROGRAM_JSON:
+        return read_program(path)["style"]
+    if os.path.isdir(path) or path.endswith((".json", ".msgpack")) or os.path.basename(path) == LEGACY_LAYOUT_TXT:
+        return read_layout(path)["style"]
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
@@ -0,0 +1,94 @@
+"""
+OpenAI chat completion 응답 캐시 (content-addressed)
+
+요청 본문(model, messages 와 max_tokens 등 나머지 파라미터)을 정렬된 JSON 으로 만든 SHA-256 이 키이고,
+응답 JSON 은 {SCENE_LLM_CACHE_DIR}/{키 앞 2글자}/{키}.json 에 요청과 함께 저장한다.
+
+SCENE_LLM_CACHE 로 동작을 고른다.
+    off     캐시를 사용하지 않음 (기본값)
+    record  저장된 응답이 있으면 사용하고, 없으면 OpenAI 를 호출해 성공한 응답을 저장
+    replay  저장된 응답만 사용. 없으면 LLMCacheMiss (네트워크를 쓰지 않음)
+
+같은 디렉토리를 llm_replay_server.py 로 띄우면 OpenAI 호환 /v1/chat/completions 서버가 되므로
+OPENAI_BASE_URL 만 바꿔 기록해 둔 fixture 로 파이프라인 전체를 네트워크 없이 실행할 수 있다.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+from pipeline_progress import report_count
+
+CACHE_MODES = ("off", "record", "replay")
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class LLMCacheMiss(RuntimeError):
+    """replay 모드에서 저장된 응답이 없는 요청"""
+
+
+def cache_mode():
+    mode = os.getenv("SCENE_LLM_CACHE", "off").strip().lower() or "off"
+    if mode not in CACHE_MODES:
+        raise ValueError(f"SCENE_LLM_CACHE must be one of {', '.join(CACHE_MODES)}, got {mode!r}")
+    return mode
+
+
+def cache_dir():
+    return os.path.abspath(os.getenv("SCENE_LLM_CACHE_DIR") or os.path.join(REPO_DIR, "outputs", "llm_cache"))
+
+
+def request_key(request):
+    """요청 본문(dict)의 키. 파라미터 순서와 무관"""
+    return hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def _entry_path(key, directory=None):
+    return os.path.join(directory or cache_dir(), key[:2], f"{key}.json")
+
+
+def load(request, directory=None):
+    """저장된 응답 JSON (dict). 없으면 None"""
+    try:
+        with open(_entry_path(request_key(request), directory), "r", encoding="utf-8") as f:
+            return json.load(f)["response"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def store(request, response, directory=None):
+    """응답 JSON 저장. 같은 요청을 여러 스레드가 동시에 저장해도 반쪽짜리 파일이 남지 않도록 임시 파일 후 rename"""
+    key = request_key(request)
+    path = _entry_path(key, directory)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump({"key": key, "request": request, "response": response}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+    return path
+
+
+def cached_call(request, call):
+    """캐시 모드에 따라 request 에 대한 응답 JSON 반환
+
+    call(request) 는 실제 API 를 호출해 응답 JSON (dict, 실패하면 None) 을 돌려주는 함수.
+    실패한 응답은 저장하지 않는다.
+    """
+    mode = cache_mode()
+    if mode == "off":
+        return call(request)
+
+    response = load(request)
+    if response is not None:
+        report_count("llm_cache", result="hit")
+        return response
+    report_count("llm_cache", result="miss")
+    if mode == "replay":
+        raise LLMCacheMiss(f"No recorded response for request {request_key(request)} in {cache_dir()}")
+
+    response = call(request)
+    if response is not None:
+        store(request, response)
+    return response
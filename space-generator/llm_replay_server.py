@@ -0,0 +1,89 @@
+"""
+기록해 둔 LLM 응답을 돌려주는 OpenAI 호환 서버 (네트워크 없이 파이프라인 실행 / 벤치마크용)
+
+    SCENE_LLM_CACHE=record 로 파이프라인을 한 번 실행해 응답을 기록한 뒤
+    python llm_replay_server.py --cache_dir outputs/llm_cache --port 8100
+    OPENAI_BASE_URL=http://127.0.0.1:8100/v1 로 서버 / 파이프라인 실행
+
+POST /v1/chat/completions 는 요청 본문의 키(llm_cache.request_key)로 기록을 찾아 그대로 반환하고,
+없으면 OpenAI 형식의 오류와 함께 404 를 반환한다.
+시작할 때 디렉토리의 모든 기록을 저장된 request 로 다시 색인하므로 파일 이름을 바꾸거나 직접 만든 fixture 도 사용할 수 있다.
+"""
+
+import argparse
+import json
+import os
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from llm_cache import cache_dir, request_key
+
+
+def build_index(directory):
+    """{요청 키: 기록 파일 경로}"""
+    index = {}
+    for dirpath, _, names in os.walk(directory):
+        for name in sorted(names):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(dirpath, name)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+                index[request_key(entry["request"])] = path
+            except (OSError, ValueError, KeyError, TypeError):
+                print(f"Skipping unreadable fixture: {path}")
+    return index
+
+
+def create_app(directory):
+    app = FastAPI(title="LLM Replay Server")
+    index = build_index(directory)
+    print(f"Serving {len(index)} recorded responses from {directory}")
+
+    def openai_error(status_code, message, code):
+        return JSONResponse(status_code=status_code, content={"error": {"message": message, "type": "invalid_request_error", "code": code}})
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        try:
+            body = await request.json()
+        except ValueError:
+            return openai_error(400, "Request body is not valid JSON", "invalid_json")
+        if body.get("stream"):
+            return openai_error(400, "Streaming is not supported by the replay server", "stream_not_supported")
+        path = index.get(request_key(body))
+        if path is None:
+            return openai_error(404, f"No recorded response for request {request_key(body)}", "cache_miss")
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)["response"]
+
+    @app.get("/v1/models")
+    async def list_models():
+        models = set()
+        for path in index.values():
+            with open(path, "r", encoding="utf-8") as f:
+                models.add(json.load(f)["request"].get("model"))
+        return {"object": "list", "data": [{"id": model, "object": "model", "owned_by": "replay"} for model in sorted(filter(None, models))]}
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy", "responses": len(index)}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible server for recorded LLM responses")
+    parser.add_argument("--cache_dir", default=None, help="Recorded responses (default: SCENE_LLM_CACHE_DIR)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run(create_app(os.path.abspath(args.cache_dir or cache_dir())), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+파이프라인 단계별 checkpoint
+
+단계(CHECKPOINT_STAGES)가 끝날 때마다 {output}/checkpoints/{stage}.json 에 manifest 를 남긴다.
+language_phase 는 scene_synthesis 진행 단계의 앞부분(LLM 호출)이고, 나머지는 pipeline_progress.STAGES 와 같다.
+
+{
+    "stage": "text_retrieval",
+    "inputs": {"params": {...}, "previous": {"language_phase": "<의존 단계 outputs_hash>"}},
+    "inputs_hash": "...",
+    "outputs": [{"path": "Result_retrieval/text_retrieval/bed.txt", "size": 123, "sha256": "..."}],
+    "outputs_hash": "...",
+    "started_at": ..., "finished_at": ..., "duration": ...
+}
+
+입력은 요청 파라미터(scene_descriptor, iterations, seed, time_budget)와 의존 단계(STAGE_DEPENDENCIES)의 출력 해시이므로
+앞 단계를 다시 실행해 결과가 달라지면 뒤 단계의 checkpoint 는 자동으로 무효가 된다.
+retrieval 은 언어 단계 결과에만 의존하므로 배치 최적화(scene_synthesis)와 동시에 실행할 수 있다.
+같은 출력 디렉토리로 다시 실행하면 pending_stages() 가 미완료 단계만 실행하도록 알려준다.
+
+layout_scene_api.sh 에서는 명령행으로 사용한다:
+    python pipeline_checkpoint.py --output DIR --scene_descriptor D --iterations N [--seed S] [--time_budget B] resume STAGE
+    python pipeline_checkpoint.py --output DIR --scene_descriptor D --iterations N [--seed S] [--time_budget B] write STAGE --started_at T
+resume 은 checkpoint 가 유효하면 0, 아니면 그 단계와 그에 의존하는 단계의 출력과 checkpoint 를 지우고 1 로 종료한다.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+from pipeline_progress import STAGES, report_progress
+
+CHECKPOINT_DIR = "checkpoints"
+
+CHECKPOINT_STAGES = ("language_phase",) + STAGES
+
+# 단계별 출력 (출력 디렉토리 기준 상대 경로)
+STAGE_OUTPUTS = {
+    "language_phase": ["Result_language"],
+    "scene_synthesis": ["Result_txt"],
+    "text_retrieval": [os.path.join("Result_retrieval", "text_retrieval")],
+    "clip_retrieval": [os.path.join("Result_retrieval", "clip_retrieval")],
+    "scene_composition": ["Result"],
+}
+
+# 단계가 입력으로 쓰는 단계 (retrieval 은 배치 결과가 아니라 언어 단계의 style 설명만 사용)
+STAGE_DEPENDENCIES = {
+    "language_phase": (),
+    "scene_synthesis": ("language_phase",),
+    "text_retrieval": ("language_phase",),
+    "clip_retrieval": ("text_retrieval",),
+    "scene_composition": ("scene_synthesis", "clip_retrieval"),
+}
+
+
+def pipeline_params(scene_descriptor, iterations, seed=None, time_budget=None):
+    """checkpoint 입력에 들어가는 요청 파라미터"""
+    return {"scene_descriptor": scene_descriptor, "iterations": int(iterations), "seed": None if seed in (None, "") else int(seed),
+            "time_budget": None if time_budget in (None, "") else float(time_budget)}
+
+
+def _hash(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _manifest_path(output_path, stage):
+    return os.path.join(output_path, CHECKPOINT_DIR, f"{stage}.json")
+
+
+def read_checkpoint(output_path, stage):
+    """단계의 manifest dict. 없거나 읽을 수 없으면 None"""
+    try:
+        with open(_manifest_path(output_path, stage), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _stage_inputs(output_path, stage, params):
+    previous = {}
+    for dependency in STAGE_DEPENDENCIES[stage]:
+        manifest = read_checkpoint(output_path, dependency)
+        if manifest is None:
+            return None
+        previous[dependency] = manifest["outputs_hash"]
+    return {"params": params, "previous": previous}
+
+
+def _dependents(stage):
+    """stage 와 stage 의 결과를 (직접 또는 간접으로) 입력으로 쓰는 단계들"""
+    found = [stage]
+    for later in CHECKPOINT_STAGES:
+        if later not in found and any(dependency in found for dependency in STAGE_DEPENDENCIES[later]):
+            found.append(later)
+    return found
+
+
+def _list_outputs(output_path, stage):
+    outputs = []
+    for rel in STAGE_OUTPUTS[stage]:
+        root = os.path.join(output_path, rel)
+        for dirpath, _, names in os.walk(root):
+            for name in sorted(names):
+                path = os.path.join(dirpath, name)
+                outputs.append({
+                    "path": os.path.relpath(path, output_path),
+                    "size": os.path.getsize(path),
+                    "sha256": _file_sha256(path),
+                })
+    return sorted(outputs, key=lambda output: output["path"])
+
+
+def is_complete(output_path, stage, params):
+    """manifest 가 있고 입력이 같으며 기록된 출력 파일이 모두 같은 크기로 남아 있으면 True (의존 단계도 검사)"""
+    if not all(is_complete(output_path, dependency, params) for dependency in STAGE_DEPENDENCIES[stage]):
+        return False
+    manifest = read_checkpoint(output_path, stage)
+    inputs = _stage_inputs(output_path, stage, params)
+    if manifest is None or inputs is None or manifest.get("inputs_hash") != _hash(inputs):
+        return False
+    for output in manifest["outputs"]:
+        path = os.path.join(output_path, output["path"])
+        if not os.path.isfile(path) or os.path.getsize(path) != output["size"]:
+            return False
+    return True
+
+
+def write_checkpoint(output_path, stage, params, started_at=None):
+    """단계가 성공한 직후 호출. 출력 파일 목록과 해시를 manifest 로 저장"""
+    inputs = _stage_inputs(output_path, stage, params)
+    if inputs is None:
+        raise ValueError(f"Cannot checkpoint {stage}: a stage it depends on has no checkpoint")
+    outputs = _list_outputs(output_path, stage)
+    finished_at = time.time()
+    manifest = {
+        "stage": stage,
+        "inputs": inputs,
+        "inputs_hash": _hash(inputs),
+        "outputs": outputs,
+        "outputs_hash": _hash([(output["path"], output["sha256"]) for output in outputs]),
+        "started_at": started_at,
+        "finished_at": finished_at,
+        "duration": None if started_at is None else finished_at - started_at,
+    }
+    path = _manifest_path(output_path, stage)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 임시 파일에 쓴 뒤 rename (중간에 종료돼도 반쪽짜리 manifest 가 남지 않도록)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(f"{path}.tmp", path)
+    return manifest
+
+
+def reset_from(output_path, stage):
+    """stage 와 그 결과에 의존하는 단계의 checkpoint 와 출력 삭제 (실패한 시도의 반쪽짜리 결과 정리)"""
+    for later in _dependents(stage):
+        try:
+            os.remove(_manifest_path(output_path, later))
+        except FileNotFoundError:
+            pass
+        for rel in STAGE_OUTPUTS[later]:
+            shutil.rmtree(os.path.join(output_path, rel), ignore_errors=True)
+
+
+def pending_stages(output_path, params, progress_file=None):
+    """실행해야 할 단계 목록 (CHECKPOINT_STAGES 순서)
+
+    완료된 단계는 진행 상황에 completed 로 기록하고, 미완료 단계와 그에 의존하는 단계의 이전 출력은 삭제한다.
+    """
+    pending = []
+    for stage in CHECKPOINT_STAGES:
+        if stage in pending:
+            continue
+        if is_complete(output_path, stage, params):
+            if stage in STAGES:
+                report_progress(stage, "completed", progress=100, message="Restored from checkpoint", path=progress_file)
+            continue
+        reset_from(output_path, stage)
+        pending += [later for later in _dependents(stage) if later not in pending]
+    return [stage for stage in CHECKPOINT_STAGES if stage in pending]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pipeline stage checkpoints")
+    parser.add_argument("--output", required=True, help="Task output directory")
+    parser.add_argument("--scene_descriptor", required=True)
+    parser.add_argument("--iterations", type=int, required=True)
+    parser.add_argument("--seed", default="")
+    parser.add_argument("--time_budget", default="")
+    parser.add_argument("command", choices=["resume", "write"])
+    parser.add_argument("stage", choices=CHECKPOINT_STAGES)
+    parser.add_argument("--started_at", type=float, default=None)
+    args = parser.parse_args()
+
+    output_path = os.path.abspath(args.output)
+    params = pipeline_params(args.scene_descriptor, args.iterations, args.seed, args.time_budget)
+    if args.command == "write":
+        write_checkpoint(output_path, args.stage, params, args.started_at)
+        return 0
+    if is_complete(output_path, args.stage, params):
+        if args.stage in STAGES:
+            report_progress(args.stage, "completed", progress=100, message="Restored from checkpoint")
+        return 0
+    reset_from(output_path, args.stage)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
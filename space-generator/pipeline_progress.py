@@ -0,0 +1,164 @@
+"""
+파이프라인 진행 상황 이벤트 기록
+
+각 단계(scene_synthesis, text_retrieval, clip_retrieval, scene_composition)는
+report_progress() 로 이벤트를 남긴다. 이벤트는 SCENE_PROGRESS_FILE (또는 set_progress_file 로 지정한 파일)에
+한 줄에 JSON 하나씩 추가되고, API 서버가 이 파일을 읽어 SSE / WebSocket 으로 전달한다.
+파일이 지정되지 않으면 아무것도 하지 않는다.
+
+report_timing() / report_count() 는 같은 파일에 측정값 이벤트("metric" 키가 있는 줄)를 남긴다.
+서버는 작업이 끝나면 이 이벤트를 읽어 /metrics 의 histogram / counter 에 반영한다.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+STAGES = ("scene_synthesis", "text_retrieval", "clip_retrieval", "scene_composition")
+
+_progress_file = None
+
+
+def set_progress_file(path):
+    """상주 워커처럼 한 프로세스가 여러 작업을 처리할 때 작업마다 호출"""
+    global _progress_file
+    _progress_file = path
+
+
+def get_progress_file():
+    return _progress_file or os.environ.get("SCENE_PROGRESS_FILE")
+
+
+def report_progress(stage, status="processing", progress=None, message="", path=None, **data):
+    """이벤트 한 줄 기록
+
+    stage: STAGES 중 하나
+    status: processing / completed / failed
+    progress: 단계 내 진행률 (0-100)
+    path: 기록할 파일 (여러 작업을 스레드로 다루는 서버 쪽에서 사용. 기본값은 get_progress_file())
+    data: iteration, best_cost 등 단계별 추가 정보
+    """
+    path = path or get_progress_file()
+    if not path:
+        return
+    event = {"time": time.time(), "stage": stage, "status": status, "message": message}
+    if progress is not None:
+        event["progress"] = int(progress)
+    event.update(data)
+    _append(path, event)
+
+
+def report_timing(operation, seconds, **labels):
+    """소요 시간(초) 기록. seconds 는 값 하나 또는 목록 (SLSQP restart 처럼 반복 측정한 값을 한 번에 기록)"""
+    path = get_progress_file()
+    if not path:
+        return
+    values = list(seconds) if isinstance(seconds, (list, tuple)) else [seconds]
+    if values:
+        _append(path, {"time": time.time(), "metric": operation, "type": "timing", "values": values,
+                       "labels": {k: str(v) for k, v in labels.items() if v is not None}})
+
+
+def report_count(name, value=1, **labels):
+    """누적 값 기록 (OpenAI token 수 등)"""
+    path = get_progress_file()
+    if not path or not value:
+        return
+    _append(path, {"time": time.time(), "metric": name, "type": "count", "value": value,
+                   "labels": {k: str(v) for k, v in labels.items() if v is not None}})
+
+
+@contextmanager
+def timed(operation, **labels):
+    """with 블록의 소요 시간을 report_timing 으로 기록 (예외가 나도 기록)"""
+    start = time.time()
+    try:
+        yield
+    finally:
+        report_timing(operation, time.time() - start, **labels)
+
+
+def _append(path, event):
+    try:
+        # 한 번의 write 로 기록 (읽는 쪽이 반쪽짜리 줄을 보지 않도록)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(event, default=float) + "\n")
+    except OSError as e:
+        print(f"Progress report failed: {e}")
+
+
+def read_events(path, offset=0):
+    """offset 부터 완성된 줄만 읽어 (이벤트 목록, 다음 offset) 반환"""
+    if not path or not os.path.exists(path):
+        return [], offset
+    with open(path, "rb") as f:
+        f.seek(offset)
+        chunk = f.read()
+    end = chunk.rfind(b"\n") + 1
+    events = []
+    for line in chunk[:end].splitlines():
+        try:
+            events.append(json.loads(line))
+        except ValueError:
+            continue
+    return events, offset + end
+
+
+def summarize_steps(events, steps=None):
+    """이벤트 목록을 단계별 최신 상태 dict 로 요약 (status API 의 steps)
+
+    steps: 앞선 이벤트들의 요약. 주면 그 복사본에 events 를 이어서 반영한다
+    """
+    steps = {stage: dict(step) for stage, step in (steps or {}).items()}
+    for event in events:
+        if "metric" in event:
+            continue
+        step = steps.setdefault(event["stage"], {"status": "pending", "progress": 0, "message": ""})
+        step["status"] = event.get("status", step["status"])
+        step["message"] = event.get("message", step["message"])
+        if "progress" in event:
+            step["progress"] = event["progress"]
+        elif step["status"] == "completed":
+            step["progress"] = 100
+        for key, value in event.items():
+            if key not in ("time", "stage", "status", "message", "progress"):
+                step[key] = value
+    return steps
+
+
+class StepSummaries:
+    """progress 파일별 단계 요약 캐시
+
+    파일마다 (inode, 읽은 offset, 요약)을 기억해 두고 다음 요청에서는 새로 추가된 이벤트만 읽는다.
+    status / 배치 status 요청이 올 때마다 progress 파일 전체를 다시 읽고 파싱하지 않기 위해 사용.
+    파일이 지워지거나 다시 만들어지면(inode 가 바뀌거나 offset 보다 작아지면) 처음부터 다시 읽는다.
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # path -> (inode, offset, steps)
+        self._lock = threading.Lock()
+
+    def steps(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            with self._lock:
+                self._entries.pop(path, None)
+            return {}
+        with self._lock:
+            inode, offset, steps = self._entries.get(path, (None, 0, {}))
+        if inode != stat.st_ino or stat.st_size < offset:
+            offset, steps = 0, {}
+        if stat.st_size > offset:
+            events, offset = read_events(path, offset)
+            steps = summarize_steps(events, steps)
+        with self._lock:
+            self._entries[path] = (stat.st_ino, offset, steps)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return steps
@@ -0,0 +1,207 @@
+"""
+언어 단계 결과(constraint program) 라이브러리
+
+새로 만든 program 을 장면 설명과 함께 {SCENE_PROGRAM_LIBRARY_DIR}/{키}.json 에 저장해 두고,
+비슷한 설명이 다시 들어오면 저장된 program 을 그대로 써서 LLM 호출 없이 바로 최적화 단계로 넘어간다.
+
+설명은 방 크기("4x5", "5m x 5m", "5 by 5")와 방 종류 단어(관사, 전치사 등을 빼고 복수형 s 를 뗀 단어 집합)로 나눈다.
+크기는 (가로, 세로) 순서 그대로 비교한다. program 이 create_room(가로, 세로)과 문, 창문이 붙는 벽(north, south 등)을
+정하므로 "4x5" 와 "5x4" 는 다른 방이다.
+개수는 뒤의 단어와 묶어 "2 bed" 같은 단어로 남긴다("two beds" 도 같음, 1 개는 그냥 "bed").
+크기와 개수 단어가 모두 같고(둘 다 없는 경우 포함) 방 종류 단어의 Jaccard 유사도가 SCENE_PROGRAM_LIBRARY_SIMILARITY
+이상이면 같은 방으로 보고, 그 중 가장 비슷한 program 을 쓴다.
+
+SCENE_PROGRAM_LIBRARY 로 동작을 고른다.
+    off    라이브러리를 사용하지 않음
+    store  새 program 을 저장만 하고 재사용하지 않음
+    reuse  비슷한 program 이 있으면 재사용하고, 없으면 언어 단계를 실행해 결과를 저장 (기본값)
+
+SCENE_PROGRAM_LIBRARY_REFRESH=1 이면 재사용한 program 을 백그라운드에서 다시 만든다. 같은 항목의 갱신은
+claim_refresh / release_refresh 의 표시 파일로 한 번에 하나만 실행된다.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+
+from layout_document import LAYOUT_VERSION
+
+LIBRARY_MODES = ("off", "store", "reuse")
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 이 시간(초)보다 오래된 갱신 표시는 끝나지 못한 갱신이 남긴 것으로 보고 무시
+REFRESH_STALE_SECONDS = 1800
+
+_DIMENSIONS = re.compile(
+    r"(\d+(?:\.\d+)?)\s*(?:m|meters?|metres?)?\s*(?:x|×|\*|by)\s*(\d+(?:\.\d+)?)\s*(?:m|meters?|metres?)?\b")
+
+# 방 종류를 구분하는 데 의미가 없는 단어
+_STOPWORDS = {
+    "a", "an", "the", "of", "in", "for", "with", "and", "that", "is", "which", "by", "x",
+    "m", "meter", "meters", "metre", "metres", "sq", "square", "sized", "size",
+}
+
+_NUMBER_WORDS = {
+    "one": "1", "two": "2", "three": "3", "four": "4", "five": "5", "six": "6",
+    "seven": "7", "eight": "8", "nine": "9", "ten": "10", "twelve": "12", "single": "1", "pair": "2",
+}
+
+
+def library_mode():
+    mode = os.getenv("SCENE_PROGRAM_LIBRARY", "reuse").strip().lower() or "reuse"
+    if mode not in LIBRARY_MODES:
+        raise ValueError(f"SCENE_PROGRAM_LIBRARY must be one of {', '.join(LIBRARY_MODES)}, got {mode!r}")
+    return mode
+
+
+def library_dir():
+    return os.path.abspath(os.getenv("SCENE_PROGRAM_LIBRARY_DIR") or os.path.join(REPO_DIR, "outputs", "program_library"))
+
+
+def similarity_threshold():
+    return float(os.getenv("SCENE_PROGRAM_LIBRARY_SIMILARITY", "0.8"))
+
+
+def parse_descriptor(scene_descriptor):
+    """장면 설명의 (방 크기, 방 종류 단어 집합). 크기가 없으면 None
+
+    개수가 붙은 단어는 "2 bed" 처럼 개수와 함께 하나의 단어가 된다.
+    """
+    text = scene_descriptor.lower()
+    dimensions = None
+    match = _DIMENSIONS.search(text)
+    if match:
+        dimensions = (float(match.group(1)), float(match.group(2)))
+        text = text[:match.start()] + " " + text[match.end():]
+    words = set()
+    count = None
+    for word in re.findall(r"\d+(?:\.\d+)?|[a-z]+", text):
+        word = _NUMBER_WORDS.get(word, word)
+        if word[0].isdigit():
+            count = word if count is None else count + " " + word
+            continue
+        if word in _STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.add(word if count in (None, "1") else f"{count} {word}")
+        count = None
+    if count is not None:
+        words.add(count)
+    return dimensions, words
+
+
+def _counts(words):
+    """개수가 붙은 단어들"""
+    return {word for word in words if word[0].isdigit()}
+
+
+def similarity(words, other_words):
+    """방 종류 단어 집합의 Jaccard 유사도"""
+    if not words and not other_words:
+        return 1.0
+    return len(words & other_words) / len(words | other_words)
+
+
+def _entry_key(dimensions, words):
+    return hashlib.sha256(json.dumps([dimensions, sorted(words)]).encode()).hexdigest()[:32]
+
+
+def _entries(directory):
+    try:
+        names = [name for name in os.listdir(directory) if name.endswith(".json")]
+    except OSError:
+        return
+    for name in names:
+        try:
+            with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if isinstance(entry, dict) and entry.get("version") == LAYOUT_VERSION and isinstance(entry.get("program"), dict):
+            yield entry
+
+
+def lookup(scene_descriptor, directory=None, threshold=None):
+    """scene_descriptor 와 크기, 개수가 같고 가장 비슷한 저장된 항목 (dict). 유사도가 threshold 미만이면 None
+
+    항목의 "descriptor" 는 program 을 만든 원래 설명, "similarity" 는 유사도.
+    저장된 단어 대신 원래 설명을 다시 나눠 비교하므로 이전 버전이 저장한 항목에도 같은 규칙이 적용된다.
+    """
+    threshold = similarity_threshold() if threshold is None else threshold
+    dimensions, words = parse_descriptor(scene_descriptor)
+    best = None
+    for entry in _entries(directory or library_dir()):
+        entry_dimensions, entry_words = parse_descriptor(entry.get("descriptor") or "")
+        if entry_dimensions != dimensions or _counts(entry_words) != _counts(words):
+            continue
+        score = similarity(words, entry_words)
+        if score >= threshold and (best is None or score > best["similarity"]):
+            best = dict(entry, similarity=score)
+    return best
+
+
+def store(scene_descriptor, program, directory=None):
+    """program 을 scene_descriptor 의 항목으로 저장 (같은 크기와 방 종류 단어의 이전 항목은 덮어씀)하고 경로 반환"""
+    directory = directory or library_dir()
+    dimensions, words = parse_descriptor(scene_descriptor)
+    entry = {
+        "version": LAYOUT_VERSION,
+        "descriptor": scene_descriptor,
+        "dimensions": dimensions,
+        "words": sorted(words),
+        "created_at": time.time(),
+        "program": program,
+    }
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{_entry_key(dimensions, words)}.json")
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(entry, f, ensure_ascii=False)
+    os.replace(tmp, path)
+    return path
+
+
+def reuse_program(entry, scene_descriptor):
+    """저장된 항목의 program 을 새 장면 설명용으로 복사"""
+    program = json.loads(json.dumps(entry["program"]))
+    program["scene_descriptor"] = scene_descriptor
+    return program
+
+
+def _refresh_marker(scene_descriptor, directory):
+    return os.path.join(directory, f"{_entry_key(*parse_descriptor(scene_descriptor))}.refreshing")
+
+
+def claim_refresh(scene_descriptor, directory=None):
+    """scene_descriptor 항목을 다시 만드는 갱신의 표시({키}.refreshing)를 만든다. 이미 진행 중인 갱신이 있으면 False
+
+    표시는 갱신이 끝나면 release_refresh 로 지운다. 같은 항목의 갱신은 한 번에 하나만 실행된다.
+    """
+    directory = directory or library_dir()
+    os.makedirs(directory, exist_ok=True)
+    marker = _refresh_marker(scene_descriptor, directory)
+    try:
+        if time.time() - os.path.getmtime(marker) > REFRESH_STALE_SECONDS:
+            os.remove(marker)
+    except OSError:
+        pass
+    try:
+        fd = os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, "w") as f:
+        f.write(str(os.getpid()))
+    return True
+
+
+def release_refresh(scene_descriptor, directory=None):
+    """claim_refresh 로 만든 갱신 표시 삭제"""
+    try:
+        os.remove(_refresh_marker(scene_descriptor, directory or library_dir()))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,110 @@
+"""
+언어 단계의 프롬프트 의존성 그래프 실행기
+
+노드는 함수 하나이고, 매개변수 이름이 그 노드가 결과를 기다리는 노드의 이름이다.
+
+    graph = PromptGraph()
+
+    @graph.node
+    def lang3(prompt2):            # prompt2 노드가 끝나면 실행
+        return ask(...)
+
+    @graph.node
+    def lang4(lang3): ...          # lang4, lang5 는 lang3 만 기다리므로 동시에 실행된다
+    @graph.node
+    def lang5(lang3): ...
+
+    results = graph.run()          # {노드 이름: 반환값}
+
+OpenAI 호출은 동기 함수이므로 asyncio 이벤트 루프가 의존성을 관리하고,
+준비된 노드는 스레드 풀(최대 max_concurrency 개)에서 실행한다.
+노드마다 시작 시각(그래프 시작 기준)과 소요 시간을 timings 에 남기고 report_timing("llm_node") 으로 기록한다.
+"""
+
+import asyncio
+import inspect
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pipeline_progress import report_timing
+
+DEFAULT_CONCURRENCY = 8
+
+
+def _max_concurrency():
+    try:
+        return max(1, int(os.getenv("SCENE_LLM_CONCURRENCY", DEFAULT_CONCURRENCY)))
+    except ValueError:
+        return DEFAULT_CONCURRENCY
+
+
+class PromptGraph:
+    """프롬프트 노드 DAG. 노드는 의존하는 노드보다 나중에 추가해야 하므로 순환이 생기지 않는다"""
+
+    def __init__(self, max_concurrency=None):
+        self.max_concurrency = max_concurrency or _max_concurrency()
+        self.nodes = {}
+        self.timings = {}
+
+    def node(self, func):
+        """데코레이터. 함수 이름이 노드 이름, 매개변수 이름이 의존 노드"""
+        deps = tuple(inspect.signature(func).parameters)
+        missing = [dep for dep in deps if dep not in self.nodes]
+        if missing:
+            raise ValueError(f"Node {func.__name__} depends on unknown nodes: {', '.join(missing)}")
+        if func.__name__ in self.nodes:
+            raise ValueError(f"Duplicate node {func.__name__}")
+        self.nodes[func.__name__] = (func, deps)
+        return func
+
+    def run(self):
+        """모든 노드를 실행하고 {이름: 결과} 반환. 노드 하나가 실패하면 아직 시작하지 않은 노드는 취소하고 예외를 다시 발생시킨다"""
+        return asyncio.run(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        started = time.time()
+        tasks = {}
+
+        async def run_node(name, func, deps):
+            args = [await tasks[dep] for dep in deps]
+            start = time.time()
+            result = await loop.run_in_executor(executor, func, *args)
+            duration = time.time() - start
+            self.timings[name] = {"start": start - started, "duration": duration, "deps": list(deps)}
+            report_timing("llm_node", duration, node=name)
+            return result
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="prompt-graph") as executor:
+            for name, (func, deps) in self.nodes.items():
+                tasks[name] = asyncio.ensure_future(run_node(name, func, deps))
+            try:
+                await asyncio.gather(*tasks.values())
+            except BaseException:
+                for task in tasks.values():
+                    task.cancel()
+                await asyncio.gather(*tasks.values(), return_exceptions=True)
+                raise
+        return {name: task.result() for name, task in tasks.items()}
+
+    def critical_path(self):
+        """가장 늦게 끝난 노드에서 거꾸로, 매번 가장 늦게 끝난 의존 노드를 따라간 경로 (실행 후 사용)"""
+        def finished(name):
+            return self.timings[name]["start"] + self.timings[name]["duration"]
+
+        path = []
+        name = max(self.timings, key=finished, default=None)
+        while name is not None:
+            path.append(name)
+            deps = self.timings[name]["deps"]
+            name = max(deps, key=finished) if deps else None
+        return path[::-1]
+
+    def summary(self):
+        """노드별 시작 / 소요 시간 표 (print 용)"""
+        lines = [f"{'node':<20}{'start':>8}{'duration':>10}"]
+        for name, timing in sorted(self.timings.items(), key=lambda item: item[1]["start"]):
+            lines.append(f"{name:<20}{timing['start']:>8.2f}{timing['duration']:>10.2f}")
+        lines.append("critical path: " + " -> ".join(self.critical_path()))
+        return "\n".join(lines)
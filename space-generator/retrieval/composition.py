@@ -7,6 +7,9 @@ import re
 from mathutils import Vector, Euler
 import math
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from layout_document import find_layout, layout_data, read_layout
+
 class SceneLayoutManager:
     def __init__(self, root_path=None):
         """
@@ -14,7 +17,7 @@ class SceneLayoutManager:
         
         Expected folder structure:
         root_path/
-        ├── layout.txt
+        ├── layout.json
         ├── background_color.txt
         ├── objects/
         │   ├── bed/
@@ -42,7 +45,7 @@ class SceneLayoutManager:
         
         # Set up standardized paths
         self.objects_path = os.path.join(self.root_path, "objects")
-        self.layout_file_path = os.path.join(self.root_path, "layout.txt")
+        self.layout_file_path = find_layout(self.root_path)
         self.background_color_path = os.path.join(self.root_path, "background_color.txt")
         self.output_path = os.path.join(self.root_path, "output")
         
@@ -59,7 +62,7 @@ class SceneLayoutManager:
     def validate_structure(self):
         """Validate that required files and folders exist"""
         required_paths = [
-            (self.layout_file_path, "layout.txt"),
+            (self.layout_file_path, os.path.basename(self.layout_file_path)),
             (self.objects_path, "objects/ folder")
         ]
         
@@ -72,7 +75,7 @@ class SceneLayoutManager:
             print(f"❌ Missing required files/folders: {', '.join(missing)}")
             print(f"Expected structure in: {self.root_path}")
             print("Required:")
-            print("  - layout.txt")
+            print("  - layout.json")
             print("  - objects/ folder")
             print("Optional:")
             print("  - background_color.txt")
@@ -81,64 +84,13 @@ class SceneLayoutManager:
             print("✅ Folder structure validated")
     
     def parse_layout_file(self):
-        """Parse the layout text file and extract room and object information"""
-        layout_data = {
-            'room_width': None,
-            'room_length': None,
-            'objects': {},
-            'style': None,
-            'prompt': None
-        }
-        
+        """Read the layout document (layout_document) and extract room and object information"""
         print(f"📖 Reading layout file: {self.layout_file_path}")
         
-        with open(self.layout_file_path, 'r') as f:
-            content = f.read()
-            
-        # Extract room dimensions
-        room_width_match = re.search(r'room_width:\s*(\d+(?:\.\d+)?)', content)
-        room_length_match = re.search(r'room_length:\s*(\d+(?:\.\d+)?)', content)
-        
-        if room_width_match:
-            layout_data['room_width'] = float(room_width_match.group(1))
-        if room_length_match:
-            layout_data['room_length'] = float(room_length_match.group(1))
-            
-        # Extract prompt
-        prompt_match = re.search(r'prompt:\s*(.+)', content)
-        if prompt_match:
-            layout_data['prompt'] = prompt_match.group(1)
-            
-        # Extract objects
-        object_pattern = r'(\w+):\s*\{\'position\':\s*\(([\d\w\.\(\), -]+)\),\s*\'width\':\s*([\d\.]+),\s*\'length\':\s*([\d\.]+)\}'
-        
-        for match in re.finditer(object_pattern, content):
-            obj_name = match.group(1)
-            
-            # Parse position tuple
-            position_str = match.group(2)
-            pos_numbers = re.findall(r'np\.float64\(([\d\.-]+)\)|(\d+(?:\.\d+)?)', position_str)
-            position = []
-            for num_match in pos_numbers:
-                if num_match[0]:  # np.float64 format
-                    position.append(float(num_match[0]))
-                elif num_match[1]:  # regular float format
-                    position.append(float(num_match[1]))
-            
-            if len(position) >= 3:
-                layout_data['objects'][obj_name] = {
-                    'position': (position[0], position[1], position[2]),
-                    'width': float(match.group(3)),
-                    'length': float(match.group(4))
-                }
-                
-        # Extract style description
-        style_match = re.search(r'style:\s*(.+)', content, re.DOTALL)
-        if style_match:
-            layout_data['style'] = style_match.group(1).strip()
+        data = layout_data(read_layout(self.layout_file_path))
             
-        print(f"📊 Parsed {len(layout_data['objects'])} objects from layout")
-        return layout_data
+        print(f"📊 Parsed {len(data['objects'])} objects from layout")
+        return data
     
     def parse_background_colors(self):
         """Parse background color file and extract floor and wall colors"""
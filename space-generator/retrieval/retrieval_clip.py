@@ -4,12 +4,32 @@ import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
 import os
 import re
+import sys
 import time
 
-clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch16").cuda()
-clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch16")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline_progress import report_progress, report_timing
+from layout_document import read_query_text
+
+CLIP_MODEL_NAME = "openai/clip-vit-base-patch16"
+EMBEDDING_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "clip_image_embeddings.npy")
+
+# 처음 사용할 때 한 번만 로드 (상주 워커에서는 프로세스 시작 시 미리 로드)
+clip_model = None
+clip_processor = None
+
+def load_clip_model():
+    global clip_model, clip_processor
+    if clip_model is None:
+        clip_model = CLIPModel.from_pretrained(CLIP_MODEL_NAME).cuda()
+        clip_processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+    return clip_model, clip_processor
+
+def load_embeddings(embedding_path=EMBEDDING_PATH):
+    return np.load(embedding_path, allow_pickle=True).item()
 
 def get_clip_text_embedding(text):
+    load_clip_model()
     max_length = 77
     inputs = clip_processor(text=[text], return_tensors="pt", padding=True, truncation=True, max_length=max_length)
     inputs = {k: v.cuda() for k, v in inputs.items()}
@@ -100,7 +120,9 @@ def clip_rerank_for_all_objects(results_by_object, query_text, embedding_dict, d
     print(f"\n🎯 CLIP Reranking 시작 (총 {len(items)}개 object)")
     print("=" * 60)
     
-    for object_name, object_block in items:
+    for i, (object_name, object_block) in enumerate(items):
+        report_progress('clip_retrieval', progress = 10 + 85 * i / len(items),
+                        message = f"Reranking {object_name}", object = object_name)
         obj_start = time.time()
         obj_key = object_name.strip().lower()
         
@@ -140,6 +162,7 @@ def clip_rerank_for_all_objects(results_by_object, query_text, embedding_dict, d
             rerank_start = time.time()
             reranked = clip_similarity_rerank(candidate_items, prompt, embedding_dict, top_k=top_k)
             rerank_end = time.time()
+            report_timing('clip_rerank', rerank_end - rerank_start)
             
             if reranked:
                 print(f"🎉 CLIP Top-{len(reranked)} 결과 ({rerank_end - rerank_start:.2f}초):")
@@ -192,7 +215,7 @@ def save_clip_results(final_results, output_dir):
         
         print(f"💾 {object_name} CLIP 결과 저장: {filepath} ({len(items)}개)")
 
-def main(query_text_path, candidate_folder, output_dir):
+def main(query_text_path, candidate_folder, output_dir, database=None, embedding_dict=None):
     start_time = time.time()
     print("🚀 CLIP 기반 가구 검색 시작")
     print("=" * 60)
@@ -205,22 +228,22 @@ def main(query_text_path, candidate_folder, output_dir):
         os.path.join(base_path, "3D-FUTURE-model-part3"),
         os.path.join(base_path, "3D-FUTURE-model-part4")
     ]
-    embedding_path = "clip_image_embeddings.npy"
 
-    # 1. 쿼리 텍스트 파일에서 읽기
-    with open(query_text_path, "r", encoding="utf-8") as f:
-        query_text = f.read()
+    # 1. 레이아웃 문서에서 쿼리 텍스트(style 설명) 읽기
+    query_text = read_query_text(query_text_path)
 
     # 2. 데이터 로딩
+    report_progress('clip_retrieval', progress = 0, message = "Loading CLIP data")
     load_start = time.time()
-    print("📚 데이터베이스 로딩 중...")
-    from object_retrieval import load_all_model_info
-    database = load_all_model_info(folder_paths)
+    if database is None:
+        print("📚 데이터베이스 로딩 중...")
+        from object_retrieval import load_all_model_info
+        database = load_all_model_info(folder_paths)
     print(f"✅ 데이터베이스: {len(database)}개 아이템 로드")
     
-    print("🖼️ CLIP 임베딩 로딩 중...")
-    import numpy as np
-    embedding_dict = np.load(embedding_path, allow_pickle=True).item()
+    if embedding_dict is None:
+        print("🖼️ CLIP 임베딩 로딩 중...")
+        embedding_dict = load_embeddings()
     print(f"✅ CLIP 임베딩: {len(embedding_dict)}개 로드")
     
     print("📂 후보 ID 파일 로딩 중...")
@@ -252,6 +275,9 @@ def main(query_text_path, candidate_folder, output_dir):
     
     total_time = time.time() - start_time
     print(f"\n⏱️ 총 실행 시간: {total_time:.2f}초")
+    report_progress('clip_retrieval', 'completed', progress = 100,
+                    message = f"{len(final_results)} objects reranked", duration = total_time)
+    return final_results
 
 if __name__ == "__main__":
     import argparse
@@ -259,8 +285,8 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="CLIP reranking for furniture retrieval")
 
     parser.add_argument(
-        "--layout_path", default="/source/sumin/stylin/Scene_Synthesis/Result_txt/layout.txt", type=str, required=True,
-        help="Path to the layout.txt file (LLM prompt result)"
+        "--layout_path", default="/source/sumin/stylin/Scene_Synthesis/Result_txt/layout.json", type=str, required=True,
+        help="Path to the layout.json file (LLM prompt result)"
     )
     parser.add_argument(
         "--candidate_folder", default="/source/sumin/stylin/Scene_Synthesis/Result_retrieval/text_retrieval", type=str, required=True,
@@ -9,6 +9,10 @@ import trimesh
 from typing import Dict, List, Optional, Tuple
 import open3d as o3d
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline_progress import report_progress, timed
+from layout_document import LayoutFormatError, find_layout, layout_data, read_layout
+
 class SceneComposer:
     def __init__(self, root_path=None, clip_results_path="/source/sumin/stylin/FlairGPT/retrieval/clip_rerank_results"):
         """
@@ -28,7 +32,7 @@ class SceneComposer:
         
         # Set up standardized paths
         self.clip_results_path = clip_results_path
-        self.layout_file_path = os.path.join(self.root_path, "layout.txt")
+        self.layout_file_path = find_layout(self.root_path)
         self.background_color_path = os.path.join(self.root_path, "background_color.txt")
         self.output_path = os.path.join(self.root_path, "output")
         
@@ -57,7 +61,7 @@ class SceneComposer:
     def validate_structure(self):
         """Validate that required files exist"""
         required_paths = [
-            (self.layout_file_path, "layout.txt"),
+            (self.layout_file_path, os.path.basename(self.layout_file_path)),
         ]
         
         missing = []
@@ -69,226 +73,58 @@ class SceneComposer:
             print(f"❌ Missing required files: {', '.join(missing)}")
             print(f"Expected structure in: {self.root_path}")
             print("Required:")
-            print("  - layout.txt")
+            print("  - layout.json")
             sys.exit(1)
         else:
             print("✅ File structure validated")
     
-    # parse_layout_file 함수 수정 (색상 로딩 개선)
     def parse_layout_file(self):
-        """Parse the layout text file and extract room and object information - FIXED VERSION"""
-        layout_data = {
-            'room_width': None,
-            'room_length': None,
-            'objects': {},
-            'style': None,
-            'prompt': None
-        }
-        
+        """Read the layout document (layout_document) and extract room and object information"""
         print(f"📖 Reading layout file: {self.layout_file_path}")
         
-        with open(self.layout_file_path, 'r') as f:
-            content = f.read()
-        
-        # Debug: Show first part of content
-        print(f"📄 Layout file preview:")
-        lines = content.split('\n')[:10]  # First 10 lines
-        for i, line in enumerate(lines):
-            print(f"  {i+1:2d}: {line}")
-        total_lines = len(content.split('\n'))
-        if total_lines > 10:
-            print(f"  ... (total {total_lines} lines)")
-        
-        # Extract room dimensions
-        room_width_match = re.search(r'room_width:\s*(\d+(?:\.\d+)?)', content)
-        room_length_match = re.search(r'room_length:\s*(\d+(?:\.\d+)?)', content)
-        
-        if room_width_match:
-            layout_data['room_width'] = float(room_width_match.group(1))
-            print(f"🏠 Found room width: {layout_data['room_width']}")
-        if room_length_match:
-            layout_data['room_length'] = float(room_length_match.group(1))
-            print(f"🏠 Found room length: {layout_data['room_length']}")
-        
-        # Extract prompt
-        prompt_match = re.search(r'prompt:\s*(.+)', content)
-        if prompt_match:
-            layout_data['prompt'] = prompt_match.group(1)
-            print(f"📝 Found prompt: {layout_data['prompt'][:50]}...")
-        
-        # FIXED: Extract ALL objects from position format (including doors and windows)
-        print(f"\n🔍 Searching for ALL objects with position data...")
-        
-        # Updated pattern to catch all object names (including with numbers)
-        object_pattern = r'(\w+\d*):\s*\{\'position\':\s*\(([\d\w\.\(\), -]+)\),\s*\'width\':\s*([\d\.]+),\s*\'length\':\s*([\d\.]+)\}'
-        
-        all_objects_found = 0
-        doors_windows_found = 0
-        furniture_found = 0
+        try:
+            document = read_layout(self.layout_file_path)
+        except LayoutFormatError as e:
+            print(f"❌ Invalid layout file: {e}")
+            raise
         
-        for match in re.finditer(object_pattern, content):
-            obj_name = match.group(1)
-            all_objects_found += 1
-            
-            # Parse position tuple - FIXED: 과학적 표기법 지원
-            position_str = match.group(2)
-            
-            # 🔥 수정된 정규식: 과학적 표기법(e-09, E+10 등) 지원
-            pos_numbers = re.findall(
-                r'np\.float64\(([\d\.\-+eE]+)\)|([\d\.\-+eE]+)',
-                position_str
-            )
-            position = []
-            for num_match in pos_numbers:
-                if num_match[0]:  # np.float64 format
-                    position.append(float(num_match[0]))
-                elif num_match[1]:  # regular float format
-                    position.append(float(num_match[1]))
-            
-            if len(position) >= 3:
-                obj_data = {
-                    'position': (position[0], position[1], position[2]),
-                    'width': float(match.group(3)),
-                    'length': float(match.group(4))
-                }
-                
-                # Check if it's a door or window
-                is_door_window = any(keyword in obj_name.lower() for keyword in ['door', 'window'])
-                
-                if is_door_window:
-                    doors_windows_found += 1
-                    print(f"  🚪/🪟 Found door/window: '{obj_name}' at {obj_data['position']}, size {obj_data['width']}x{obj_data['length']}")
-                else:
-                    furniture_found += 1
-                    print(f"  🪑 Found furniture: '{obj_name}' at {obj_data['position']}, size {obj_data['width']}x{obj_data['length']}")
-                
-                layout_data['objects'][obj_name] = obj_data
+        data = layout_data(document)
+        print(f"🏠 Room: {data['room_width']}m x {data['room_length']}m")
+        print(f"📝 Prompt: {data['prompt'][:50]}...")
+        
+        doors_windows_found = 0
+        for name, obj_data in data['objects'].items():
+            if any(keyword in name.lower() for keyword in ['door', 'window']):
+                doors_windows_found += 1
+                print(f"  🚪/🪟 {name}: pos={obj_data['position']}, size={obj_data['width']}x{obj_data['length']}")
             else:
-                print(f"  ❌ Invalid position data for {obj_name}: {position_str}")
+                print(f"  🪑 {name}: pos={obj_data['position']}, size={obj_data['width']}x{obj_data['length']}")
         
-        print(f"\n📊 Parsing summary:")
-        print(f"  📦 Total objects found: {all_objects_found}")
+        print(f"\n📊 Layout summary:")
+        print(f"  📦 Total objects: {len(data['objects'])}")
         print(f"  🚪 Doors/Windows: {doors_windows_found}")
-        print(f"  🪑 Furniture: {furniture_found}")
-        
-        # Extract numbered object names (for reference only, already parsed above)
-        pattern = re.compile(
-            r'^\s*(\d+)[\.\)\-:\s]+\*\*([^*]+)\*\*[\s\S]*?(?=^\s*\d+[\.\)\-:\s]+\*\*|$\Z)',
-            re.MULTILINE
-        )
+        print(f"  🪑 Furniture: {len(data['objects']) - doors_windows_found}")
+        if data['style']:
+            print(f"🎨 Style: {data['style'][:100]}...")
         
-        numbered_objects = []
-        for match in pattern.finditer(content):
-            object_name = match.group(2).strip()
-            numbered_objects.append(object_name)
-        
-        if numbered_objects:
-            print(f"📋 Found {len(numbered_objects)} numbered objects (for reference): {numbered_objects}")
-        
-        # Extract style description
-        style_match = re.search(r'style:\s*(.+)', content, re.DOTALL)
-        if style_match:
-            layout_data['style'] = style_match.group(1).strip()
-            print(f"🎨 Found style: {layout_data['style'][:100]}...")
-        
-        print(f"\n✅ Final object list:")
-        for name, data in layout_data['objects'].items():
-            obj_type = "🚪/🪟" if any(keyword in name.lower() for keyword in ['door', 'window']) else "🪑"
-            print(f"  {obj_type} {name}: pos={data['position']}, size={data['width']}x{data['length']}")
-        
-        return layout_data
+        return data
 
-    # parse_background_colors 함수 수정 (layout.txt 색상 우선 사용)
     def parse_background_colors(self):
-        """Parse layout.txt and extract floor and wall colors from both formats"""
-        # 기본 색상값 설정
+        """Floor and wall colors from the layout document (RGB only), defaults if missing"""
         colors = {
             'floor_color': (0.8, 0.6, 0.4),  # 기본 바닥 색상
             'wall_color': (0.6, 0.7, 0.6)    # 기본 벽 색상
         }
         
-        # layout.txt에서 색상 정보 파싱
-        if hasattr(self, 'layout_file_path') and os.path.exists(self.layout_file_path):
-            print(f"📄 Parsing colors from layout.txt: {self.layout_file_path}")
-            try:
-                with open(self.layout_file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                
-                # 두 가지 형식 모두 시도
-                colors = self.parse_colors_from_content(content, colors)
-                        
-            except Exception as e:
-                print(f"❌ Error reading layout.txt: {e}")
-                print("Using default colors")
-        else:
-            print(f"📄 Layout file not found, using default colors")
+        for key in ('floor_color', 'wall_color'):
+            if self.layout_data.get(key):
+                colors[key] = tuple(self.layout_data[key][:3])  # RGB만 사용
+            else:
+                print(f"📄 No {key} in layout, using default")
             
         print(f"🎨 Final colors - Floor: {colors['floor_color']}, Wall: {colors['wall_color']}")
         return colors
 
-    def parse_colors_from_content(self, content, default_colors):
-        """Parse colors from content with multiple format support"""
-        colors = default_colors.copy()
-        
-        # 우선순위 1: 간단한 형식 (wall_color: (0.95, 0.95, 0.95, 1.0))
-        print("🔍 Trying simple format first...")
-        
-        # wall_color 간단한 형식
-        wall_simple_match = re.search(r"wall_color\s*:\s*\(([^)]+)\)", content)
-        if wall_simple_match:
-            try:
-                rgba_str = wall_simple_match.group(1)
-                rgba_values = [float(x.strip()) for x in rgba_str.split(',')]
-                if len(rgba_values) >= 3:
-                    colors['wall_color'] = tuple(rgba_values[:3])  # RGB만 사용
-                    print(f"🎨 Parsed wall color (simple format): {colors['wall_color']}")
-            except Exception as e:
-                print(f"❌ Error parsing wall color (simple): {e}")
-        
-        # floor_color 간단한 형식
-        floor_simple_match = re.search(r"floor_color\s*:\s*\(([^)]+)\)", content)
-        if floor_simple_match:
-            try:
-                rgba_str = floor_simple_match.group(1)
-                rgba_values = [float(x.strip()) for x in rgba_str.split(',')]
-                if len(rgba_values) >= 3:
-                    colors['floor_color'] = tuple(rgba_values[:3])  # RGB만 사용
-                    print(f"🎨 Parsed floor color (simple format): {colors['floor_color']}")
-            except Exception as e:
-                print(f"❌ Error parsing floor color (simple): {e}")
-        
-        # 우선순위 2: 딕셔너리 형식 (간단한 형식에서 찾지 못한 경우만)
-        if colors['wall_color'] == default_colors['wall_color'] or colors['floor_color'] == default_colors['floor_color']:
-            print("🔍 Trying dictionary format...")
-            
-            # wall_color 딕셔너리 형식 (간단한 형식에서 못 찾은 경우만)
-            if colors['wall_color'] == default_colors['wall_color']:
-                wall_dict_match = re.search(r"'wall_color'\s*:\s*\{[^}]*'rgba'\s*:\s*\(([^)]+)\)", content)
-                if wall_dict_match:
-                    try:
-                        rgba_str = wall_dict_match.group(1)
-                        rgba_values = [float(x.strip()) for x in rgba_str.split(',')]
-                        if len(rgba_values) >= 3:
-                            colors['wall_color'] = tuple(rgba_values[:3])  # RGB만 사용
-                            print(f"🎨 Parsed wall color (dict format): {colors['wall_color']}")
-                    except Exception as e:
-                        print(f"❌ Error parsing wall color (dict): {e}")
-            
-            # floor_color 딕셔너리 형식 (간단한 형식에서 못 찾은 경우만)
-            if colors['floor_color'] == default_colors['floor_color']:
-                floor_dict_match = re.search(r"'floor_color'\s*:\s*\{[^}]*'rgba'\s*:\s*\(([^)]+)\)", content)
-                if floor_dict_match:
-                    try:
-                        rgba_str = floor_dict_match.group(1)
-                        rgba_values = [float(x.strip()) for x in rgba_str.split(',')]
-                        if len(rgba_values) >= 3:
-                            colors['floor_color'] = tuple(rgba_values[:3])  # RGB만 사용
-                            print(f"🎨 Parsed floor color (dict format): {colors['floor_color']}")
-                    except Exception as e:
-                        print(f"❌ Error parsing floor color (dict): {e}")
-        
-        return colors
-
     
     def create_room_mesh(self):
         """Create room mesh with floor and walls - ENHANCED VERSION"""
@@ -1588,10 +1424,13 @@ class SceneComposer:
         
         print(f"\n🪑 Loading furniture: {furniture_objects}")
         
-        for obj_name in furniture_objects:
+        for i, obj_name in enumerate(furniture_objects):
+            report_progress('scene_composition', progress = 10 + 70 * i / max(1, len(furniture_objects)),
+                            message = f"Loading {obj_name}", object = obj_name)
             if obj_name in self.layout_data['objects']:
                 try:
-                    mesh = self.load_furniture_object(obj_name, self.layout_data['objects'][obj_name])
+                    with timed('mesh_load'):
+                        mesh = self.load_furniture_object(obj_name, self.layout_data['objects'][obj_name])
                     if mesh is not None:
                         self.scene_meshes.append({
                             'mesh': mesh,
@@ -1739,13 +1578,20 @@ class SceneComposer:
             print(f"   {obj_type} {name}: pos={data['position']}, size={data['width']}x{data['length']}")
         
         # Create room
+        report_progress('scene_composition', progress = 0, message = "Creating room mesh")
         self.create_room_mesh()
         
         # Load furniture
         self.load_all_furniture()
         
         # Save scene
-        success = self.save_scene_as_glb()
+        report_progress('scene_composition', progress = 80, message = "Exporting GLB")
+        with timed('glb_export'):
+            success = self.save_scene_as_glb()
+        if success:
+            report_progress('scene_composition', 'completed', progress = 100, message = "Scene saved")
+        else:
+            report_progress('scene_composition', 'failed', message = "GLB export failed")
         
         # Final summary
         print("\n" + "=" * 50)
@@ -1765,6 +1611,8 @@ class SceneComposer:
                 color_info = f" (Color: {self.background_colors['wall_color']})"
             print(f"   {icon} {item['name']}{color_info}")
 
+        return success
+
 
     # combine_scene_meshes 함수 수정 (색상 적용 개선)
     def combine_scene_meshes(self):
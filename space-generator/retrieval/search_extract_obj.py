@@ -2,19 +2,23 @@
 import open3d as o3d
 import numpy as np
 import os
+import sys
 import re
 import json
 import shutil
 from typing import Dict, List, Optional
 import trimesh
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from layout_document import find_layout, read_layout
+
 class OBJLoaderTest:
     def __init__(self, root_path=None, clip_results_path="clip_rerank_results"):
         """
         Initialize the OBJ loader test
         
         Args:
-            root_path: Root directory path containing layout.txt
+            root_path: Root directory path containing layout.json
             clip_results_path: Path to CLIP rerank results folder
         """
         if root_path is None:
@@ -23,7 +27,7 @@ class OBJLoaderTest:
             self.root_path = os.path.abspath(root_path)
             
         self.clip_results_path = clip_results_path
-        self.layout_file_path = os.path.join(self.root_path, "layout.txt")
+        self.layout_file_path = find_layout(self.root_path)
         self.output_path = os.path.join(self.root_path, "output", "individual_meshes")
         
         # 3D-FUTURE dataset paths
@@ -44,7 +48,7 @@ class OBJLoaderTest:
         print(f"📁 Output path: {self.output_path}")
         
     def parse_layout_file(self):
-        """Parse layout.txt to get object names"""
+        """Read the layout document to get object names"""
         objects = {}
         
         print(f"\n📖 Reading layout file: {self.layout_file_path}")
@@ -53,29 +57,26 @@ class OBJLoaderTest:
             print(f"❌ Layout file not found!")
             return objects
             
-        with open(self.layout_file_path, 'r') as f:
-            content = f.read()
+        document = read_layout(self.layout_file_path)
             
-        # First, extract object positions from the standard format
-        position_pattern = r'(\w+):\s*\{\'position\':\s*\(([\d\w\.\(\), -]+)\),\s*\'width\':\s*([\d\.]+),\s*\'length\':\s*([\d\.]+)\}'
-        
+        # First, object sizes from the layout (doors and windows are not retrieved)
         positions = {}
-        for match in re.finditer(position_pattern, content):
-            obj_name = match.group(1).lower()
+        for obj in document['objects']:
+            obj_name = obj['name'].lower()
             if 'door' not in obj_name and 'window' not in obj_name:
                 positions[obj_name] = {
-                    'width': float(match.group(3)),
-                    'length': float(match.group(4))
+                    'width': obj['width'],
+                    'length': obj['length']
                 }
         
-        # Then, parse numbered blocks for object names (더 정확한 이름)
+        # Then, parse numbered blocks of the style description for object names (더 정확한 이름)
         pattern = re.compile(
             r'^\s*(\d+)[\.\)\-:\s]+\*\*([^*]+)\*\*[\s\S]*?(?=^\s*\d+[\.\)\-:\s]+\*\*|$\Z)',
             re.MULTILINE
         )
         
         numbered_objects = []
-        for match in pattern.finditer(content):
+        for match in pattern.finditer(document['style']):
             object_name = match.group(2).strip()
             numbered_objects.append(object_name)
             
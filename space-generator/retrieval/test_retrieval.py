@@ -7,6 +7,11 @@ from collections import defaultdict, Counter
 from difflib import SequenceMatcher
 import math
 import argparse
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline_progress import report_progress, timed
+from layout_document import read_query_text
 
 
 # 데이터베이스 카테고리 정의
@@ -838,18 +843,23 @@ def save_results_to_files(results_by_object: Dict, output_dir: str = "./search_r
         except Exception as e:
             print(f"❌ {object_name} 저장 실패: {e}")
 
-def search_furniture_database(folder_paths: List[str], query_text: str, output_dir: str = "./search_results"):
-    """실제 데이터베이스를 사용한 가구 검색 (간소화된 버전)"""
+def search_furniture_database(folder_paths: List[str], query_text: str, output_dir: str = "./search_results", database: List[Dict] = None):
+    """실제 데이터베이스를 사용한 가구 검색 (간소화된 버전)
+
+    database 를 넘기면 (이미 로드된 DB를 재사용하는 상주 워커) 폴더를 다시 읽지 않는다.
+    """
     
     # 검색 엔진 초기화
     search_engine = FurnitureSearchEngine()
     
     # 데이터베이스 로드
-    print("=== 데이터베이스 로딩 중... ===")
-    database = DatabaseLoader.load_multiple_folders(folder_paths)
+    if database is None:
+        print("=== 데이터베이스 로딩 중... ===")
+        database = DatabaseLoader.load_multiple_folders(folder_paths)
     
     if not database:
         print("데이터베이스가 비어있습니다!")
+        report_progress('text_retrieval', 'failed', message = "Furniture database is empty")
         return
     
     print(f"총 {len(database)}개 아이템 로드 완료")
@@ -872,6 +882,7 @@ def search_furniture_database(folder_paths: List[str], query_text: str, output_d
     
     if not parsed_items:
         print("파싱된 아이템이 없습니다.")
+        report_progress('text_retrieval', 'completed', progress = 100, message = "No objects parsed from layout")
         return
     
     print(f"\n총 {len(parsed_items)}개 아이템이 성공적으로 매칭됨")
@@ -879,8 +890,10 @@ def search_furniture_database(folder_paths: List[str], query_text: str, output_d
     # 각 object별로 검색 결과 저장
     results_by_object = {}
     
-    for parsed_item in parsed_items:
+    for i, parsed_item in enumerate(parsed_items):
         target_category = parsed_item['target_category']
+        report_progress('text_retrieval', progress = 100 * i / len(parsed_items),
+                        message = f"Searching {target_category}", object = target_category)
         
         # 해당 object에 대한 모든 결과 계산
         object_results = []
@@ -919,6 +932,8 @@ def search_furniture_database(folder_paths: List[str], query_text: str, output_d
     
     # 요약 통계 출력
     total_results = sum(len(results) for results in results_by_object.values())
+    report_progress('text_retrieval', 'completed', progress = 100,
+                    message = f"{len(parsed_items)} objects searched", candidates = total_results)
     print(f"\n{'='*60}")
     print(f"🎯 검색 완료!")
     print(f"📁 결과 저장 위치: {output_dir}")
@@ -930,7 +945,7 @@ def search_furniture_database(folder_paths: List[str], query_text: str, output_d
     return results_by_object
 
 # 사용 예시
-def demo_search(query_text_path, output_dir):
+def demo_search(query_text_path, output_dir, database=None):
     # 실제 데이터베이스 폴더 경로들
     DATASET_BASE_PATH = os.environ.get('DATASET_BASE_PATH', '../../dataset')
 
@@ -941,17 +956,18 @@ def demo_search(query_text_path, output_dir):
         os.path.join(DATASET_BASE_PATH, "3D-FUTURE-model-part4")
     ]
     
-    with open(query_text_path, "r", encoding="utf-8") as f:
-        query_text = f.read()
+    # 레이아웃 문서의 style 설명 (일반 텍스트 파일이면 내용 그대로)
+    query_text = read_query_text(query_text_path)
         
-    search_furniture_database(folder_paths, query_text, output_dir)
+    with timed('text_retrieval'):
+        return search_furniture_database(folder_paths, query_text, output_dir, database=database)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Furniture category & keyword matching")
 
     parser.add_argument(
         "--layout_path", type=str, default = "Result_txt/test.txt", required=True,
-        help="Path to the layout.txt file (LLM prompt result)"
+        help="Path to the layout.json file (LLM prompt result)"
     )
 
     parser.add_argument(
@@ -961,4 +977,4 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
-    demo_search(args.layout_path, args.output_dir)
\ No newline at end of file
+    demo_search(args.layout_path, args.output_dir)
@@ -0,0 +1,127 @@
+import heapq
+import threading
+import time
+from collections import deque
+
+
+class QueueFullError(Exception):
+    """대기열이 가득 찼을 때 발생"""
+
+
+class SceneTaskQueue:
+    """고정 크기 워커 풀 + FIFO 대기열
+
+    작업은 submit() 순서대로 max_workers 개의 워커 스레드에서 실행되고,
+    대기 중인 작업이 max_queue 개를 넘으면 QueueFullError 로 즉시 거절한다.
+    runner 가 False 를 반환하면 (취소되어 실행하지 않은 작업) 소요 시간 통계에서 제외한다.
+    """
+
+    def __init__(self, runner, max_workers=2, max_queue=20, default_duration=300.0):
+        self.runner = runner
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue = max(0, int(max_queue))
+        self.default_duration = float(default_duration)
+
+        self._queue = deque()           # (task_id, args)
+        self._forced = set()            # max_queue 에 포함하지 않는 (force=True 로 추가한) 작업
+        self._running = {}              # task_id -> 시작 시각
+        self._durations = deque(maxlen=20)
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def start(self):
+        """워커 스레드 시작 (여러 번 호출해도 한 번만 시작)"""
+        with self._cond:
+            if self._threads:
+                return
+            for i in range(self.max_workers):
+                thread = threading.Thread(target=self._worker, name=f"scene-worker-{i}")
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, task_id, *args, force=False):
+        """작업을 대기열에 추가하고 0부터 시작하는 대기 순번을 반환
+
+        force=True 면 max_queue 를 넘어도 추가 (배치 요청은 전체 크기를 따로 제한한다)
+        """
+        with self._cond:
+            if not force and len(self._queue) - len(self._forced) >= self.max_queue:
+                raise QueueFullError(f"Queue is full ({self.max_queue} tasks waiting)")
+            self._queue.append((task_id, args))
+            if force:
+                self._forced.add(task_id)
+            self._cond.notify()
+            return len(self._queue) - 1
+
+    def cancel(self, task_id):
+        """대기 중인 작업을 대기열에서 제거. 대기열에 없으면 False"""
+        with self._cond:
+            for i, (queued_id, _) in enumerate(self._queue):
+                if queued_id == task_id:
+                    del self._queue[i]
+                    self._forced.discard(task_id)
+                    return True
+        return False
+
+    def average_duration(self):
+        with self._cond:
+            return self._average_duration()
+
+    def _average_duration(self):
+        if not self._durations:
+            return self.default_duration
+        return sum(self._durations) / len(self._durations)
+
+    def estimate_wait(self, position, started_times):
+        """대기 순번 position 인 작업의 예상 대기 시간(초)
+
+        position, started_times: 이 프로세스 대기열에서의 순번과 이 프로세스에서 실행 중인 작업들의 시작 시각
+            (여러 프로세스가 공유하는 저장소에서 가져온 값, TaskStore.owner_queue). 슬롯 수는 프로세스마다 max_workers 개
+        """
+        with self._cond:
+            return self._estimate_wait(position, started_times)
+
+    def _estimate_wait(self, position, started_times):
+        # 각 워커 슬롯이 비는 시각을 시뮬레이션
+        average = self._average_duration()
+        now = time.time()
+        slots = [max(0.0, average - (now - started)) for started in started_times]
+        slots += [0.0] * (self.max_workers - len(slots))
+        heapq.heapify(slots)
+
+        start = 0.0
+        for _ in range(position + 1):
+            start = heapq.heappop(slots)
+            heapq.heappush(slots, start + average)
+        return start
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queued": len(self._queue),
+                "running": len(self._running),
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "average_duration": round(self._average_duration(), 1),
+            }
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                task_id, args = self._queue.popleft()
+                self._forced.discard(task_id)
+                self._running[task_id] = time.time()
+
+            executed = True
+            try:
+                executed = self.runner(task_id, *args) is not False
+            except Exception as e:
+                print(f"Task {task_id}: Worker error - {e}")
+            finally:
+                with self._cond:
+                    started = self._running.pop(task_id, None)
+                    if started is not None and executed:
+                        self._durations.append(time.time() - started)
@@ -0,0 +1,497 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# 상태 값
+QUEUED = "queued"
+PROCESSING = "processing"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (COMPLETED, FAILED, CANCELLED)
+
+# 테이블 컬럼으로 저장하는 필드. 그 외 필드는 extra(JSON)에 저장
+COLUMNS = ("status", "scene_descriptor", "iterations", "created_at", "started_at",
+           "updated_at", "file_path", "error", "owner",
+           "request_key", "leader_id", "idempotency_key", "batch_id")
+
+# create_or_attach 결과
+CREATED = "created"      # 새 작업
+ATTACHED = "attached"    # 같은 요청을 실행 중인 작업(leader)에 붙음
+EXISTING = "existing"    # 같은 Idempotency-Key 로 이미 만든 작업
+
+
+def current_owner():
+    """작업을 실행 중인 프로세스 식별자 (호스트:PID)"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner):
+    """같은 호스트의 프로세스면 살아있는지 확인. 다른 호스트는 알 수 없으므로 살아있다고 가정"""
+    if not owner or ":" not in owner:
+        return True
+    host, pid = owner.rsplit(":", 1)
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+    return True
+
+
+class TaskStore:
+    """작업 상태 저장소 인터페이스
+
+    ttl 초가 지난 완료/실패 작업과 max_entries 를 넘는 오래된 작업은 evict_expired() 에서 삭제한다.
+    """
+
+    def __init__(self, ttl=86400.0, max_entries=10000, sweep_interval=60.0):
+        self.ttl = float(ttl)
+        self.max_entries = max(1, int(max_entries))
+        self.sweep_interval = float(sweep_interval)
+        self._last_sweep = 0.0
+
+    def create(self, task_id, **fields):
+        raise NotImplementedError
+
+    def create_or_attach(self, task_id, request_key=None, idempotency_key=None, **fields):
+        """작업 생성을 한 번에(원자적으로) 처리
+
+        - idempotency_key 로 만든 작업이 이미 있으면 새로 만들지 않고 (EXISTING, 기존 task_id)
+        - request_key 가 같은 작업이 대기/실행 중이면 그 작업을 leader 로 하는 follower 를 만들고 (ATTACHED, leader_id)
+        - 아니면 새 작업을 만들고 (CREATED, task_id)
+        follower 는 대기열에 들어가지 않고 leader 의 결과를 공유한다.
+        """
+        raise NotImplementedError
+
+    def followers(self, leader_id):
+        """leader 에 붙어 있는 작업 id 목록"""
+        raise NotImplementedError
+
+    def batch_tasks(self, batch_id):
+        """배치에 속한 작업 dict 목록 (생성 순서)"""
+        raise NotImplementedError
+
+    def get(self, task_id):
+        """작업 dict 반환. 없으면 None"""
+        raise NotImplementedError
+
+    def update(self, task_id, **fields):
+        """필드 변경. 취소된 작업은 더 이상 바꾸지 않는다 (실행 중이던 파이프라인이 늦게 상태를 쓰더라도)"""
+        raise NotImplementedError
+
+    def cancel(self, task_id, **fields):
+        """대기/실행 중인 작업을 cancelled 로 변경. 이미 끝난 작업이면 False"""
+        raise NotImplementedError
+
+    def delete(self, task_id):
+        raise NotImplementedError
+
+    def count(self, status=None, include_batches=True):
+        """작업 수. status 를 주면 실제로 실행되는 작업(follower 제외)만 센다
+
+        include_batches=False 면 배치 요청으로 만든 작업은 제외 (단일 요청의 대기열 제한 확인용)
+        """
+        raise NotImplementedError
+
+    def queue_position(self, task_id):
+        """전체 대기열에서의 순번 (0 = 다음 차례). 대기 중이 아니면 None"""
+        raise NotImplementedError
+
+    def owner_queue(self, task_id):
+        """(작업을 맡은 프로세스(owner) 대기열에서의 순번, 그 프로세스에서 실행 중인 작업들의 시작 시각 목록)
+
+        작업은 추가한 프로세스의 워커만 실행하므로 시작 시각 예상은 이 값으로 한다. 대기 중이 아니면 None
+        """
+        raise NotImplementedError
+
+    def evict_expired(self):
+        """만료된 작업을 삭제하고 삭제한 개수를 반환"""
+        raise NotImplementedError
+
+    def fail_orphaned(self):
+        """실행하던 프로세스가 죽어서 끝나지 못한 작업을 failed 로 표시"""
+        raise NotImplementedError
+
+    def maybe_evict(self):
+        now = time.time()
+        if now - self._last_sweep >= self.sweep_interval:
+            self._last_sweep = now
+            return self.evict_expired()
+        return 0
+
+    def close(self):
+        pass
+
+
+class MemoryTaskStore(TaskStore):
+    """프로세스 메모리 저장소 (uvicorn 워커 1개일 때만 사용)"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._tasks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, task_id, **fields):
+        now = time.time()
+        task = {"status": QUEUED, "updated_at": now, "owner": current_owner()}
+        task.update(fields)
+        with self._lock:
+            self._tasks[task_id] = task
+        self.maybe_evict()
+
+    def create_or_attach(self, task_id, request_key=None, idempotency_key=None, **fields):
+        with self._lock:
+            if idempotency_key:
+                for existing_id, task in self._tasks.items():
+                    if task.get("idempotency_key") == idempotency_key:
+                        return EXISTING, existing_id
+            leader_id = None
+            if request_key:
+                for active_id, task in self._tasks.items():
+                    if (task.get("request_key") == request_key and not task.get("leader_id")
+                            and task["status"] in (QUEUED, PROCESSING)):
+                        leader_id = active_id
+                        fields["status"] = task["status"]
+                        break
+            task = {"status": QUEUED, "updated_at": time.time(), "owner": current_owner(),
+                    "request_key": request_key, "idempotency_key": idempotency_key, "leader_id": leader_id}
+            task.update(fields)
+            self._tasks[task_id] = task
+        self.maybe_evict()
+        return (ATTACHED, leader_id) if leader_id else (CREATED, task_id)
+
+    def followers(self, leader_id):
+        with self._lock:
+            return [task_id for task_id, task in self._tasks.items() if task.get("leader_id") == leader_id]
+
+    def batch_tasks(self, batch_id):
+        with self._lock:
+            return [dict(task, task_id=task_id) for task_id, task in self._tasks.items() if task.get("batch_id") == batch_id]
+
+    def get(self, task_id):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            return dict(task, task_id=task_id) if task is not None else None
+
+    def update(self, task_id, **fields):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None or task["status"] == CANCELLED:
+                return False
+            task.update(fields)
+            task["updated_at"] = time.time()
+            return True
+
+    def cancel(self, task_id, **fields):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None or task["status"] not in (QUEUED, PROCESSING):
+                return False
+            task.update(fields, status=CANCELLED, updated_at=time.time())
+            return True
+
+    def delete(self, task_id):
+        with self._lock:
+            return self._tasks.pop(task_id, None) is not None
+
+    def count(self, status=None, include_batches=True):
+        with self._lock:
+            if status is None:
+                return len(self._tasks)
+            return sum(1 for task in self._tasks.values()
+                       if task["status"] == status and not task.get("leader_id")
+                       and (include_batches or not task.get("batch_id")))
+
+    def queue_position(self, task_id):
+        with self._lock:
+            position = 0
+            for queued_id, task in self._tasks.items():
+                if task["status"] != QUEUED or task.get("leader_id"):
+                    continue
+                if queued_id == task_id:
+                    return position
+                position += 1
+        return None
+
+    def owner_queue(self, task_id):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None or task["status"] != QUEUED or task.get("leader_id"):
+                return None
+            owned = [(queued_id, other) for queued_id, other in self._tasks.items()
+                     if other.get("owner") == task.get("owner") and not other.get("leader_id")]
+            position = [queued_id for queued_id, other in owned if other["status"] == QUEUED].index(task_id)
+            return position, [other.get("started_at") or other["updated_at"] for _, other in owned if other["status"] == PROCESSING]
+
+    def evict_expired(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [task_id for task_id, task in self._tasks.items()
+                       if task["status"] in FINISHED_STATUSES and task["updated_at"] < cutoff]
+            for task_id in expired:
+                del self._tasks[task_id]
+            # 개수 제한: 오래된 완료/실패 작업부터 삭제
+            overflow = len(self._tasks) - self.max_entries
+            if overflow > 0:
+                for task_id in [t for t, task in self._tasks.items() if task["status"] in FINISHED_STATUSES][:overflow]:
+                    del self._tasks[task_id]
+                    expired.append(task_id)
+        return len(expired)
+
+    def fail_orphaned(self):
+        return 0
+
+
+class SQLiteTaskStore(TaskStore):
+    """SQLite 저장소. 같은 DB 파일을 쓰는 모든 uvicorn 워커가 작업 상태를 공유한다"""
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    task_id TEXT UNIQUE NOT NULL,
+                    status TEXT NOT NULL,
+                    scene_descriptor TEXT,
+                    iterations INTEGER,
+                    created_at TEXT,
+                    started_at REAL,
+                    updated_at REAL NOT NULL,
+                    file_path TEXT,
+                    error TEXT,
+                    owner TEXT,
+                    extra TEXT
+                );
+            """)
+            # 이전 버전 DB 에 없는 컬럼 추가
+            existing = {row["name"] for row in conn.execute("PRAGMA table_info(tasks)")}
+            for column in ("request_key", "leader_id", "idempotency_key", "batch_id"):
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE tasks ADD COLUMN {column} TEXT")
+            conn.executescript("""
+                CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, seq);
+                CREATE INDEX IF NOT EXISTS idx_tasks_updated ON tasks (updated_at);
+                CREATE INDEX IF NOT EXISTS idx_tasks_request ON tasks (request_key, status);
+                CREATE INDEX IF NOT EXISTS idx_tasks_leader ON tasks (leader_id);
+                CREATE INDEX IF NOT EXISTS idx_tasks_batch ON tasks (batch_id, seq);
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_tasks_idempotency ON tasks (idempotency_key)
+                    WHERE idempotency_key IS NOT NULL;
+            """)
+
+    def _connect(self):
+        # 스레드마다 연결 하나 (sqlite3 연결은 스레드 간 공유 불가)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _split(fields):
+        columns = {k: v for k, v in fields.items() if k in COLUMNS}
+        extra = {k: v for k, v in fields.items() if k not in COLUMNS and k != "task_id"}
+        return columns, extra
+
+    def _insert(self, conn, task_id, fields):
+        columns, extra = self._split(fields)
+        columns.setdefault("status", QUEUED)
+        columns.setdefault("owner", current_owner())
+        columns["updated_at"] = time.time()
+        names = ["task_id"] + list(columns) + ["extra"]
+        values = [task_id] + list(columns.values()) + [json.dumps(extra)]
+        conn.execute(f"INSERT INTO tasks ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})", values)
+
+    def create(self, task_id, **fields):
+        self._insert(self._connect(), task_id, fields)
+        self.maybe_evict()
+
+    def create_or_attach(self, task_id, request_key=None, idempotency_key=None, **fields):
+        conn = self._connect()
+        # 조회와 생성 사이에 다른 워커가 끼어들지 않도록 쓰기 잠금을 먼저 잡는다
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if idempotency_key:
+                row = conn.execute("SELECT task_id FROM tasks WHERE idempotency_key = ?", (idempotency_key,)).fetchone()
+                if row is not None:
+                    conn.execute("COMMIT")
+                    return EXISTING, row["task_id"]
+            leader = None
+            if request_key:
+                leader = conn.execute("""
+                    SELECT task_id, status FROM tasks
+                    WHERE request_key = ? AND leader_id IS NULL AND status IN (?, ?)
+                    ORDER BY seq LIMIT 1
+                """, (request_key, QUEUED, PROCESSING)).fetchone()
+            if leader is not None:
+                fields["status"] = leader["status"]
+                fields["leader_id"] = leader["task_id"]
+            self._insert(conn, task_id, dict(fields, request_key=request_key, idempotency_key=idempotency_key))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self.maybe_evict()
+        return (ATTACHED, leader["task_id"]) if leader is not None else (CREATED, task_id)
+
+    def followers(self, leader_id):
+        rows = self._connect().execute("SELECT task_id FROM tasks WHERE leader_id = ?", (leader_id,)).fetchall()
+        return [row["task_id"] for row in rows]
+
+    @staticmethod
+    def _row_to_task(row):
+        task = {k: row[k] for k in row.keys() if k not in ("seq", "extra")}
+        if row["extra"]:
+            task.update(json.loads(row["extra"]))
+        return task
+
+    def batch_tasks(self, batch_id):
+        rows = self._connect().execute("SELECT * FROM tasks WHERE batch_id = ? ORDER BY seq", (batch_id,)).fetchall()
+        return [self._row_to_task(row) for row in rows]
+
+    def get(self, task_id):
+        row = self._connect().execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        if row is None:
+            return None
+        return self._row_to_task(row)
+
+    def update(self, task_id, **fields):
+        columns, extra = self._split(fields)
+        columns["updated_at"] = time.time()
+        conn = self._connect()
+        if extra:
+            # extra 는 읽고-합치고-쓰기이므로 트랜잭션으로 묶는다
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT extra FROM tasks WHERE task_id = ? AND status != ?",
+                                   (task_id, CANCELLED)).fetchone()
+                if row is None:
+                    conn.execute("ROLLBACK")
+                    return False
+                merged = json.loads(row["extra"] or "{}")
+                merged.update(extra)
+                columns["extra"] = json.dumps(merged)
+                assignments = ", ".join(f"{k} = ?" for k in columns)
+                conn.execute(f"UPDATE tasks SET {assignments} WHERE task_id = ?", list(columns.values()) + [task_id])
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return True
+        assignments = ", ".join(f"{k} = ?" for k in columns)
+        cursor = conn.execute(f"UPDATE tasks SET {assignments} WHERE task_id = ? AND status != ?",
+                              list(columns.values()) + [task_id, CANCELLED])
+        return cursor.rowcount > 0
+
+    def cancel(self, task_id, **fields):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT extra FROM tasks WHERE task_id = ? AND status IN (?, ?)",
+                               (task_id, QUEUED, PROCESSING)).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return False
+            columns, extra = self._split(fields)
+            merged = json.loads(row["extra"] or "{}")
+            merged.update(extra)
+            columns.update(status=CANCELLED, updated_at=time.time(), extra=json.dumps(merged))
+            assignments = ", ".join(f"{k} = ?" for k in columns)
+            conn.execute(f"UPDATE tasks SET {assignments} WHERE task_id = ?", list(columns.values()) + [task_id])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return True
+
+    def delete(self, task_id):
+        cursor = self._connect().execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+        return cursor.rowcount > 0
+
+    def count(self, status=None, include_batches=True):
+        conn = self._connect()
+        if status is None:
+            return conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+        batch_filter = "" if include_batches else " AND batch_id IS NULL"
+        return conn.execute(f"SELECT COUNT(*) FROM tasks WHERE status = ? AND leader_id IS NULL{batch_filter}",
+                            (status,)).fetchone()[0]
+
+    def queue_position(self, task_id):
+        row = self._connect().execute("""
+            SELECT (SELECT COUNT(*) FROM tasks q WHERE q.status = ? AND q.leader_id IS NULL AND q.seq < t.seq)
+            FROM tasks t WHERE t.task_id = ? AND t.status = ? AND t.leader_id IS NULL
+        """, (QUEUED, task_id, QUEUED)).fetchone()
+        return row[0] if row else None
+
+    def owner_queue(self, task_id):
+        conn = self._connect()
+        row = conn.execute("""
+            SELECT t.owner, (SELECT COUNT(*) FROM tasks q
+                             WHERE q.status = ? AND q.leader_id IS NULL AND q.owner IS t.owner AND q.seq < t.seq)
+            FROM tasks t WHERE t.task_id = ? AND t.status = ? AND t.leader_id IS NULL
+        """, (QUEUED, task_id, QUEUED)).fetchone()
+        if row is None:
+            return None
+        rows = conn.execute(
+            "SELECT COALESCE(started_at, updated_at) FROM tasks WHERE status = ? AND leader_id IS NULL AND owner IS ?",
+            (PROCESSING, row[0])).fetchall()
+        return row[1], [started[0] for started in rows]
+
+    def evict_expired(self):
+        conn = self._connect()
+        placeholders = ", ".join("?" * len(FINISHED_STATUSES))
+        removed = conn.execute(
+            f"DELETE FROM tasks WHERE status IN ({placeholders}) AND updated_at < ?",
+            FINISHED_STATUSES + (time.time() - self.ttl,)).rowcount
+        # 개수 제한: 오래된 완료/실패 작업부터 삭제
+        overflow = self.count() - self.max_entries
+        if overflow > 0:
+            removed += conn.execute(f"""
+                DELETE FROM tasks WHERE seq IN (
+                    SELECT seq FROM tasks WHERE status IN ({placeholders}) ORDER BY seq LIMIT ?)
+            """, FINISHED_STATUSES + (overflow,)).rowcount
+        return removed
+
+    def fail_orphaned(self):
+        rows = self._connect().execute(
+            "SELECT task_id, owner FROM tasks WHERE status IN (?, ?) AND leader_id IS NULL",
+            (QUEUED, PROCESSING)).fetchall()
+        orphaned = [row["task_id"] for row in rows if not _owner_alive(row["owner"])]
+        for task_id in orphaned:
+            for follower_id in [task_id] + self.followers(task_id):
+                self.update(follower_id, status=FAILED, error="Server restarted before the task finished")
+        return len(orphaned)
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def create_task_store():
+    """환경변수 설정에 맞는 저장소 생성"""
+    kwargs = {
+        "ttl": float(os.getenv('SCENE_TASK_TTL', '86400')),
+        "max_entries": int(os.getenv('SCENE_TASK_MAX_ENTRIES', '10000')),
+    }
+    backend = os.getenv('SCENE_TASK_STORE', 'sqlite')
+    if backend == 'memory':
+        return MemoryTaskStore(**kwargs)
+    output_base = os.getenv('SCENE_OUTPUT_DIR', './outputs')
+    path = os.getenv('SCENE_TASK_DB', os.path.join(output_base, 'tasks.db'))
+    return SQLiteTaskStore(path, **kwargs)